@@ -3,10 +3,16 @@
 
 import os
 import sys
+import time
+import asyncio
 import logging
 import platform
+import contextlib
+import importlib.abc
+import importlib.util
 import json
 import secrets
+import tempfile
 
 # Configuration du logging sécurisé
 logging.basicConfig(
@@ -18,28 +24,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger("serve_model")
 
+# Forcer une nouvelle sonde du matériel (empreinte conservée sous CACHE_DIR)
+if "--refresh-hardware" in sys.argv:
+    os.environ["HARDWARE_FINGERPRINT_REFRESH"] = "1"
+
+# Compacter au démarrage un cache créé sans auto_vacuum (VACUUM complet, une seule fois)
+if "--compact-cache" in sys.argv:
+    os.environ["CACHE_COMPACT_ON_START"] = "1"
+
+# Mesure du démarrage sans servir: durée de chaque phase et imports les plus coûteux
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+
 # Génération d'un jeton de sécurité pour les requêtes
 API_TOKEN = os.environ.get("API_TOKEN") or secrets.token_hex(16)
 logger.info(f"Token d'API généré: {API_TOKEN}")
 
-# Affichage des informations système
-system_info = {
-    "platform": platform.platform(),
-    "python_version": platform.python_version(),
-    "system": platform.system(),
-    "machine": platform.machine(),
-    "processor": platform.processor()
-}
-logger.info(f"Informations système: {json.dumps(system_info)}")
-
-# Vérification des dépendances critiques
-try:
-    import fastapi
-    import pydantic
-    import uvicorn
-except ImportError as e:
-    logger.critical(f"Dépendances critiques manquantes: {e}")
-    print(f"ERREUR: Dépendances critiques manquantes: {e}")
+def get_system_info():
+    """Informations système (calculées à la demande: platform.processor() lance un sous-processus)"""
+    return {
+        "platform": platform.platform(),
+        "python_version": platform.python_version(),
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor()
+    }
+
+def module_available(name):
+    """Vérifie qu'un module est installé sans l'importer"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+# Vérification des dépendances critiques (sans les importer: elles le seront au démarrage de l'application)
+missing = [name for name in ("fastapi", "pydantic", "uvicorn") if not module_available(name)]
+if missing:
+    logger.critical(f"Dépendances critiques manquantes: {', '.join(missing)}")
+    print(f"ERREUR: Dépendances critiques manquantes: {', '.join(missing)}")
     print("Exécutez 'pip install fastapi uvicorn pydantic' pour installer les dépendances minimales.")
     print("\nLe serveur va démarrer en mode dégradé...\n")
     # Au lieu de quitter, on passe en mode dégradé
@@ -47,33 +68,128 @@ except ImportError as e:
 else:
     DEGRADED_MODE = False
 
-# Vérification des dépendances optionnelles
-try:
-    import aiohttp
-except ImportError:
-    logger.warning("Package aiohttp manquant, installation...")
-    try:
-        os.system(f"{sys.executable} -m pip install aiohttp>=3.9.5")
-        import aiohttp
-        logger.info("aiohttp installé avec succès")
-    except:
-        logger.warning("Échec de l'installation de aiohttp")
-
-# Vérification de psutil
-try:
-    import psutil
-    PSUTIL_AVAILABLE = True
-    logger.info("psutil détecté avec succès")
-except ImportError:
-    PSUTIL_AVAILABLE = False
-    logger.warning("Package psutil manquant, tentative d'installation...")
+# Vérification des dépendances optionnelles: aucune installation au démarrage,
+# les paquets s'installent avec l'application (requirements.txt)
+if not module_available("aiohttp"):
+    logger.warning(f"Package aiohttp manquant, backends distants indisponibles ('{sys.executable} -m pip install aiohttp>=3.9.5')")
+
+PSUTIL_AVAILABLE = module_available("psutil")
+if not PSUTIL_AVAILABLE:
+    logger.warning(f"Package psutil manquant, l'analyse des ressources sera limitée ('{sys.executable} -m pip install psutil>=5.9.8')")
+
+class _TimedLoader:
+    """Enveloppe d'un loader qui mesure l'exécution du module (temps cumulé et propre)"""
+    
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+    
+    def __getattr__(self, attribute):
+        return getattr(self._loader, attribute)
+    
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+    
+    def exec_module(self, module):
+        stack = self._profiler.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self._profiler.imports[self._name] = (cumulative, cumulative - children)
+
+class StartupProfiler(importlib.abc.MetaPathFinder):
+    """Chronomètre les phases du démarrage et les imports effectués pendant celles-ci"""
+    
+    def __init__(self):
+        self.phases = []
+        self.imports = {}
+        self.stack = []
+        self._searching = set()
+    
+    def find_spec(self, name, path=None, target=None):
+        if name in self._searching:
+            return None
+        self._searching.add(name)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                        spec.loader = _TimedLoader(spec.loader, name, self)
+                    return spec
+            return None
+        finally:
+            self._searching.discard(name)
+    
+    def install(self):
+        sys.meta_path.insert(0, self)
+    
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+    
+    @contextlib.contextmanager
+    def phase(self, label):
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((label, time.perf_counter() - start, len(sys.modules) - modules_before))
+    
+    def report(self, top=15):
+        lines = ["Profil du démarrage:"]
+        for label, duration, modules in self.phases:
+            lines.append(f"  {label:<32} {duration * 1000:9.1f} ms  ({modules} modules importés)")
+        lines.append(f"  {'total':<32} {sum(duration for _, duration, _ in self.phases) * 1000:9.1f} ms")
+        lines.append(f"Imports les plus coûteux (temps propre / cumulé), {len(self.imports)} modules:")
+        ranked = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        for name, (cumulative, own) in ranked:
+            lines.append(f"  {name:<48} {own * 1000:8.1f} ms / {cumulative * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+def profile_startup():
+    """Exécute le démarrage complet sans servir et affiche où passe le temps"""
+    # Le préchargement du modèle se fait en arrière-plan et se suit via /ready
+    os.environ["MODEL_PRELOAD"] = "0"
+    # Données de l'application (cache SQLite, empreinte matérielle, modèles, logs) dans un
+    # répertoire temporaire: le profilage ne modifie pas l'état de la machine. Lu par
+    # server.config, donc avant tout import du serveur
+    with tempfile.TemporaryDirectory(prefix="filechat-profile-", ignore_cleanup_errors=True) as app_data:
+        os.environ["APPDATA"] = app_data
+        profiler = _profile_startup_phases()
+    print(profiler.report())
+
+def _profile_startup_phases():
+    profiler = StartupProfiler()
+    profiler.install()
     try:
-        os.system(f"{sys.executable} -m pip install psutil>=5.9.8")
-        import psutil
-        PSUTIL_AVAILABLE = True
-        logger.info("psutil installé avec succès")
-    except:
-        logger.warning("Échec de l'installation de psutil, l'analyse des ressources sera limitée")
+        with profiler.phase("import server.routes"):
+            from server.routes import init_app
+        with profiler.phase("init_app"):
+            app = init_app()
+        with profiler.phase("middlewares de sécurité"):
+            setup_security_middleware(app)
+        with profiler.phase("startup (cache, sessions, ...)"):
+            asyncio.run(_run_lifecycle(app))
+        with profiler.phase("import uvicorn"):
+            import uvicorn
+    finally:
+        profiler.uninstall()
+    return profiler
+
+async def _run_lifecycle(app):
+    await app.router.startup()
+    await app.router.shutdown()
 
 # Implémentation du middleware de sécurité pour FastAPI
 def setup_security_middleware(app):
@@ -116,6 +232,10 @@ def setup_security_middleware(app):
     return app
 
 if __name__ == "__main__":
+    if PROFILE_STARTUP and not DEGRADED_MODE:
+        profile_startup()
+        sys.exit(0)
+    
     # Mode dégradé: mini-serveur HTTP pour indiquer le statut
     if DEGRADED_MODE:
         try:
@@ -147,7 +267,7 @@ if __name__ == "__main__":
                         self.end_headers()
                         self.wfile.write(json.dumps({
                             "error": "Serveur en mode dégradé. Veuillez installer les dépendances requises.",
-                            "system_info": system_info
+                            "system_info": get_system_info()
                         }).encode())
                 
                 def do_OPTIONS(self):
@@ -179,7 +299,7 @@ if __name__ == "__main__":
             sys.exit(1)
     else:
         # Mode normal avec FastAPI
-        from fastapi import FastAPI
+        import uvicorn
         from server.routes import init_app
         
         # Configuration de l'hôte et du port
@@ -0,0 +1,267 @@
+"""
+Routage des backends de génération selon leur santé: latence (EWMA et
+percentiles), taux de succès et disjoncteurs avec sondes en arrière-plan
+"""
+import asyncio
+import time
+from collections import deque
+from .config import (
+    logger, ROUTER_EWMA_ALPHA, ROUTER_LATENCY_WINDOW, CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN, CIRCUIT_PROBE_INTERVAL, CIRCUIT_PROBE_TIMEOUT,
+    HEDGING_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY, HEDGE_MAX_PER_REQUEST,
+    HEDGE_BUDGET_RATIO, HEDGE_BUDGET_BURST
+)
+
+# États du disjoncteur
+CLOSED = "closed"        # Backend sain: utilisé normalement
+OPEN = "open"            # Échecs répétés: ignoré jusqu'à la fin du délai de repos
+HALF_OPEN = "half_open"  # Délai écoulé: une seule requête d'essai (ou une sonde) autorisée
+
+class BackendHealth:
+    """Santé observée d'un backend"""
+
+    def __init__(self, name, priority, probe_url=None):
+        self.name = name
+        self.priority = priority
+        self.probe_url = probe_url
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.opened_at = None
+        self.trial_started_at = None
+        self.ewma_latency = None
+        self.success_rate = 1.0
+        self.latencies = deque(maxlen=ROUTER_LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+
+    def percentile(self, q):
+        """Percentile q (0-100) des latences récentes, None sans mesure"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def score(self):
+        """Coût estimé d'un appel: latence moyenne pénalisée par le taux d'échec"""
+        if self.ewma_latency is None:
+            return None
+        return self.ewma_latency / max(self.success_rate, 0.05)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "success_rate": round(self.success_rate, 3),
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "p50_ms": round(self.percentile(50) * 1000, 1) if self.latencies else None,
+            "p95_ms": round(self.percentile(95) * 1000, 1) if self.latencies else None,
+            "p99_ms": round(self.percentile(99) * 1000, 1) if self.latencies else None,
+            "cooldown_seconds": self.cooldown if self.state != CLOSED else 0
+        }
+
+class BackendRouter:
+    """
+    Ordonne les backends par santé pour chaque requête. Un backend dont le
+    disjoncteur est ouvert est ignoré immédiatement au lieu de coûter son timeout.
+    """
+
+    def __init__(self):
+        self.backends = {}
+        self._probe_task = None
+
+    def register(self, name, priority, probe_url=None):
+        """Déclare un backend (priorité = ordre de préférence à santé égale)"""
+        if name not in self.backends:
+            self.backends[name] = BackendHealth(name, priority, probe_url)
+        return self.backends[name]
+
+    def _refresh(self, health):
+        """Passe en semi-ouvert un disjoncteur dont le délai de repos est écoulé"""
+        if health.state == OPEN and time.monotonic() - health.opened_at >= health.cooldown:
+            health.state = HALF_OPEN
+            health.trial_started_at = None
+
+    def allow(self, name):
+        """Indique si une requête peut être envoyée au backend maintenant"""
+        health = self.backends.get(name)
+        if health is None:
+            return True
+        self._refresh(health)
+        if health.state == CLOSED:
+            return True
+        if health.state == HALF_OPEN and health.probe_url is None:
+            # Pas de sonde possible: la prochaine requête réelle sert d'essai.
+            # Un essai réservé mais jamais conclu est libéré après un délai de repos.
+            now = time.monotonic()
+            if health.trial_started_at is None or now - health.trial_started_at >= health.cooldown:
+                health.trial_started_at = now
+                return True
+        return False
+
+    def order(self, names):
+        """Backends utilisables, du plus sain au moins sain"""
+        candidates = [name for name in names if self.allow(name)]
+
+        def sort_key(name):
+            health = self.backends.get(name)
+            if health is None:
+                return (0, True, 0.0, 0)
+            score = health.score()
+            # Les backends sans mesure passent après ceux dont la latence est connue
+            # et restent départagés entre eux par leur priorité configurée
+            return (0 if health.state == CLOSED else 1, score is None, score or 0.0, health.priority)
+
+        return sorted(candidates, key=sort_key)
+
+    def record_success(self, name, latency=None):
+        """Enregistre un appel réussi (latence en secondes si pertinente)"""
+        health = self.backends.get(name)
+        if health is None:
+            return
+        health.requests += 1
+        health.success_rate = (1 - ROUTER_EWMA_ALPHA) * health.success_rate + ROUTER_EWMA_ALPHA
+        if latency is not None:
+            health.latencies.append(latency)
+            if health.ewma_latency is None:
+                health.ewma_latency = latency
+            else:
+                health.ewma_latency = (1 - ROUTER_EWMA_ALPHA) * health.ewma_latency + ROUTER_EWMA_ALPHA * latency
+        if health.state != CLOSED:
+            logger.info(f"Backend {name} rétabli, disjoncteur fermé")
+        health.state = CLOSED
+        health.consecutive_failures = 0
+        health.cooldown = CIRCUIT_COOLDOWN
+        health.trial_started_at = None
+
+    def record_failure(self, name):
+        """Enregistre un échec et ouvre le disjoncteur si nécessaire"""
+        health = self.backends.get(name)
+        if health is None:
+            return
+        health.requests += 1
+        health.failures += 1
+        health.consecutive_failures += 1
+        health.success_rate = (1 - ROUTER_EWMA_ALPHA) * health.success_rate
+        health.trial_started_at = None
+
+        if health.state == HALF_OPEN:
+            # L'essai a échoué: délai de repos doublé
+            health.cooldown = min(health.cooldown * 2, CIRCUIT_MAX_COOLDOWN)
+            self._open(health)
+        elif health.state == CLOSED and health.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self._open(health)
+
+    def _open(self, health):
+        health.state = OPEN
+        health.opened_at = time.monotonic()
+        logger.warning(f"Backend {health.name} indisponible, disjoncteur ouvert pour {health.cooldown}s")
+
+    async def _probe(self, health):
+        """Sonde légère d'un backend semi-ouvert"""
+        from aiohttp import ClientTimeout
+        from .http_client import http_sessions
+
+        try:
+            session = await http_sessions.get_session(health.name)
+            async with session.get(
+                health.probe_url, timeout=ClientTimeout(total=CIRCUIT_PROBE_TIMEOUT), raise_for_status=True
+            ):
+                pass
+        except Exception as e:
+            logger.debug(f"Sonde du backend {health.name} en échec: {e}")
+            self.record_failure(health.name)
+        else:
+            # La latence d'une sonde ne reflète pas celle d'une génération
+            self.record_success(health.name)
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(CIRCUIT_PROBE_INTERVAL)
+            for health in list(self.backends.values()):
+                self._refresh(health)
+                if health.state == HALF_OPEN and health.probe_url is not None:
+                    await self._probe(health)
+
+    def start(self):
+        """Démarre les sondes en arrière-plan (à appeler depuis la boucle asyncio)"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop(self):
+        """Arrête les sondes"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def stats(self):
+        return {name: health.stats() for name, health in self.backends.items()}
+
+class HedgingPolicy:
+    """
+    Décide quand lancer un second backend en parallèle d'un backend lent.
+    Le budget global (jetons regagnés à chaque requête) borne la charge ajoutée.
+    """
+
+    def __init__(self, router, enabled=HEDGING_ENABLED, percentile=HEDGE_PERCENTILE,
+                 max_per_request=HEDGE_MAX_PER_REQUEST, budget_ratio=HEDGE_BUDGET_RATIO):
+        self.router = router
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_per_request = max_per_request
+        self.budget_ratio = budget_ratio
+        self._tokens = float(HEDGE_BUDGET_BURST)
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.budget_denied = 0
+
+    def on_request(self):
+        """Compte une génération et crédite le budget de couverture"""
+        self.requests += 1
+        self._tokens = min(float(HEDGE_BUDGET_BURST), self._tokens + self.budget_ratio)
+
+    def delay(self, name):
+        """Délai avant couverture du backend, None s'il ne faut pas le couvrir"""
+        if not self.enabled or self.max_per_request <= 0:
+            return None
+        health = self.router.backends.get(name)
+        if health is None or len(health.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, health.percentile(self.percentile))
+
+    def acquire(self):
+        """Consomme un jeton de couverture si le budget le permet"""
+        if self._tokens < 1:
+            self.budget_denied += 1
+            return False
+        self._tokens -= 1
+        self.hedges += 1
+        return True
+
+    def record_win(self):
+        """Le backend lancé en couverture a répondu le premier"""
+        self.hedges_won += 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "hedge_win_rate": round(self.hedges_won / self.hedges, 3) if self.hedges else 0,
+            "budget_denied": self.budget_denied,
+            "budget_tokens": round(self._tokens, 2)
+        }
+
+# Routeur et politique de couverture partagés par l'application
+backend_router = BackendRouter()
+hedging = HedgingPolicy(backend_router)
@@ -3,12 +3,706 @@ Gestionnaire de cache pour le serveur d'inférence IA
 """
 import os
 import sqlite3
+import threading
 import time
 import hashlib
 import json
 import zlib
 import base64
-from .config import logger, CACHE_DIR, CACHE_DB_PATH, CACHE_ENABLED, CACHE_EXPIRY
+from collections import OrderedDict
+from contextlib import contextmanager
+from .config import (
+    logger, CACHE_DIR, CACHE_DB_PATH, CACHE_ENABLED, CACHE_EXPIRY,
+    CACHE_SQLITE_TIMEOUT, CACHE_SQLITE_MMAP_SIZE, CACHE_SQLITE_CACHE_KB, CACHE_SQLITE_STATEMENTS,
+    CACHE_MEMORY_MAX_ENTRIES, CACHE_MEMORY_MAX_BYTES, CACHE_STATS_FLUSH_INTERVAL,
+    CACHE_MAX_SIZE_MB, CACHE_EVICTION_POLICY, CACHE_EVICTION_BATCH, CACHE_EVICTION_MAX_BATCHES,
+    CACHE_CODEC, CACHE_ZSTD_LEVEL, CACHE_ZSTD_DICT_SIZE, CACHE_ZSTD_TRAIN_SAMPLES, CACHE_ZSTD_MIN_SAMPLES,
+    CACHE_MIGRATION_BATCH, CACHE_NORMALIZE_PROMPTS, CACHE_SIMILAR_ENABLED, CACHE_SIMILARITY_THRESHOLD,
+    CACHE_SIMILAR_MAX_TEMPERATURE, CACHE_SWEEP_BATCH, CACHE_SWEEP_MAX_BATCHES, CACHE_SWEEP_PAUSE,
+    CACHE_VACUUM_INTERVAL, CACHE_VACUUM_PAGES, CACHE_COMPACT_ON_START
+)
+from .prompt_similarity import (
+    normalize_prompt, canonicalize_prompt, minhash_signature, signature_to_bytes, signature_from_bytes,
+    estimate_similarity, lsh_buckets
+)
+
+# Compression zstd optionnelle
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+class CacheEngine:
+    """
+    Moteur SQLite du cache: une connexion longue par thread (mode WAL),
+    requêtes préparées réutilisées et paramètres du cache gardés en mémoire
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (thread propriétaire, connexion)
+        self._generation = 0
+
+        # Copie en mémoire des paramètres de cache_metadata (évite une lecture par requête)
+        self.cache_expiry = CACHE_EXPIRY
+        self.compression_enabled = True
+
+    def _open(self):
+        """Ouvre et configure une nouvelle connexion SQLite"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=CACHE_SQLITE_TIMEOUT,
+            cached_statements=CACHE_SQLITE_STATEMENTS,
+            check_same_thread=False
+        )
+        # Sans effet sur une base existante créée sans auto_vacuum (voir compact_cache)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(CACHE_SQLITE_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA cache_size=-{int(CACHE_SQLITE_CACHE_KB)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # INSERT OR REPLACE doit déclencher les triggers de suppression (agrégats, signatures)
+        conn.execute("PRAGMA recursive_triggers=ON")
+        return conn
+
+    def connection(self):
+        """Retourne la connexion du thread courant (créée au premier appel)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._open()
+            with self._lock:
+                stale = self._prune_dead_threads()
+                self._connections.append((threading.current_thread(), conn))
+                self._local.generation = self._generation
+            self._local.conn = conn
+            self._close(stale)
+        return conn
+
+    def _prune_dead_threads(self):
+        """Retire les connexions des threads terminés (à appeler sous self._lock)"""
+        alive, stale = [], []
+        for thread, conn in self._connections:
+            (alive if thread.is_alive() else stale).append((thread, conn))
+        self._connections = alive
+        return [conn for _, conn in stale]
+
+    def _close(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Cache: fermeture de connexion impossible: {e}")
+
+    def open_connections(self):
+        """Nombre de connexions encore suivies (une par thread vivant)"""
+        with self._lock:
+            return len(self._connections)
+
+    @contextmanager
+    def transaction(self):
+        """Fournit un curseur dans une transaction validée ou annulée automatiquement"""
+        conn = self.connection()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def load_settings(self):
+        """Recharge en mémoire les paramètres stockés dans cache_metadata"""
+        cursor = self.connection().execute(
+            "SELECT key, value FROM cache_metadata WHERE key IN ('cache_expiry', 'compression_enabled')"
+        )
+        settings = dict(cursor.fetchall())
+        self.cache_expiry = int(settings.get("cache_expiry", CACHE_EXPIRY))
+        self.compression_enabled = settings.get("compression_enabled", "1") == "1"
+
+    def disk_usage(self):
+        """Octets réellement occupés par la base (pages utilisées, hors pages libres)"""
+        conn = self.connection()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def close_all(self):
+        """Ferme toutes les connexions ouvertes (arrêt du serveur)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        self._close([conn for _, conn in connections])
+
+class MemoryTier:
+    """
+    Niveau LRU en mémoire devant response_cache, borné en nombre d'entrées
+    et en octets. Les réponses y sont conservées décompressées.
+    """
+
+    def __init__(self, max_entries=CACHE_MEMORY_MAX_ENTRIES, max_bytes=CACHE_MEMORY_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # cache_id -> (response, created_at, user_id, size)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cache_id, user_id, expiry_time):
+        """Retourne la réponse si elle est présente, valide et visible pour l'utilisateur"""
+        with self._lock:
+            entry = self._entries.get(cache_id)
+            if entry is not None:
+                response, created_at, entry_user_id, size = entry
+                if created_at <= expiry_time:
+                    # Entrée expirée: on la retire du niveau mémoire
+                    del self._entries[cache_id]
+                    self.total_bytes -= size
+                elif entry_user_id is None or entry_user_id == user_id:
+                    self._entries.move_to_end(cache_id)
+                    self.hits += 1
+                    return response
+            self.misses += 1
+            return None
+
+    def put(self, cache_id, response, created_at, user_id=None):
+        """Ajoute ou remplace une entrée puis évince les moins récemment utilisées"""
+        size = len(response.encode('utf-8'))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        
+        with self._lock:
+            previous = self._entries.pop(cache_id, None)
+            if previous is not None:
+                self.total_bytes -= previous[3]
+            self._entries[cache_id] = (response, created_at, user_id, size)
+            self.total_bytes += size
+            
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted[3]
+
+    def discard(self, cache_ids):
+        """Retire des entrées du niveau mémoire (entrées évincées du disque)"""
+        with self._lock:
+            for cache_id in cache_ids:
+                entry = self._entries.pop(cache_id, None)
+                if entry is not None:
+                    self.total_bytes -= entry[3]
+
+    def clear(self):
+        """Vide le niveau mémoire et remet ses compteurs à zéro"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Statistiques du niveau mémoire"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_kb": f"{self.total_bytes / 1024:.2f}",
+                "max_entries": self.max_entries,
+                "max_size_kb": f"{self.max_bytes / 1024:.2f}",
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": f"{(self.hits / lookups) * 100 if lookups else 0:.2f}%"
+            }
+
+class CacheCounters:
+    """
+    Compteurs du cache tenus en mémoire et écrits par lots dans cache_metadata,
+    pour que le chemin de lecture reste en lecture seule. Les accès par entrée
+    (last_accessed, hit_count) utilisés par l'éviction sont regroupés de la même façon.
+    """
+
+    # Clés persistées dans cache_metadata (valeurs entières)
+    KEYS = ("hits", "misses", "bytes_served", "decompression_us", "evictions", "similar_hits", "expired_deleted")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(self.KEYS, 0)
+        self._accesses = {}  # cache_id -> [nombre d'accès, dernier accès]
+
+    def increment(self, **deltas):
+        """Ajoute les deltas aux compteurs en attente"""
+        with self._lock:
+            for key, delta in deltas.items():
+                self._pending[key] += delta
+
+    def touch(self, cache_id):
+        """Enregistre un accès à une entrée"""
+        now = int(time.time())
+        with self._lock:
+            access = self._accesses.get(cache_id)
+            if access is None:
+                self._accesses[cache_id] = [1, now]
+            else:
+                access[0] += 1
+                access[1] = now
+
+    def pending(self):
+        """Copie des compteurs pas encore écrits"""
+        with self._lock:
+            return dict(self._pending)
+
+    def reset(self):
+        """Oublie les compteurs en attente (purge du cache)"""
+        with self._lock:
+            self._pending = dict.fromkeys(self.KEYS, 0)
+            self._accesses = {}
+
+    def flush(self):
+        """Écrit les compteurs et les accès en attente en une transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, dict.fromkeys(self.KEYS, 0)
+            accesses, self._accesses = self._accesses, {}
+        
+        deltas = [(int(delta), key) for key, delta in pending.items() if delta]
+        if not deltas and not accesses:
+            return
+        
+        try:
+            with self.engine.transaction() as cursor:
+                cursor.executemany(
+                    "UPDATE cache_metadata SET value = CAST(value AS INTEGER) + ? WHERE key = ?",
+                    deltas
+                )
+                cursor.executemany(
+                    """
+                    UPDATE response_cache 
+                    SET hit_count = hit_count + ?, last_accessed = MAX(COALESCE(last_accessed, 0), ?) 
+                    WHERE id = ?
+                    """,
+                    [(count, last_accessed, cache_id) for cache_id, (count, last_accessed) in accesses.items()]
+                )
+        except Exception as e:
+            # Réinjecter les deltas pour la prochaine tentative (les accès sont abandonnés)
+            self.increment(**pending)
+            logger.error(f"Erreur lors de l'écriture des compteurs du cache: {e}")
+
+class CacheEvictor:
+    """
+    Éviction par lots (LRU ou LFU) quand la base dépasse son budget sur disque.
+    Chaque lot est une petite transaction pour ne jamais bloquer les requêtes.
+    """
+
+    # Ordre de suppression selon la politique
+    ORDER_BY = {
+        "lru": "last_accessed ASC",
+        "lfu": "hit_count ASC, last_accessed ASC",
+    }
+
+    def __init__(self, engine, memory_tier, counters, max_size_mb=CACHE_MAX_SIZE_MB,
+                 policy=CACHE_EVICTION_POLICY, batch_size=CACHE_EVICTION_BATCH,
+                 max_batches=CACHE_EVICTION_MAX_BATCHES):
+        if policy not in self.ORDER_BY:
+            logger.warning(f"Cache: politique d'éviction inconnue '{policy}', utilisation de 'lru'")
+            policy = "lru"
+        self.engine = engine
+        self.memory_tier = memory_tier
+        self.counters = counters
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.policy = policy
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+    def step(self):
+        """Évince au plus max_batches lots tant que le budget est dépassé"""
+        if self.max_bytes <= 0:
+            return 0
+        
+        evicted = 0
+        for _ in range(self.max_batches):
+            if self.engine.disk_usage() <= self.max_bytes:
+                break
+            
+            with self.engine.transaction() as cursor:
+                cursor.execute(
+                    f"SELECT id FROM response_cache ORDER BY {self.ORDER_BY[self.policy]} LIMIT ?",
+                    (self.batch_size,)
+                )
+                cache_ids = [row[0] for row in cursor.fetchall()]
+                if not cache_ids:
+                    break
+                cursor.executemany("DELETE FROM response_cache WHERE id = ?", [(i,) for i in cache_ids])
+            
+            self.memory_tier.discard(cache_ids)
+            self.counters.increment(evictions=len(cache_ids))
+            evicted += len(cache_ids)
+        
+        if evicted:
+            logger.info(f"Cache: {evicted} entrées évincées (politique {self.policy})")
+        return evicted
+
+class ExpirySweeper:
+    """
+    Supprime les entrées expirées par petits lots à débit contrôlé, puis rend
+    périodiquement les pages libérées au système (incremental vacuum)
+    """
+
+    def __init__(self, engine, counters, batch_size=CACHE_SWEEP_BATCH, max_batches=CACHE_SWEEP_MAX_BATCHES,
+                 pause=CACHE_SWEEP_PAUSE, vacuum_interval=CACHE_VACUUM_INTERVAL, vacuum_pages=CACHE_VACUUM_PAGES):
+        self.engine = engine
+        self.counters = counters
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        self.vacuum_interval = vacuum_interval
+        self.vacuum_pages = vacuum_pages
+        self._last_vacuum = time.monotonic()
+
+    def delete_batch(self):
+        """Supprime au plus batch_size entrées expirées (via l'index sur created_at)"""
+        expiry_time = int(time.time()) - self.engine.cache_expiry
+        with self.engine.transaction() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM response_cache WHERE id IN (
+                    SELECT id FROM response_cache WHERE created_at <= ? LIMIT ?
+                )
+                """,
+                (expiry_time, self.batch_size)
+            )
+            deleted = cursor.rowcount
+        if deleted:
+            self.counters.increment(expired_deleted=deleted)
+        return deleted
+
+    def step(self):
+        """Tâche de maintenance: quelques lots de suppression puis, si dû, un incremental vacuum"""
+        deleted = 0
+        for batch in range(self.max_batches):
+            if batch:
+                time.sleep(self.pause)
+            count = self.delete_batch()
+            deleted += count
+            if count < self.batch_size:
+                break
+        
+        if deleted:
+            logger.info(f"Cache: {deleted} entrées expirées supprimées")
+        
+        if time.monotonic() - self._last_vacuum >= self.vacuum_interval:
+            self._last_vacuum = time.monotonic()
+            self.vacuum()
+        return deleted
+
+    def vacuum(self):
+        """Rend au système au plus vacuum_pages pages libres"""
+        conn = self.engine.connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return
+        if conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+            return
+        conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+        conn.commit()
+
+class ResponseCodec:
+    """
+    Encodage des réponses stockées en BLOB: brut ("none"), zlib, ou zstd avec un
+    dictionnaire entraîné sur les réponses en cache. Les anciennes entrées texte
+    zlib + base64 ("zlib-b64") restent lisibles et sont converties par lots.
+    """
+
+    def __init__(self, engine, codec=CACHE_CODEC, zstd_level=CACHE_ZSTD_LEVEL):
+        if codec == "zstd" and not ZSTD_AVAILABLE:
+            logger.warning("Cache: paquet zstandard absent, utilisation de zlib")
+            codec = "zlib"
+        elif codec not in ("zlib", "zstd"):
+            logger.warning(f"Cache: codec inconnu '{codec}', utilisation de zlib")
+            codec = "zlib"
+        self.engine = engine
+        self.codec = codec
+        self.zstd_level = zstd_level
+        self.min_samples = CACHE_ZSTD_MIN_SAMPLES
+        self.dictionaries = {}  # dict_id -> zstandard.ZstdCompressionDict
+        self.active_dict_id = None
+        self.legacy_pending = True
+        # Les (dé)compresseurs zstd ne sont pas thread-safe: un jeu par thread
+        self._local = threading.local()
+
+    def load_dictionaries(self):
+        """Charge les dictionnaires zstd enregistrés; le plus récent devient actif"""
+        if not ZSTD_AVAILABLE:
+            return
+        rows = self.engine.connection().execute(
+            "SELECT id, data FROM cache_dictionaries WHERE codec = 'zstd' ORDER BY id"
+        ).fetchall()
+        self.dictionaries = {row[0]: zstandard.ZstdCompressionDict(row[1]) for row in rows}
+        self.active_dict_id = rows[-1][0] if rows else None
+        self._local = threading.local()
+
+    def _zstd(self, dict_id, compress):
+        """(Dé)compresseur zstd du thread courant pour un dictionnaire donné"""
+        instances = self._local.__dict__.setdefault("zstd", {})
+        instance = instances.get((dict_id, compress))
+        if instance is None:
+            dict_data = self.dictionaries[dict_id] if dict_id is not None else None
+            if compress:
+                instance = zstandard.ZstdCompressor(level=self.zstd_level, dict_data=dict_data)
+            else:
+                instance = zstandard.ZstdDecompressor(dict_data=dict_data)
+            instances[(dict_id, compress)] = instance
+        return instance
+
+    def encode(self, raw, compress=True):
+        """Encode des octets UTF-8; retourne (payload, codec, dict_id)"""
+        if not compress:
+            return raw, "none", None
+        if self.codec == "zstd":
+            dict_id = self.active_dict_id
+            return self._zstd(dict_id, True).compress(raw), "zstd", dict_id
+        return zlib.compress(raw), "zlib", None
+
+    def decode(self, payload, codec, dict_id=None):
+        """Décode une réponse stockée selon son codec"""
+        if codec == "zstd":
+            if dict_id is not None and dict_id not in self.dictionaries:
+                # Dictionnaire entraîné par un autre processus
+                self.load_dictionaries()
+            return self._zstd(dict_id, False).decompress(payload).decode('utf-8')
+        if codec == "zlib":
+            return zlib.decompress(payload).decode('utf-8')
+        if codec == "zlib-b64":
+            return decompress_text(payload)
+        return payload.decode('utf-8') if isinstance(payload, bytes) else payload
+
+    def train_dictionary(self, sample_size=CACHE_ZSTD_TRAIN_SAMPLES):
+        """Entraîne un dictionnaire zstd sur les réponses les plus récentes du cache"""
+        if not ZSTD_AVAILABLE:
+            return None
+        
+        rows = self.engine.connection().execute(
+            "SELECT response, codec, dict_id FROM response_cache ORDER BY created_at DESC LIMIT ?",
+            (sample_size,)
+        ).fetchall()
+        samples = [self.decode(*row).encode('utf-8') for row in rows]
+        if len(samples) < self.min_samples:
+            return None
+        
+        dictionary = zstandard.train_dictionary(CACHE_ZSTD_DICT_SIZE, samples)
+        with self.engine.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO cache_dictionaries (codec, data, samples, created_at) VALUES ('zstd', ?, ?, ?)",
+                (dictionary.as_bytes(), len(samples), int(time.time()))
+            )
+            dict_id = cursor.lastrowid
+        
+        self.dictionaries[dict_id] = dictionary
+        self.active_dict_id = dict_id
+        logger.info(f"Cache: dictionnaire zstd #{dict_id} entraîné sur {len(samples)} réponses")
+        return dict_id
+
+    def maybe_train(self):
+        """Tâche de maintenance: entraîne le premier dictionnaire dès qu'il y a assez de réponses"""
+        if self.codec != "zstd" or self.active_dict_id is not None:
+            return
+        
+        available = self.engine.connection().execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM response_cache LIMIT ?)", (self.min_samples,)
+        ).fetchone()[0]
+        if available < self.min_samples:
+            return
+        
+        try:
+            self.train_dictionary()
+        except zstandard.ZstdError as e:
+            # Échantillon insuffisant pour zstd: réessayer avec davantage de réponses
+            self.min_samples *= 2
+            logger.warning(f"Cache: entraînement du dictionnaire zstd impossible ({e}), nouvel essai à {self.min_samples} réponses")
+
+    def migrate_legacy(self, batch_size=CACHE_MIGRATION_BATCH):
+        """Tâche de maintenance: convertit un lot d'entrées zlib + base64 en BLOB zlib"""
+        if not self.legacy_pending:
+            return 0
+        
+        with self.engine.transaction() as cursor:
+            cursor.execute(
+                "SELECT id, response FROM response_cache WHERE codec = 'zlib-b64' LIMIT ?", (batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                self.legacy_pending = False
+                return 0
+            
+            updates, invalid = [], []
+            for cache_id, response in rows:
+                try:
+                    payload = base64.b64decode(response)
+                    updates.append((payload, len(zlib.decompress(payload)), cache_id))
+                except Exception:
+                    invalid.append((cache_id,))
+            
+            cursor.executemany(
+                "UPDATE response_cache SET response = ?, codec = 'zlib', original_size = ? WHERE id = ?", updates
+            )
+            cursor.executemany("DELETE FROM response_cache WHERE id = ?", invalid)
+        
+        logger.info(f"Cache: {len(updates)} entrées converties en BLOB, {len(invalid)} entrées illisibles supprimées")
+        return len(rows)
+
+class CacheMaintenance:
+    """Thread de maintenance: exécute périodiquement les tâches enregistrées"""
+
+    def __init__(self, interval=CACHE_STATS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.tasks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_task(self, task):
+        """Ajoute une tâche (appelable sans argument) au cycle de maintenance"""
+        self.tasks.append(task)
+
+    def run_once(self):
+        """Exécute un cycle de maintenance"""
+        for task in self.tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Erreur lors de la maintenance du cache ({task.__qualname__}): {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        """Démarre le thread de maintenance"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le thread de maintenance"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+# Agrégats maintenus par triggers sur response_cache: (portée, expression de la clé)
+AGGREGATE_SCOPES = (
+    ("all", "''"),
+    ("model", "COALESCE({row}.model, '')"),
+    ("user", "COALESCE({row}.user_id, '')"),
+    ("codec", "COALESCE({row}.codec, 'none')"),
+)
+
+def _aggregate_statements(row, sign):
+    """Requêtes ajoutant (sign=1) ou retirant (sign=-1) une ligne des agrégats"""
+    statements = []
+    for scope, key in AGGREGATE_SCOPES:
+        statements.append(f"""
+            INSERT INTO cache_aggregates 
+            (scope, key, entries, total_bytes, compressed_entries, compressed_bytes, original_bytes) 
+            VALUES (
+                '{scope}', {key.format(row=row)}, {sign},
+                {sign} * LENGTH({row}.response),
+                {sign} * (CASE WHEN {row}.compressed = 1 THEN 1 ELSE 0 END),
+                {sign} * (CASE WHEN {row}.compressed = 1 THEN LENGTH({row}.response) ELSE 0 END),
+                {sign} * COALESCE({row}.original_size, LENGTH({row}.response))
+            )
+            ON CONFLICT(scope, key) DO UPDATE SET 
+                entries = entries + excluded.entries,
+                total_bytes = total_bytes + excluded.total_bytes,
+                compressed_entries = compressed_entries + excluded.compressed_entries,
+                compressed_bytes = compressed_bytes + excluded.compressed_bytes,
+                original_bytes = original_bytes + excluded.original_bytes;""")
+        if sign < 0:
+            # Lignes vides supprimées: le nombre de lignes suit les clés encore présentes en cache
+            statements.append(f"""
+            DELETE FROM cache_aggregates 
+            WHERE scope = '{scope}' AND key = {key.format(row=row)} AND entries <= 0;""")
+    return "".join(statements)
+
+def _create_aggregates(cursor):
+    """Crée la table d'agrégats, ses triggers et la remplit à partir des entrées existantes"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cache_aggregates'"
+    ).fetchone()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cache_aggregates (
+        scope TEXT,
+        key TEXT,
+        entries INTEGER DEFAULT 0,
+        total_bytes INTEGER DEFAULT 0,
+        compressed_entries INTEGER DEFAULT 0,
+        compressed_bytes INTEGER DEFAULT 0,
+        original_bytes INTEGER DEFAULT 0,
+        PRIMARY KEY (scope, key)
+    )
+    ''')
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_aggregates_scope_entries ON cache_aggregates (scope, entries)")
+    
+    if not exists:
+        # Calcul initial (une seule fois) sur les entrées déjà présentes
+        for scope, key in AGGREGATE_SCOPES:
+            key_sql = key.format(row="response_cache")
+            cursor.execute(f"""
+                INSERT INTO cache_aggregates 
+                (scope, key, entries, total_bytes, compressed_entries, compressed_bytes, original_bytes) 
+                SELECT '{scope}', {key_sql}, COUNT(*), COALESCE(SUM(LENGTH(response)), 0),
+                       SUM(CASE WHEN compressed = 1 THEN 1 ELSE 0 END),
+                       SUM(CASE WHEN compressed = 1 THEN LENGTH(response) ELSE 0 END),
+                       COALESCE(SUM(COALESCE(original_size, LENGTH(response))), 0)
+                FROM response_cache GROUP BY {key_sql}
+            """)
+    else:
+        # Lignes vidées par les versions précédentes des triggers
+        cursor.execute("DELETE FROM cache_aggregates WHERE entries <= 0")
+    
+    # Triggers recréés à chaque démarrage pour suivre les changements de leur définition
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_response_cache_aggregates_{trigger}")
+    cursor.execute(f"""
+        CREATE TRIGGER trg_response_cache_aggregates_insert
+        AFTER INSERT ON response_cache
+        BEGIN {_aggregate_statements("NEW", 1)}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER trg_response_cache_aggregates_delete
+        AFTER DELETE ON response_cache
+        BEGIN {_aggregate_statements("OLD", -1)}
+        END
+    """)
+    # Les mises à jour d'accès (hit_count, last_accessed) ne touchent pas aux agrégats
+    cursor.execute(f"""
+        CREATE TRIGGER trg_response_cache_aggregates_update
+        AFTER UPDATE OF response, compressed, codec, original_size, model, user_id ON response_cache
+        BEGIN {_aggregate_statements("OLD", -1)} {_aggregate_statements("NEW", 1)}
+        END
+    """)
+
+# Composants partagés par toutes les fonctions du module
+_engine = CacheEngine()
+_memory_tier = MemoryTier()
+_counters = CacheCounters(_engine)
+_evictor = CacheEvictor(_engine, _memory_tier, _counters)
+_sweeper = ExpirySweeper(_engine, _counters)
+_codec = ResponseCodec(_engine)
+_maintenance = CacheMaintenance()
+_maintenance.add_task(_counters.flush)
+_maintenance.add_task(_sweeper.step)
+_maintenance.add_task(_evictor.step)
+_maintenance.add_task(_codec.migrate_legacy)
+_maintenance.add_task(_codec.maybe_train)
 
 def init_cache():
     """Initialise le cache SQLite"""
@@ -19,54 +713,150 @@ def init_cache():
     os.makedirs(CACHE_DIR, exist_ok=True)
     
     # Initialiser la base de données SQLite
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    
-    # Créer la table de cache si elle n'existe pas
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS response_cache (
-        id TEXT PRIMARY KEY,
-        prompt TEXT,
-        system_prompt TEXT,
-        model TEXT,
-        response TEXT,
-        created_at INTEGER,
-        temperature REAL,
-        top_p REAL,
-        max_length INTEGER,
-        compressed BOOLEAN DEFAULT 0,
-        user_id TEXT DEFAULT NULL
-    )
-    ''')
-    
-    # Créer la table de métadonnées pour stocker les stats et paramètres du cache
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS cache_metadata (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )
-    ''')
+    with _engine.transaction() as cursor:
+        # Créer la table de cache si elle n'existe pas
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            id TEXT PRIMARY KEY,
+            prompt TEXT,
+            system_prompt TEXT,
+            model TEXT,
+            response TEXT,
+            created_at INTEGER,
+            temperature REAL,
+            top_p REAL,
+            max_length INTEGER,
+            compressed BOOLEAN DEFAULT 0,
+            user_id TEXT DEFAULT NULL,
+            last_accessed INTEGER,
+            hit_count INTEGER DEFAULT 0,
+            codec TEXT DEFAULT 'none',
+            dict_id INTEGER DEFAULT NULL,
+            original_size INTEGER DEFAULT NULL
+        )
+        ''')
+        
+        # Migrer les bases créées avant l'ajout des colonnes d'éviction
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(response_cache)")}
+        if "last_accessed" not in columns:
+            cursor.execute("ALTER TABLE response_cache ADD COLUMN last_accessed INTEGER")
+            cursor.execute("UPDATE response_cache SET last_accessed = created_at")
+        if "hit_count" not in columns:
+            cursor.execute("ALTER TABLE response_cache ADD COLUMN hit_count INTEGER DEFAULT 0")
+        if "codec" not in columns:
+            # Les anciennes entrées compressées sont du texte zlib + base64, converties ensuite par lots
+            cursor.execute("ALTER TABLE response_cache ADD COLUMN codec TEXT DEFAULT 'none'")
+            cursor.execute("ALTER TABLE response_cache ADD COLUMN dict_id INTEGER DEFAULT NULL")
+            cursor.execute("ALTER TABLE response_cache ADD COLUMN original_size INTEGER DEFAULT NULL")
+            cursor.execute("""
+                UPDATE response_cache 
+                SET codec = CASE WHEN compressed = 1 THEN 'zlib-b64' ELSE 'none' END,
+                    original_size = CASE WHEN compressed = 1 THEN NULL ELSE LENGTH(CAST(response AS BLOB)) END
+            """)
+        
+        # Index partiel pour retrouver rapidement les entrées restant à convertir
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_legacy ON response_cache (id) WHERE codec = 'zlib-b64'"
+        )
+        
+        # Dictionnaires de compression zstd entraînés sur les réponses en cache
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT,
+            data BLOB,
+            samples INTEGER,
+            created_at INTEGER
+        )
+        ''')
+        
+        # Index utilisé par la suppression des entrées expirées
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+        
+        # Index utilisés par l'éviction LRU / LFU
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_lru ON response_cache (last_accessed)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_lfu ON response_cache (hit_count, last_accessed)"
+        )
+        
+        # Index des prompts quasi identiques: signatures MinHash et bandes LSH
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prompt_signatures (
+            id TEXT PRIMARY KEY,
+            signature BLOB
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prompt_lsh (
+            band INTEGER,
+            bucket INTEGER,
+            id TEXT
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prompt_lsh_bucket ON prompt_lsh (band, bucket)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prompt_lsh_id ON prompt_lsh (id)")
+        
+        # Les signatures suivent les suppressions de response_cache (expiration, éviction, purge)
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_response_cache_delete_signature
+        AFTER DELETE ON response_cache
+        BEGIN
+            DELETE FROM prompt_signatures WHERE id = OLD.id;
+            DELETE FROM prompt_lsh WHERE id = OLD.id;
+        END
+        ''')
+        
+        # Statistiques en temps constant: agrégats tenus à jour par triggers
+        _create_aggregates(cursor)
+        
+        # Créer la table de métadonnées pour stocker les stats et paramètres du cache
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        
+        # Insérer/mettre à jour les paramètres par défaut s'ils n'existent pas
+        cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)", 
+                     ("cache_expiry", str(CACHE_EXPIRY)))
+        for counter in CacheCounters.KEYS:
+            cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)", 
+                         (counter, "0"))
+        cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)",
+                     ("compression_enabled", "1"))  # Activer la compression par défaut
     
-    # Insérer/mettre à jour les paramètres par défaut s'ils n'existent pas
-    cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)", 
-                 ("cache_expiry", str(CACHE_EXPIRY)))
-    cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)", 
-                 ("hits", "0"))
-    cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)", 
-                 ("misses", "0"))
-    cursor.execute("INSERT OR IGNORE INTO cache_metadata VALUES (?, ?)",
-                 ("compression_enabled", "1"))  # Activer la compression par défaut
+    _engine.load_settings()
+    _codec.load_dictionaries()
+    _codec.legacy_pending = True
     
-    conn.commit()
-    conn.close()
+    # Base antérieure à l'auto_vacuum: le fichier ne rétrécit qu'après un VACUUM complet,
+    # lancé avant le thread de maintenance pour ne pas concurrencer ses écritures
+    if _engine.connection().execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if CACHE_COMPACT_ON_START:
+            compact_cache()
+        else:
+            logger.info("Cache: base créée sans auto_vacuum, relancer avec --compact-cache pour réduire le fichier")
     
-    logger.info(f"Cache initialisé: {CACHE_DB_PATH}")
+    # Les entrées expirées sont supprimées par lots par le thread de maintenance
+    _maintenance.start()
     
-    # Nettoyer les entrées expirées au démarrage
-    clean_expired_entries()
+    logger.info(f"Cache initialisé: {_engine.db_path}")
+
+def close_cache():
+    """Écrit les compteurs et ferme les connexions du cache (à appeler à l'arrêt du serveur)"""
+    _maintenance.stop()
+    _counters.flush()
+    _engine.close_all()
 
 def generate_cache_id(prompt, system_prompt, model, temperature, top_p, max_length, user_id=None):
     """Génère un ID de cache basé sur la requête"""
+    # Les prompts qui ne diffèrent que par la forme Unicode ou les espaces en fin de ligne
+    # partagent le même ID; casse et ponctuation restent significatives
+    if CACHE_NORMALIZE_PROMPTS:
+        prompt = normalize_prompt(prompt)
+        system_prompt = normalize_prompt(system_prompt)
+    
     # Créer une chaîne avec tous les paramètres pertinents
     cache_string = f"{prompt}|{system_prompt}|{model}|{temperature}|{top_p}|{max_length}"
     
@@ -78,7 +868,7 @@ def generate_cache_id(prompt, system_prompt, model, temperature, top_p, max_leng
     return hashlib.sha256(cache_string.encode()).hexdigest()
 
 def compress_text(text):
-    """Compresse le texte en utilisant zlib"""
+    """Compresse le texte en utilisant zlib (ancien format texte base64)"""
     try:
         compressed = zlib.compress(text.encode('utf-8'))
         return base64.b64encode(compressed).decode('ascii')
@@ -87,7 +877,7 @@ def compress_text(text):
         return text
 
 def decompress_text(compressed_text):
-    """Décompresse le texte compressé par zlib"""
+    """Décompresse le texte compressé par zlib (ancien format texte base64)"""
     try:
         decoded = base64.b64decode(compressed_text.encode('ascii'))
         return zlib.decompress(decoded).decode('utf-8')
@@ -95,75 +885,150 @@ def decompress_text(compressed_text):
         logger.error(f"Erreur lors de la décompression: {e}")
         return compressed_text
 
-def is_compression_enabled():
-    """Vérifie si la compression est activée dans les métadonnées"""
-    try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM cache_metadata WHERE key = ?", ("compression_enabled",))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result and result[0] == "1":
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"Erreur lors de la vérification de la compression: {e}")
-        return False
+def _similarity_context(system_prompt, model, temperature, top_p, max_length, user_id=None):
+    """Contexte partagé par des requêtes comparables (tout sauf le prompt)"""
+    return hashlib.sha256(
+        f"{canonicalize_prompt(system_prompt)}|{model}|{temperature}|{top_p}|{max_length}|{user_id}".encode()
+    ).hexdigest()
+
+def _similar_match_allowed(temperature):
+    """La correspondance approchée n'a de sens que pour les générations déterministes"""
+    return CACHE_SIMILAR_ENABLED and temperature is not None and temperature <= CACHE_SIMILAR_MAX_TEMPERATURE
 
-def check_cache(cache_id, user_id=None):
-    """Vérifie si une entrée existe dans le cache et n'a pas expiré"""
+def _index_prompt_signature(cursor, cache_id, prompt, context):
+    """Enregistre la signature MinHash et les bandes LSH d'une entrée"""
+    signature = minhash_signature(canonicalize_prompt(prompt))
+    cursor.execute("DELETE FROM prompt_lsh WHERE id = ?", (cache_id,))
+    cursor.execute(
+        "INSERT OR REPLACE INTO prompt_signatures (id, signature) VALUES (?, ?)",
+        (cache_id, signature_to_bytes(signature))
+    )
+    cursor.executemany(
+        "INSERT INTO prompt_lsh (band, bucket, id) VALUES (?, ?, ?)",
+        [(band, bucket, cache_id) for band, bucket in lsh_buckets(signature, context)]
+    )
+
+def find_similar_cache(prompt, system_prompt, model, temperature, top_p, max_length, user_id=None,
+                       threshold=None, record_miss=False):
+    """
+    Cherche la réponse d'un prompt quasi identique (similarité MinHash >= seuil)
+    pour une génération déterministe. Retourne None si aucune ne convient.
+    Une réponse trouvée compte comme similar_hit (pas comme hit); record_miss
+    compte l'échec ici quand check_cache ne l'a pas déjà fait (un seul événement par requête).
+    """
     if not CACHE_ENABLED:
         return None
+    if not _similar_match_allowed(temperature):
+        if record_miss:
+            _counters.increment(misses=1)
+        return None
+    
+    threshold = CACHE_SIMILARITY_THRESHOLD if threshold is None else threshold
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
+        signature = minhash_signature(canonicalize_prompt(prompt))
+        context = _similarity_context(system_prompt, model, temperature, top_p, max_length, user_id)
+        conn = _engine.connection()
         
-        # Récupérer la durée d'expiration du cache des métadonnées
-        cursor.execute("SELECT value FROM cache_metadata WHERE key = ?", ("cache_expiry",))
-        cache_expiry = int(cursor.fetchone()[0])
+        # Candidats: entrées partageant au moins une bande LSH
+        candidates = set()
+        for band, bucket in lsh_buckets(signature, context):
+            rows = conn.execute("SELECT id FROM prompt_lsh WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(row[0] for row in rows)
         
-        # Calculer le timestamp d'expiration
-        expiry_time = int(time.time()) - cache_expiry
+        best_id, best_score = None, threshold
+        for cache_id in candidates:
+            row = conn.execute("SELECT signature FROM prompt_signatures WHERE id = ?", (cache_id,)).fetchone()
+            if row is None:
+                continue
+            score = estimate_similarity(signature, signature_from_bytes(row[0]))
+            if score >= best_score:
+                best_id, best_score = cache_id, score
         
-        # Préparer la requête de base
-        query = """
-            SELECT response, compressed 
+        result = None
+        if best_id is not None:
+            result = _read_entry(conn, best_id, user_id, int(time.time()) - _engine.cache_expiry)
+        if result is None:
+            if record_miss:
+                _counters.increment(misses=1)
+            return None
+        
+        payload, codec, dict_id, created_at, entry_user_id = result
+        response = _codec.decode(payload, codec, dict_id)
+        _counters.increment(similar_hits=1, bytes_served=len(response.encode('utf-8')))
+        _counters.touch(best_id)
+        _memory_tier.put(best_id, response, created_at, entry_user_id)
+        logger.debug(f"Cache: prompt similaire trouvé ({best_score:.2f}) pour {best_id[:12]}")
+        return response
+    except Exception as e:
+        logger.error(f"Erreur lors de la recherche de prompt similaire: {e}")
+        return None
+
+def is_compression_enabled():
+    """Vérifie si la compression est activée dans les métadonnées"""
+    return _engine.compression_enabled
+
+def _read_entry(conn, cache_id, user_id, expiry_time):
+    """Ligne (response, codec, dict_id, created_at, user_id) d'une entrée valide, sans compteurs"""
+    # Requêtes constantes pour profiter du cache de requêtes préparées
+    if user_id:
+        # Vérifier pour cet utilisateur ou les entrées publiques
+        return conn.execute(
+            """
+            SELECT response, codec, dict_id, created_at, user_id 
             FROM response_cache 
-            WHERE id = ? AND created_at > ?
+            WHERE id = ? AND created_at > ? AND (user_id = ? OR user_id IS NULL)
+            """,
+            (cache_id, expiry_time, user_id)
+        ).fetchone()
+    return conn.execute(
         """
-        params = [cache_id, expiry_time]
-        
-        # Si un user_id est fourni, vérifier pour cet utilisateur ou les entrées publiques
-        if user_id:
-            query += " AND (user_id = ? OR user_id IS NULL)"
-            params.append(user_id)
+        SELECT response, codec, dict_id, created_at, user_id 
+        FROM response_cache 
+        WHERE id = ? AND created_at > ?
+        """,
+        (cache_id, expiry_time)
+    ).fetchone()
+
+def check_cache(cache_id, user_id=None, record_miss=True):
+    """
+    Vérifie si une entrée existe dans le cache et n'a pas expiré. record_miss=False
+    laisse à find_similar_cache le soin de compter l'échec de la requête.
+    """
+    if not CACHE_ENABLED:
+        return None
+    
+    try:
+        # Calculer le timestamp d'expiration
+        expiry_time = int(time.time()) - _engine.cache_expiry
         
-        # Exécuter la requête
-        cursor.execute(query, params)
-        result = cursor.fetchone()
+        # Niveau mémoire d'abord: un hit ici ne touche pas SQLite
+        response = _memory_tier.get(cache_id, user_id, expiry_time)
+        if response is not None:
+            _counters.increment(bytes_served=len(response.encode('utf-8')))
+            _counters.touch(cache_id)
+            return response
         
+        result = _read_entry(_engine.connection(), cache_id, user_id, expiry_time)
         if result:
-            # Incrémenter le compteur de hits
-            cursor.execute("UPDATE cache_metadata SET value = CAST(value AS INTEGER) + 1 WHERE key = 'hits'")
-            conn.commit()
+            payload, codec, dict_id, created_at, entry_user_id = result
             
-            response = result[0]
-            is_compressed = result[1] == 1
+            # Décompresser selon le codec de l'entrée
+            started = time.perf_counter()
+            response = _codec.decode(payload, codec, dict_id)
+            decompression_us = int((time.perf_counter() - started) * 1_000_000) if codec != "none" else 0
             
-            conn.close()
+            # Compteurs en mémoire: aucune écriture SQLite sur le chemin de lecture
+            _counters.increment(hits=1, bytes_served=len(response.encode('utf-8')), decompression_us=decompression_us)
+            _counters.touch(cache_id)
             
-            # Décompresser si nécessaire
-            if is_compressed:
-                response = decompress_text(response)
+            # Promouvoir l'entrée dans le niveau mémoire (lecture traversante)
+            _memory_tier.put(cache_id, response, created_at, entry_user_id)
                 
             return response
         
-        # Incrémenter le compteur de misses
-        cursor.execute("UPDATE cache_metadata SET value = CAST(value AS INTEGER) + 1 WHERE key = 'misses'")
-        conn.commit()
-        conn.close()
+        if record_miss:
+            _counters.increment(misses=1)
         return None
     except Exception as e:
         logger.error(f"Erreur lors de la vérification du cache: {e}")
@@ -175,59 +1040,58 @@ def update_cache(cache_id, prompt, system_prompt, model, response, temperature,
         return
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        
         # Vérifier si la compression est activée
         compression_enabled = is_compression_enabled()
         
-        # Compresser la réponse si la compression est activée
-        stored_response = response
-        if compression_enabled:
-            stored_response = compress_text(response)
+        # Encoder la réponse en BLOB (compressée si la compression est activée)
+        raw = response.encode('utf-8')
+        payload, codec, dict_id = _codec.encode(raw, compression_enabled)
         
         # Insérer ou remplacer l'entrée dans le cache
-        cursor.execute(
-            "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (cache_id, prompt, system_prompt, model, stored_response, int(time.time()), 
-             temperature, top_p, max_length, compression_enabled, user_id)
-        )
+        created_at = int(time.time())
+        with _engine.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO response_cache 
+                (id, prompt, system_prompt, model, response, created_at, temperature, top_p, 
+                 max_length, compressed, user_id, last_accessed, hit_count, codec, dict_id, original_size) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)
+                """,
+                (cache_id, prompt, system_prompt, model, payload, created_at, 
+                 temperature, top_p, max_length, codec != "none", user_id, created_at,
+                 codec, dict_id, len(raw))
+            )
+            
+            # Indexer le prompt pour la correspondance approchée
+            if _similar_match_allowed(temperature):
+                context = _similarity_context(system_prompt, model, temperature, top_p, max_length, user_id)
+                _index_prompt_signature(cursor, cache_id, prompt, context)
         
-        conn.commit()
-        conn.close()
+        # Écriture traversante vers le niveau mémoire
+        _memory_tier.put(cache_id, response, created_at, user_id)
         
         # Logger le ratio de compression si activé
         if compression_enabled:
-            original_size = len(response)
-            compressed_size = len(stored_response)
+            original_size = len(raw)
+            compressed_size = len(payload)
             ratio = (1 - (compressed_size / original_size)) * 100 if original_size > 0 else 0
-            logger.debug(f"Cache: Ratio de compression: {ratio:.2f}% ({original_size} -> {compressed_size} octets)")
+            logger.debug(f"Cache: Ratio de compression {codec}: {ratio:.2f}% ({original_size} -> {compressed_size} octets)")
             
     except Exception as e:
         logger.error(f"Erreur lors de la mise à jour du cache: {e}")
 
 def clean_expired_entries():
-    """Nettoie les entrées expirées du cache"""
+    """Nettoie toutes les entrées expirées du cache, lot par lot"""
     if not CACHE_ENABLED:
         return
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Récupérer la durée d'expiration des métadonnées
-        cursor.execute("SELECT value FROM cache_metadata WHERE key = ?", ("cache_expiry",))
-        cache_expiry = int(cursor.fetchone()[0])
-        
-        # Calculer le timestamp d'expiration
-        expiry_time = int(time.time()) - cache_expiry
-        
-        # Supprimer les entrées expirées
-        cursor.execute("DELETE FROM response_cache WHERE created_at <= ?", (expiry_time,))
-        deleted_count = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+        deleted_count = 0
+        while True:
+            count = _sweeper.delete_batch()
+            deleted_count += count
+            if count < _sweeper.batch_size:
+                break
         
         if deleted_count > 0:
             logger.info(f"Cache: {deleted_count} entrées expirées supprimées")
@@ -235,42 +1099,99 @@ def clean_expired_entries():
     except Exception as e:
         logger.error(f"Erreur lors du nettoyage du cache: {e}")
 
+def compact_cache():
+    """
+    Passe la base en auto_vacuum incrémental et la reconstruit (VACUUM complet).
+    Opération longue sur un gros cache: à lancer hors charge, une seule fois.
+    """
+    if not CACHE_ENABLED:
+        return False
+    
+    try:
+        conn = _engine.connection()
+        size_before = os.path.getsize(_engine.db_path)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        # Le VACUUM passe par le journal WAL: le fichier principal n'est réduit qu'au checkpoint
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        size_after = os.path.getsize(_engine.db_path)
+        logger.info(
+            f"Cache: base compactée ({size_before / (1024 * 1024):.1f} Mo -> {size_after / (1024 * 1024):.1f} Mo), "
+            "auto_vacuum incrémental actif"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Erreur lors du compactage du cache: {e}")
+        return False
+
+# Au-delà, get_cache_stats indique seulement "au moins EXPIRED_COUNT_LIMIT" entrées expirées
+EXPIRED_COUNT_LIMIT = 10000
+
 def get_cache_stats():
     """Récupère les statistiques du cache"""
     if not CACHE_ENABLED:
         return {"enabled": False, "message": "Le cache est désactivé"}
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
+        cursor = _engine.connection().cursor()
         
         # Récupérer les métadonnées du cache
         cursor.execute("SELECT key, value FROM cache_metadata")
         metadata = {row[0]: row[1] for row in cursor.fetchall()}
         
-        # Récupérer le nombre d'entrées
-        cursor.execute("SELECT COUNT(*) FROM response_cache")
-        entry_count = cursor.fetchone()[0]
-        
-        # Récupérer la taille moyenne des réponses
-        cursor.execute("SELECT AVG(LENGTH(response)) FROM response_cache")
-        avg_size = cursor.fetchone()[0]
+        # Agrégats maintenus par triggers: aucune lecture de response_cache
+        cursor.execute("""
+            SELECT scope, key, entries, total_bytes, compressed_entries, compressed_bytes, original_bytes 
+            FROM cache_aggregates WHERE scope IN ('all', 'model', 'codec') AND entries > 0
+        """)
+        aggregates = {"all": {}, "model": {}, "codec": {}}
+        for scope, key, entries, total_bytes, compressed_entries, compressed_bytes, original_bytes in cursor.fetchall():
+            aggregates[scope][key] = {
+                "entries": entries,
+                "total_bytes": total_bytes,
+                "compressed_entries": compressed_entries,
+                "compressed_bytes": compressed_bytes,
+                "original_bytes": original_bytes
+            }
+        totals = aggregates["all"].get("", {})
+        entry_count = totals.get("entries", 0)
+        total_size = totals.get("total_bytes", 0)
+        avg_size = total_size / entry_count if entry_count else 0
+        compressed_count = totals.get("compressed_entries", 0)
+        avg_compressed_size = totals.get("compressed_bytes", 0) / compressed_count if compressed_count else 0
         
-        # Récupérer l'utilisation d'espace total
-        cursor.execute("SELECT SUM(LENGTH(response)) FROM response_cache")
-        total_size = cursor.fetchone()[0] or 0
+        # Ratio de compression effectif par codec
+        codecs = {
+            codec: {
+                "entries": values["entries"],
+                "stored_kb": f"{values['total_bytes'] / 1024:.2f}",
+                "original_kb": f"{values['original_bytes'] / 1024:.2f}",
+                "compression_ratio": round(values["original_bytes"] / values["total_bytes"], 2) if values["total_bytes"] else 0
+            }
+            for codec, values in aggregates["codec"].items()
+        }
         
-        # Récupérer des stats sur la compression
-        cursor.execute("SELECT COUNT(*), AVG(LENGTH(response)) FROM response_cache WHERE compressed = 1")
-        compressed_result = cursor.fetchone()
-        compressed_count = compressed_result[0] if compressed_result else 0
-        avg_compressed_size = compressed_result[1] if compressed_result else 0
+        # Répartition par modèle et par utilisateur (utilisateurs les plus présents)
+        by_model = {
+            model: {"entries": values["entries"], "size_kb": f"{values['total_bytes'] / 1024:.2f}"}
+            for model, values in aggregates["model"].items()
+        }
+        cursor.execute(
+            "SELECT key, entries, total_bytes FROM cache_aggregates "
+            "WHERE scope = 'user' AND key != '' AND entries > 0 ORDER BY entries DESC LIMIT 20"
+        )
+        by_user = {
+            row[0]: {"entries": row[1], "size_kb": f"{row[2] / 1024:.2f}"}
+            for row in cursor.fetchall()
+        }
         
-        # Récupérer le nombre d'entrées expirées (mais pas encore supprimées)
-        cursor.execute("SELECT value FROM cache_metadata WHERE key = ?", ("cache_expiry",))
-        cache_expiry = int(cursor.fetchone()[0])
+        # Nombre d'entrées expirées pas encore supprimées (borné, via l'index sur created_at)
+        cache_expiry = int(metadata.get("cache_expiry", CACHE_EXPIRY))
         expiry_time = int(time.time()) - cache_expiry
-        cursor.execute("SELECT COUNT(*) FROM response_cache WHERE created_at <= ?", (expiry_time,))
+        cursor.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM response_cache WHERE created_at <= ? LIMIT ?)",
+            (expiry_time, EXPIRED_COUNT_LIMIT)
+        )
         expired_count = cursor.fetchone()[0]
         
         # Récupérer les 5 entrées les plus récentes (pour debugging)
@@ -287,11 +1208,23 @@ def get_cache_stats():
             for row in cursor.fetchall()
         ]
         
-        conn.close()
+        cursor.close()
+        
+        # Compteurs persistés + compteurs en attente d'écriture
+        counters = {
+            key: int(metadata.get(key, 0)) + delta
+            for key, delta in _counters.pending().items()
+        }
         
-        # Calculer le taux de succès du cache (hits / (hits + misses))
-        hits = int(metadata.get("hits", 0))
-        misses = int(metadata.get("misses", 0))
+        # Calculer le taux de succès du cache SQLite (hits / (hits + misses))
+        disk_hits = counters["hits"]
+        misses = counters["misses"]
+        disk_hit_rate = (disk_hits / (disk_hits + misses)) * 100 if (disk_hits + misses) > 0 else 0
+        
+        # Taux de succès global, niveau mémoire inclus
+        memory_stats = _memory_tier.stats()
+        # Réponses de prompts quasi identiques comprises (un seul événement par requête)
+        hits = disk_hits + memory_stats["hits"] + counters["similar_hits"]
         hit_rate = (hits / (hits + misses)) * 100 if (hits + misses) > 0 else 0
         
         return {
@@ -301,14 +1234,36 @@ def get_cache_stats():
             "hits": hits,
             "misses": misses,
             "hit_rate": f"{hit_rate:.2f}%",
+            "bytes_served": counters["bytes_served"],
+            "avg_decompression_ms": (counters["decompression_us"] / disk_hits / 1000) if disk_hits else 0,
             "avg_response_size": avg_size or 0,
             "total_size_kb": f"{total_size / 1024:.2f}",
-            "expiry_seconds": int(metadata.get("cache_expiry", CACHE_EXPIRY)),
+            "expiry_seconds": cache_expiry,
             "compression_enabled": metadata.get("compression_enabled") == "1",
             "compressed_entries": compressed_count,
             "avg_compressed_size": avg_compressed_size or 0, 
+            "codec": _codec.codec,
+            "zstd_dictionary": _codec.active_dict_id,
+            "codecs": codecs,
+            "by_model": by_model,
+            "by_user": by_user,
             "expired_entries": expired_count,
-            "recent_entries": recent_entries
+            "expired_deleted": counters["expired_deleted"],
+            "disk_usage_kb": f"{_engine.disk_usage() / 1024:.2f}",
+            "max_size_mb": CACHE_MAX_SIZE_MB,
+            "eviction_policy": _evictor.policy,
+            "evictions": counters["evictions"],
+            "similar_matching": CACHE_SIMILAR_ENABLED,
+            "similar_hits": counters["similar_hits"],
+            "recent_entries": recent_entries,
+            "tiers": {
+                "memory": memory_stats,
+                "disk": {
+                    "hits": disk_hits,
+                    "misses": misses,
+                    "hit_rate": f"{disk_hit_rate:.2f}%"
+                }
+            }
         }
     except Exception as e:
         logger.error(f"Erreur lors de la récupération des statistiques du cache: {e}")
@@ -320,17 +1275,13 @@ def toggle_compression(enabled=True):
         return False
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        
         # Mettre à jour le paramètre de compression
-        cursor.execute(
-            "UPDATE cache_metadata SET value = ? WHERE key = 'compression_enabled'", 
-            ("1" if enabled else "0",)
-        )
-        
-        conn.commit()
-        conn.close()
+        with _engine.transaction() as cursor:
+            cursor.execute(
+                "UPDATE cache_metadata SET value = ? WHERE key = 'compression_enabled'", 
+                ("1" if enabled else "0",)
+            )
+        _engine.compression_enabled = enabled
         
         logger.info(f"Cache: Compression {'activée' if enabled else 'désactivée'}")
         return True
@@ -344,17 +1295,13 @@ def set_cache_ttl(ttl_seconds):
         return False
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        
         # Mettre à jour le TTL
-        cursor.execute(
-            "UPDATE cache_metadata SET value = ? WHERE key = 'cache_expiry'", 
-            (str(ttl_seconds),)
-        )
-        
-        conn.commit()
-        conn.close()
+        with _engine.transaction() as cursor:
+            cursor.execute(
+                "UPDATE cache_metadata SET value = ? WHERE key = 'cache_expiry'", 
+                (str(ttl_seconds),)
+            )
+        _engine.cache_expiry = int(ttl_seconds)
         
         logger.info(f"Cache: TTL défini à {ttl_seconds} secondes")
         return True
@@ -368,19 +1315,19 @@ def purge_cache():
         return False
     
     try:
-        conn = sqlite3.connect(CACHE_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Supprimer toutes les entrées
-        cursor.execute("DELETE FROM response_cache")
-        deleted_count = cursor.rowcount
-        
-        # Réinitialiser les compteurs
-        cursor.execute("UPDATE cache_metadata SET value = '0' WHERE key = 'hits'")
-        cursor.execute("UPDATE cache_metadata SET value = '0' WHERE key = 'misses'")
+        with _engine.transaction() as cursor:
+            # Supprimer toutes les entrées
+            cursor.execute("DELETE FROM response_cache")
+            deleted_count = cursor.rowcount
+            
+            # Réinitialiser les compteurs
+            cursor.executemany(
+                "UPDATE cache_metadata SET value = '0' WHERE key = ?",
+                [(counter,) for counter in CacheCounters.KEYS]
+            )
+        _counters.reset()
         
-        conn.commit()
-        conn.close()
+        _memory_tier.clear()
         
         logger.info(f"Cache: {deleted_count} entrées supprimées (cache vidé)")
         return True
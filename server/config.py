@@ -4,7 +4,7 @@ Configuration pour le serveur d'inférence
 """
 import os
 import logging
-import json
+import importlib.util
 from pathlib import Path
 
 # Configuration du logging
@@ -18,11 +18,12 @@ logging.basicConfig(
 logger = logging.getLogger("ia-server")
 
 # Initialisation des objets globaux
-model = None
-tokenizer = None
 MODEL_LOADED = False
 FALLBACK_MODE = False  # Mode léger pour le démarrage rapide sans modèle local
 
+# Dépendances optionnelles (détectées sans être importées)
+PSUTIL_AVAILABLE = importlib.util.find_spec("psutil") is not None
+
 # Configuration des chemins
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 HOME_DIR = os.path.expanduser("~")
@@ -31,11 +32,7 @@ CACHE_DIR = os.path.join(APP_DATA, "filechat")
 MODELS_DIR = os.path.join(CACHE_DIR, "models")
 LOG_DIR = os.path.join(CACHE_DIR, "logs")
 
-# Créer les répertoires s'ils n'existent pas
-for dir_path in [CACHE_DIR, MODELS_DIR, LOG_DIR]:
-    os.makedirs(dir_path, exist_ok=True)
-
-# Modèle par défaut (peut être modifié via la configuration)
+# Modèle par défaut (remplacé par celui de model_config.json, lu au premier besoin)
 DEFAULT_MODEL = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
 
 # Configuration du cache
@@ -43,29 +40,136 @@ CACHE_ENABLED = True
 CACHE_DB_PATH = os.path.join(CACHE_DIR, "response_cache.db")
 CACHE_EXPIRY = 86400  # TTL par défaut: 24 heures en secondes
 
-# Fonctions utilitaires
-def load_model_config():
-    """Charge la configuration du modèle"""
-    config_path = os.path.join(CACHE_DIR, "model_config.json")
-    
-    try:
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"Erreur lors du chargement de la configuration: {str(e)}")
-    
-    return {
-        "default_model": DEFAULT_MODEL,
-        "config": {}
-    }
-
-# Tentative de chargement de la configuration
-model_config = load_model_config()
-if "default_model" in model_config:
-    DEFAULT_MODEL = model_config["default_model"]
-
-# Log de la configuration
-logger.info(f"Démarrage du serveur avec le modèle: {DEFAULT_MODEL}")
-logger.info(f"Répertoire de cache: {CACHE_DIR}")
-logger.info(f"Cache SQLite: {CACHE_ENABLED}, TTL: {CACHE_EXPIRY}s")
+# Réglages SQLite du cache (connexions longues en mode WAL)
+CACHE_SQLITE_TIMEOUT = float(os.environ.get("CACHE_SQLITE_TIMEOUT", 5.0))
+CACHE_SQLITE_MMAP_SIZE = int(os.environ.get("CACHE_SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # 256 Mo
+CACHE_SQLITE_CACHE_KB = int(os.environ.get("CACHE_SQLITE_CACHE_KB", 16 * 1024))  # 16 Mo de pages en mémoire
+CACHE_SQLITE_STATEMENTS = 64  # Requêtes préparées conservées par connexion
+
+# Niveau mémoire (LRU) placé devant le cache SQLite
+CACHE_MEMORY_MAX_ENTRIES = int(os.environ.get("CACHE_MEMORY_MAX_ENTRIES", 1024))
+CACHE_MEMORY_MAX_BYTES = int(os.environ.get("CACHE_MEMORY_MAX_BYTES", 32 * 1024 * 1024))  # 32 Mo
+
+# Intervalle de maintenance du cache: écriture des compteurs (hits, misses...) puis éviction
+CACHE_STATS_FLUSH_INTERVAL = int(os.environ.get("CACHE_STATS_FLUSH_INTERVAL", 30))  # secondes
+
+# Taille maximale du cache sur disque et politique d'éviction ("lru" ou "lfu")
+CACHE_MAX_SIZE_MB = int(os.environ.get("CACHE_MAX_SIZE_MB", 512))  # 0 = illimité
+CACHE_EVICTION_POLICY = os.environ.get("CACHE_EVICTION_POLICY", "lru").lower()
+CACHE_EVICTION_BATCH = 200  # Entrées supprimées par transaction
+CACHE_EVICTION_MAX_BATCHES = 10  # Lots maximum par cycle de maintenance
+
+# Suppression progressive des entrées expirées et réduction du fichier (incremental vacuum)
+CACHE_SWEEP_BATCH = 500  # Entrées expirées supprimées par transaction
+CACHE_SWEEP_MAX_BATCHES = 20  # Lots maximum par cycle de maintenance
+CACHE_SWEEP_PAUSE = 0.05  # Pause entre deux lots (secondes) pour laisser passer les écritures
+CACHE_VACUUM_INTERVAL = int(os.environ.get("CACHE_VACUUM_INTERVAL", 600))  # secondes
+CACHE_VACUUM_PAGES = 1000  # Pages libres rendues au système par passe
+# Compactage complet au démarrage d'une base créée sans auto_vacuum (serve_model.py --compact-cache)
+CACHE_COMPACT_ON_START = os.environ.get("CACHE_COMPACT_ON_START", "0") == "1"
+
+# Codec de compression des réponses ("zlib" ou "zstd", ce dernier requiert le paquet zstandard)
+CACHE_CODEC = os.environ.get("CACHE_CODEC", "zlib").lower()
+CACHE_ZSTD_LEVEL = int(os.environ.get("CACHE_ZSTD_LEVEL", 3))
+CACHE_ZSTD_DICT_SIZE = 16 * 1024  # Taille du dictionnaire entraîné (octets)
+CACHE_ZSTD_TRAIN_SAMPLES = 1000  # Réponses échantillonnées pour l'entraînement
+CACHE_ZSTD_MIN_SAMPLES = 100  # Réponses nécessaires avant d'entraîner un dictionnaire
+CACHE_MIGRATION_BATCH = 500  # Anciennes entrées (zlib + base64) converties par cycle
+
+# Normalisation des prompts (Unicode NFC, fins de ligne, espaces en fin de ligne) avant le calcul de l'ID de cache
+CACHE_NORMALIZE_PROMPTS = os.environ.get("CACHE_NORMALIZE_PROMPTS", "1") == "1"
+
+# Correspondance de prompts quasi identiques (MinHash/LSH), réservée aux générations déterministes
+CACHE_SIMILAR_ENABLED = os.environ.get("CACHE_SIMILAR_ENABLED", "0") == "1"
+CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("CACHE_SIMILARITY_THRESHOLD", 0.9))
+CACHE_SIMILAR_MAX_TEMPERATURE = float(os.environ.get("CACHE_SIMILAR_MAX_TEMPERATURE", 0.3))
+
+# Pool de connexions HTTP vers les backends de génération (une session par backend)
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", 100))  # Connexions simultanées par backend
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", 300))  # secondes
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", 60))  # secondes
+
+# Routage des backends: moyenne mobile des latences et disjoncteurs
+ROUTER_EWMA_ALPHA = 0.2  # Poids de la dernière mesure dans les moyennes mobiles
+ROUTER_LATENCY_WINDOW = 200  # Latences conservées par backend pour les percentiles
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 3))  # Échecs consécutifs avant ouverture
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN", 10))  # Délai avant un nouvel essai (secondes)
+CIRCUIT_MAX_COOLDOWN = 300  # Délai maximum après des essais échoués (secondes)
+CIRCUIT_PROBE_INTERVAL = 2  # Fréquence de vérification des backends à sonder (secondes)
+CIRCUIT_PROBE_TIMEOUT = 2  # Timeout d'une sonde (secondes)
+
+# Requêtes couvertes (hedging): second backend lancé si le premier dépasse son percentile de latence
+HEDGING_ENABLED = os.environ.get("HEDGING_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = 20  # Latences observées nécessaires avant de couvrir un backend
+HEDGE_MIN_DELAY = 0.05  # Délai minimum avant couverture (secondes)
+HEDGE_MAX_PER_REQUEST = 1  # Requêtes supplémentaires maximum par génération
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", 0.1))  # Part maximale de requêtes couvertes
+HEDGE_BUDGET_BURST = 10  # Couvertures pouvant être accumulées
+
+# Regroupement en lots des requêtes concurrentes pour le modèle local
+LOCAL_BATCH_MAX_SIZE = int(os.environ.get("LOCAL_BATCH_MAX_SIZE", 8))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.environ.get("LOCAL_BATCH_MAX_WAIT_MS", 10))
+
+# File d'attente du worker d'inférence locale (au-delà: 503 + Retry-After)
+INFERENCE_QUEUE_MAX = int(os.environ.get("INFERENCE_QUEUE_MAX", 32))
+INFERENCE_RETRY_AFTER = int(os.environ.get("INFERENCE_RETRY_AFTER", 5))  # Valeur par défaut sans mesure
+INFERENCE_DISCONNECT_POLL = 0.5  # Intervalle de détection des clients déconnectés (secondes)
+MODEL_LOAD_QUEUE_MAX = int(os.environ.get("MODEL_LOAD_QUEUE_MAX", 2))  # Chargements de modèles distincts en attente
+
+# Cache des past_key_values des préfixes fréquents (gabarit + prompt système)
+PREFIX_CACHE_MAX_MB = int(os.environ.get("PREFIX_CACHE_MAX_MB", 256))  # 0 = désactivé
+PREFIX_CACHE_MIN_TOKENS = int(os.environ.get("PREFIX_CACHE_MIN_TOKENS", 16))  # Préfixes plus courts ignorés
+PREFIX_CACHE_MIN_USES = int(os.environ.get("PREFIX_CACHE_MIN_USES", 2))  # Occurrences avant mise en cache
+PREFIX_CACHE_TRACKED = 1024  # Préfixes candidats suivis au maximum
+
+# Modèles locaux résidents (plusieurs modèles gardés en mémoire, éviction LRU)
+MODEL_MEMORY_BUDGET_GB = float(os.environ.get("MODEL_MEMORY_BUDGET_GB", 0))  # 0 = part de la mémoire détectée
+MODEL_MEMORY_BUDGET_FRACTION = float(os.environ.get("MODEL_MEMORY_BUDGET_FRACTION", 0.8))
+MODEL_MAX_RESIDENT = int(os.environ.get("MODEL_MAX_RESIDENT", 3))
+
+# Précision des poids sur CPU: auto (selon la mémoire disponible), float32, int8 ou 4bit
+MODEL_CPU_PRECISION = os.environ.get("MODEL_CPU_PRECISION", "auto").lower()
+CPU_FLOAT32_MIN_MEMORY_GB = float(os.environ.get("CPU_FLOAT32_MIN_MEMORY_GB", 32))  # En dessous: int8
+CPU_INT8_MIN_MEMORY_GB = float(os.environ.get("CPU_INT8_MIN_MEMORY_GB", 12))  # En dessous: 4 bits
+CPU_MEMORY_HEADROOM = float(os.environ.get("CPU_MEMORY_HEADROOM", 1.3))  # Marge sur l'empreinte estimée (activations, cache KV)
+BNB_CPU_MIN_VERSION = (0, 46)  # Première version de bitsandbytes exécutant le 4 bits sur CPU
+
+# Modèles GGUF (llama.cpp): poids quantifiés projetés en mémoire (mmap)
+GGUF_QUANTIZATION = os.environ.get("GGUF_QUANTIZATION", "Q4_K_M")  # Fichier préféré dans un dépôt GGUF
+GGUF_CONTEXT_SIZE = int(os.environ.get("GGUF_CONTEXT_SIZE", 4096))
+GGUF_THREADS = int(os.environ.get("GGUF_THREADS", 0))  # 0 = déduit des ressources système
+GGUF_BATCH_SIZE = int(os.environ.get("GGUF_BATCH_SIZE", 512))  # Jetons de prompt traités par passe
+GGUF_USE_MLOCK = os.environ.get("GGUF_USE_MLOCK", "0") == "1"
+
+# Téléchargement des modèles: fichiers et plages d'octets en parallèle, reprise et SHA-256
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))
+DOWNLOAD_CHUNK_SIZE_MB = int(os.environ.get("DOWNLOAD_CHUNK_SIZE_MB", 32))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", 30))  # secondes sans données
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Échantillonnage des ressources système en arrière-plan
+RESOURCE_SAMPLE_INTERVAL = float(os.environ.get("RESOURCE_SAMPLE_INTERVAL", 2))  # secondes
+RESOURCE_SAMPLE_WINDOW = int(os.environ.get("RESOURCE_SAMPLE_WINDOW", 15))  # Mesures lissées (médiane)
+
+# Empreinte matérielle conservée sur disque (1 = sonder à nouveau au démarrage)
+HARDWARE_FINGERPRINT_REFRESH = os.environ.get("HARDWARE_FINGERPRINT_REFRESH", "0") == "1"
+
+# Préchargement du modèle au démarrage (sinon chargement à la première requête)
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "0") == "1"
+MODEL_WARMUP_RUNS = int(os.environ.get("MODEL_WARMUP_RUNS", 2))  # Générations factices après chargement
+MODEL_WARMUP_TOKENS = int(os.environ.get("MODEL_WARMUP_TOKENS", 8))
+
+# Fonctions utilitaires (rien n'est créé ni lu à l'import: démarrage rapide)
+def ensure_directories():
+    """Crée les répertoires de données s'ils n'existent pas"""
+    for dir_path in [CACHE_DIR, MODELS_DIR, LOG_DIR]:
+        os.makedirs(dir_path, exist_ok=True)
+
+def log_configuration(default_model):
+    """Journalise la configuration effective au démarrage du serveur"""
+    logger.info(f"Démarrage du serveur avec le modèle: {default_model}")
+    logger.info(f"Répertoire de cache: {CACHE_DIR}")
+    logger.info(f"Cache SQLite: {CACHE_ENABLED}, TTL: {CACHE_EXPIRY}s")
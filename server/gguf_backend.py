@@ -0,0 +1,136 @@
+"""
+Backend d'inférence GGUF via llama.cpp (llama-cpp-python): les poids quantifiés
+sont projetés en mémoire (mmap), partagés par le cache de pages du système
+"""
+import glob
+import os
+from .config import (
+    logger, MODELS_DIR, GGUF_QUANTIZATION, GGUF_CONTEXT_SIZE, GGUF_THREADS, GGUF_BATCH_SIZE,
+    GGUF_USE_MLOCK, PREFIX_CACHE_MAX_MB
+)
+from .model_store import model_store
+
+def is_gguf_model(model_name):
+    """Indique si le modèle est distribué au format GGUF (dépôt *-GGUF ou fichier .gguf)"""
+    return model_name.lower().endswith(".gguf") or "gguf" in model_name.lower().rsplit("/", 1)[-1]
+
+def _is_relative_name(name):
+    """Nom relatif sans remontée: ni chemin absolu, ni lecteur, ni composant '..'"""
+    return not (os.path.isabs(name) or os.path.splitdrive(name)[0] or ".." in name.replace("\\", "/").split("/"))
+
+def _resolve_in_models_dir(file_name):
+    """Fichier .gguf de MODELS_DIR, None s'il est absent ou résolu hors du répertoire (lien symbolique)"""
+    root = os.path.realpath(MODELS_DIR)
+    path = os.path.realpath(os.path.join(root, *file_name.replace("\\", "/").split("/")))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        return None
+    return path
+
+def find_gguf_file(model_name, huggingface_cache):
+    """
+    Fichier .gguf local du modèle: fichier de MODELS_DIR, magasin de modèles
+    ou cache Hugging Face. La quantification GGUF_QUANTIZATION est préférée.
+    Le nom vient des requêtes: aucun fichier hors de ces répertoires n'est chargé.
+    """
+    if not _is_relative_name(model_name):
+        logger.warning(f"Nom de modèle GGUF refusé: {model_name}")
+        return None
+    if model_name.lower().endswith(".gguf"):
+        return _resolve_in_models_dir(model_name)
+    
+    # Magasin de modèles (manifeste), sinon instantanés du cache Hugging Face
+    candidates = sorted(model_store.files(model_name, ".gguf"))
+    if not candidates:
+        repo_dir = glob.escape(model_name.replace("/", "--"))
+        candidates = sorted(glob.glob(os.path.join(huggingface_cache, f"models--{repo_dir}", "snapshots", "*", "*.gguf")))
+    if not candidates:
+        return None
+    
+    preferred = [path for path in candidates if GGUF_QUANTIZATION.lower() in os.path.basename(path).lower()]
+    # À défaut, le plus petit fichier (quantification la plus forte)
+    return preferred[0] if preferred else min(candidates, key=os.path.getsize)
+
+def thread_counts(system_resources):
+    """
+    Threads llama.cpp: la génération est limitée par la bande passante mémoire et
+    ralentit au-delà des cœurs physiques; le traitement du prompt profite des cœurs logiques
+    """
+    logical = system_resources.get("cpu_count_logical") or os.cpu_count() or 1
+    physical = system_resources.get("cpu_count_physical") or max(1, logical // 2)
+    
+    if GGUF_THREADS > 0:
+        return GGUF_THREADS, max(GGUF_THREADS, logical)
+    
+    threads = physical
+    # Machine déjà chargée: laisser des cœurs aux autres processus
+    cpu_percent = system_resources.get("cpu_percent")
+    if cpu_percent is not None and cpu_percent > 50:
+        threads = max(1, threads // 2)
+    return threads, logical
+
+class GGUFModel:
+    """Modèle GGUF chargé par llama.cpp, exposé au regroupeur comme un modèle local"""
+
+    def __init__(self, llama, path, n_threads, n_threads_batch, gpu_layers):
+        self.llama = llama
+        self.path = path
+        self.n_threads = n_threads
+        self.n_threads_batch = n_threads_batch
+        self.device = "gpu" if gpu_layers else "cpu"
+        self.quantization = os.path.basename(path).rsplit(".", 1)[0].rsplit(".", 1)[-1].rsplit("-", 1)[-1]
+
+    def memory_footprint(self):
+        """Taille des poids projetés en mémoire (partagés via le cache de pages)"""
+        return os.path.getsize(self.path)
+
+    def generate_batch(self, requests):
+        """Génère les réponses d'un lot, séquentiellement (llama.cpp traite une séquence à la fois)"""
+        from .local_inference import build_prompt
+        
+        outputs = []
+        for request in requests:
+            # llama.cpp ajoute lui-même le jeton de début de séquence
+            prompt = build_prompt(None, request.system_prompt, request.prompt)
+            if prompt.startswith("<s>"):
+                prompt = prompt[len("<s>"):]
+            result = self.llama.create_completion(
+                prompt=prompt,
+                max_tokens=request.max_length,
+                temperature=request.temperature,
+                top_p=request.top_p
+            )
+            outputs.append(result["choices"][0]["text"])
+        return outputs
+
+def load_gguf_model(model_name, system_resources, huggingface_cache):
+    """Charge un modèle GGUF avec ses poids en mmap; None si aucun fichier local"""
+    from llama_cpp import Llama, LlamaRAMCache
+    
+    path = find_gguf_file(model_name, huggingface_cache)
+    if path is None:
+        logger.warning(f"Aucun fichier GGUF local pour {model_name}")
+        return None
+    
+    n_threads, n_threads_batch = thread_counts(system_resources)
+    gpu_layers = -1 if system_resources.get("gpu_available") else 0
+    llama = Llama(
+        model_path=path,
+        n_ctx=GGUF_CONTEXT_SIZE,
+        n_batch=GGUF_BATCH_SIZE,
+        n_threads=n_threads,
+        n_threads_batch=n_threads_batch,
+        n_gpu_layers=gpu_layers,
+        use_mmap=True,
+        use_mlock=GGUF_USE_MLOCK,
+        verbose=False
+    )
+    
+    # États KV des prompts récents: le préfixe système commun n'est pas recalculé
+    if PREFIX_CACHE_MAX_MB > 0:
+        llama.set_cache(LlamaRAMCache(capacity_bytes=PREFIX_CACHE_MAX_MB * 1024 * 1024))
+    
+    logger.info(
+        f"Modèle GGUF {os.path.basename(path)} projeté en mémoire "
+        f"({n_threads} threads de génération, {n_threads_batch} pour le prompt)"
+    )
+    return GGUFModel(llama, path, n_threads, n_threads_batch, gpu_layers)
@@ -0,0 +1,156 @@
+"""
+Empreinte matérielle (CPU, jeux d'instructions, RAM, GPU) sondée une seule
+fois puis conservée sur disque sous CACHE_DIR, valable jusqu'au prochain
+redémarrage de la machine
+"""
+import json
+import os
+import platform
+import threading
+import time
+from .config import logger, CACHE_DIR, HARDWARE_FINGERPRINT_REFRESH
+
+FINGERPRINT_PATH = os.path.join(CACHE_DIR, "hardware_fingerprint.json")
+FINGERPRINT_VERSION = 1
+# Sans identifiant de démarrage, l'empreinte est ressondée passé ce délai
+FINGERPRINT_MAX_AGE = 24 * 3600
+
+# Jeux d'instructions utiles à l'inférence CPU
+ISA_FLAGS = ("sse4_2", "avx", "avx2", "fma", "f16c", "avx512f", "avx512_vnni", "avx512_bf16", "amx_int8",
+             "neon", "asimd", "asimddp", "sve", "i8mm")
+
+_fingerprint = None
+# Sonde et écriture réservées à un seul thread (exécuteur de démarrage et thread d'inférence)
+_lock = threading.Lock()
+
+def boot_id():
+    """Identifiant du démarrage courant de la machine, None s'il n'est pas disponible"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    try:
+        import psutil
+        return f"boot-{int(psutil.boot_time())}"
+    except Exception:
+        return None
+
+def _cpu_info():
+    """Modèle de CPU et jeux d'instructions (Linux: /proc/cpuinfo)"""
+    model_name = platform.processor() or platform.machine()
+    flags = set()
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip().lower()
+                if key in ("model name", "hardware") and value.strip():
+                    model_name = value.strip()
+                elif key in ("flags", "features"):
+                    flags.update(value.split())
+                    if key == "flags" and model_name:
+                        # Tous les cœurs ont les mêmes jeux d'instructions
+                        break
+    except OSError:
+        if platform.machine().lower() in ("arm64", "aarch64"):
+            flags.add("neon")
+    
+    return model_name, sorted(flag for flag in flags if flag in ISA_FLAGS)
+
+def _memory_total_gb():
+    try:
+        import psutil
+        return psutil.virtual_memory().total / (1024 ** 3)
+    except Exception:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 ** 3)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _cpu_counts():
+    logical = os.cpu_count()
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or logical, psutil.cpu_count(logical=True) or logical
+    except Exception:
+        return logical, logical
+
+def probe_hardware():
+    """Sonde complète du matériel (coûteuse: importe torch, lance nvidia-smi)"""
+    from .gpu_detector import detect_gpu
+    
+    started = time.monotonic()
+    cpu_model, isa_flags = _cpu_info()
+    physical, logical = _cpu_counts()
+    gpu_info = detect_gpu()
+    
+    fingerprint = {
+        "version": FINGERPRINT_VERSION,
+        "boot_id": boot_id(),
+        "probed_at": time.time(),
+        "platform": platform.system(),
+        "machine": platform.machine(),
+        "cpu_model": cpu_model,
+        "cpu_count_physical": physical,
+        "cpu_count_logical": logical,
+        "isa_flags": isa_flags,
+        "memory_total_gb": _memory_total_gb(),
+        "gpu_info": gpu_info
+    }
+    logger.info(f"Matériel sondé en {time.monotonic() - started:.2f}s: {cpu_model}, GPU: {gpu_info['available']}")
+    return fingerprint
+
+def _load():
+    """Empreinte enregistrée si elle correspond au démarrage courant"""
+    try:
+        with open(FINGERPRINT_PATH, 'r', encoding='utf-8') as f:
+            fingerprint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if fingerprint.get("version") != FINGERPRINT_VERSION:
+        return None
+    current_boot = boot_id()
+    if current_boot is not None:
+        return fingerprint if fingerprint.get("boot_id") == current_boot else None
+    return fingerprint if time.time() - fingerprint.get("probed_at", 0) < FINGERPRINT_MAX_AGE else None
+
+def _save(fingerprint):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Fichier temporaire propre au processus: deux serveurs ne l'écrivent pas ensemble
+        temporary = f"{FINGERPRINT_PATH}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(fingerprint, f, indent=2)
+        os.replace(temporary, FINGERPRINT_PATH)
+    except OSError as e:
+        logger.error(f"Erreur lors de l'enregistrement de l'empreinte matérielle: {str(e)}")
+
+def cached_hardware_fingerprint():
+    """Empreinte déjà obtenue par ce processus, sans sonde (None sinon)"""
+    return _fingerprint
+
+def get_hardware_fingerprint(refresh=False):
+    """
+    Empreinte matérielle: en mémoire, sinon relue sur disque (même démarrage),
+    sinon sondée et enregistrée. refresh (ou HARDWARE_FINGERPRINT_REFRESH=1) force une nouvelle sonde.
+    """
+    global _fingerprint
+    
+    if _fingerprint is not None and not refresh:
+        return _fingerprint
+    
+    with _lock:
+        # Un autre thread a pu obtenir l'empreinte pendant l'attente du verrou
+        if _fingerprint is not None and not refresh:
+            return _fingerprint
+        
+        fingerprint = None if refresh or HARDWARE_FINGERPRINT_REFRESH else _load()
+        if fingerprint is None:
+            fingerprint = probe_hardware()
+            _save(fingerprint)
+        
+        _fingerprint = fingerprint
+        return _fingerprint
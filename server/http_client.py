@@ -0,0 +1,67 @@
+"""
+Sessions HTTP partagées pour les appels aux backends de génération
+"""
+import asyncio
+from .config import (
+    logger, HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT
+)
+
+class HTTPSessionManager:
+    """
+    Une ClientSession aiohttp par backend, conservée pendant toute la vie de
+    l'application pour réutiliser les connexions (keep-alive, TLS, cache DNS)
+    """
+
+    def __init__(self, limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                 dns_cache_ttl=HTTP_DNS_CACHE_TTL, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions = {}
+        self._lock = asyncio.Lock()
+
+    def _create_session(self):
+        import aiohttp
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={"User-Agent": "FileChat/1.0"}
+        )
+
+    async def start(self, backends):
+        """Crée les sessions des backends connus au démarrage"""
+        for backend in backends:
+            await self.get_session(backend)
+        logger.info(f"Sessions HTTP prêtes: {', '.join(backends)}")
+
+    async def get_session(self, backend):
+        """Retourne la session du backend, créée au premier appel si nécessaire"""
+        session = self._sessions.get(backend)
+        if session is not None and not session.closed:
+            return session
+        
+        async with self._lock:
+            session = self._sessions.get(backend)
+            if session is None or session.closed:
+                session = self._create_session()
+                self._sessions[backend] = session
+            return session
+
+    async def close(self):
+        """Ferme toutes les sessions (arrêt de l'application)"""
+        sessions, self._sessions = self._sessions, {}
+        for backend, session in sessions.items():
+            try:
+                await session.close()
+            except Exception as e:
+                logger.warning(f"Fermeture de la session HTTP {backend} impossible: {e}")
+
+# Gestionnaire partagé par l'application
+http_sessions = HTTPSessionManager()
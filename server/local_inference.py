@@ -0,0 +1,473 @@
+"""
+Inférence avec le modèle local (transformers) et regroupement dynamique
+des requêtes concurrentes en lots
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .config import (
+    logger, LOCAL_BATCH_MAX_SIZE, LOCAL_BATCH_MAX_WAIT_MS, INFERENCE_QUEUE_MAX, INFERENCE_RETRY_AFTER, MODEL_LOAD_QUEUE_MAX,
+    MODEL_WARMUP_RUNS, MODEL_WARMUP_TOKENS, PREFIX_CACHE_MAX_MB, PREFIX_CACHE_MIN_TOKENS,
+    PREFIX_CACHE_MIN_USES, PREFIX_CACHE_TRACKED
+)
+
+# Thread dédié au chargement du modèle et à l'inférence: la boucle asyncio
+# reste libre pour /health, /status et les réponses en cache
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+async def run_in_worker(func, *args):
+    """Exécute une fonction bloquante (chargement, génération) dans le thread d'inférence"""
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, func, *args)
+
+class InferenceQueueFull(Exception):
+    """File d'attente de l'inférence locale pleine"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"File d'attente de l'inférence locale pleine, réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+class ModelLoadQueue:
+    """
+    Chargements de modèles dans le thread d'inférence: un seul par modèle (les
+    requêtes concurrentes attendent le même) et au plus max_pending modèles
+    distincts en attente, au-delà InferenceQueueFull (503 + Retry-After)
+    """
+
+    def __init__(self, max_pending=MODEL_LOAD_QUEUE_MAX):
+        self.max_pending = max_pending
+        self._inflight = {}  # nom du modèle -> tâche de chargement
+        self.loads = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.total_load_time = 0.0
+
+    def retry_after(self):
+        """Délai conseillé: durée moyenne d'un chargement"""
+        if not self.loads:
+            return INFERENCE_RETRY_AFTER
+        return max(1, math.ceil(self.total_load_time / self.loads))
+
+    async def load(self, name, func, *args):
+        """Exécute func(*args) dans le thread d'inférence, une seule fois par name en cours"""
+        task = self._inflight.get(name)
+        if task is None:
+            if len(self._inflight) >= self.max_pending:
+                self.rejected += 1
+                raise InferenceQueueFull(self.retry_after())
+            task = asyncio.ensure_future(self._timed(func, *args))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        else:
+            self.coalesced += 1
+        # shield: un client parti n'annule pas le chargement attendu par les autres
+        return await asyncio.shield(task)
+
+    async def _timed(self, func, *args):
+        started = time.monotonic()
+        try:
+            return await run_in_worker(func, *args)
+        finally:
+            self.loads += 1
+            self.total_load_time += time.monotonic() - started
+
+    def stats(self):
+        return {
+            "max_pending": self.max_pending,
+            "pending": len(self._inflight),
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "avg_load_seconds": round(self.total_load_time / self.loads, 2) if self.loads else 0
+        }
+
+# File des chargements de modèles partagée par l'application
+model_loads = ModelLoadQueue()
+
+def build_prompt(tokenizer, system_prompt, prompt):
+    """Construit le prompt au format conversationnel du modèle"""
+    if getattr(tokenizer, "chat_template", None):
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        try:
+            return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        except Exception:
+            # Certains modèles (Mistral) refusent le rôle système
+            pass
+    return f"<s>[INST] {system_prompt}\n\n{prompt} [/INST]"
+
+# Caractère à usage privé marquant la place du prompt utilisateur dans le gabarit
+_PROMPT_PLACEHOLDER = "\uE000"
+
+def split_prompt(tokenizer, system_prompt):
+    """Découpe le gabarit en (préfixe commun, fin) autour du prompt utilisateur"""
+    template = build_prompt(tokenizer, system_prompt, _PROMPT_PLACEHOLDER)
+    prefix, _, tail = template.partition(_PROMPT_PLACEHOLDER)
+    return prefix, tail
+
+def _cache_layers(past_key_values):
+    """Paires (clés, valeurs) par couche, quel que soit le format de cache de transformers"""
+    if hasattr(past_key_values, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+    if hasattr(past_key_values, "key_cache"):
+        return tuple(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return tuple((layer[0], layer[1]) for layer in past_key_values)
+
+class PrefixCache:
+    """
+    past_key_values des préfixes fréquents (gabarit + prompt système), réutilisés
+    pour ne pas recalculer l'attention sur le préfixe à chaque génération.
+    Un préfixe est mis en cache à partir de min_uses occurrences, avec
+    éviction LRU sous un budget mémoire. Utilisé depuis le seul thread d'inférence.
+    """
+
+    def __init__(self, max_bytes=PREFIX_CACHE_MAX_MB * 1024 * 1024, min_tokens=PREFIX_CACHE_MIN_TOKENS,
+                 min_uses=PREFIX_CACHE_MIN_USES):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.min_uses = min_uses
+        self.entries = OrderedDict()  # (id du modèle, jetons du préfixe) -> (couches, taille en octets)
+        self._uses = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_reused = 0
+
+    def get(self, model, prefix_ids):
+        """Couches (clés, valeurs) du préfixe, calculées si fréquent; None si non éligible"""
+        if self.max_bytes <= 0 or prefix_ids.shape[1] < self.min_tokens:
+            return None
+        
+        key = (id(model), tuple(prefix_ids[0].tolist()))
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.tokens_reused += len(key[1])
+            return entry[0]
+        
+        self.misses += 1
+        uses = self._uses.get(key, 0) + 1
+        if uses < self.min_uses:
+            if len(self._uses) >= PREFIX_CACHE_TRACKED:
+                self._uses.clear()
+            self._uses[key] = uses
+            return None
+        self._uses.pop(key, None)
+        
+        layers = self._compute(model, prefix_ids)
+        size = sum(tensor.numel() * tensor.element_size() for layer in layers for tensor in layer)
+        if size <= self.max_bytes:
+            while self.entries and self.bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+            self.entries[key] = (layers, size)
+            self.bytes += size
+        return layers
+
+    def _compute(self, model, prefix_ids):
+        import torch
+        
+        with torch.inference_mode():
+            outputs = model(input_ids=prefix_ids.to(model.device), use_cache=True)
+        return _cache_layers(outputs.past_key_values)
+
+    def discard_model(self, model):
+        """Retire les préfixes d'un modèle déchargé"""
+        for key in [key for key in self.entries if key[0] == id(model)]:
+            _, size = self.entries.pop(key)
+            self.bytes -= size
+        for key in [key for key in self._uses if key[0] == id(model)]:
+            del self._uses[key]
+
+    def clear(self):
+        self.entries.clear()
+        self._uses.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "size_mb": round(self.bytes / (1024 * 1024), 2),
+            "max_size_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0,
+            "evictions": self.evictions,
+            "tokens_reused": self.tokens_reused
+        }
+
+# Cache de préfixes partagé par le thread d'inférence
+prefix_cache = PrefixCache()
+
+def split_prefix_ids(tokenizer, prefix, prompts):
+    """
+    Jetons du préfixe et de la suite de chaque prompt complet, découpés dans la
+    tokenisation du prompt entier: les jetons sont ceux du chemin sans cache.
+    None si la tokenisation d'un prompt ne commence pas par celle du préfixe
+    (fusion de jetons à la frontière).
+    """
+    prefix_ids = tokenizer(prefix, add_special_tokens=False)["input_ids"]
+    full_ids = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+    size = len(prefix_ids)
+    if any(ids[:size] != prefix_ids or len(ids) == size for ids in full_ids):
+        return None
+    return prefix_ids, [ids[size:] for ids in full_ids]
+
+def _prefix_cached_inputs(model, tokenizer, requests):
+    """
+    Entrées de génération réutilisant le cache du préfixe commun au lot, None si
+    inapplicable. Les prompts sont remplis à gauche après le préfixe: le masque
+    d'attention ignore ce remplissage et les positions en sont déduites.
+    """
+    import torch
+    
+    system_prompt = requests[0].system_prompt
+    if any(r.system_prompt != system_prompt for r in requests):
+        return None
+    prefix, _ = split_prompt(tokenizer, system_prompt)
+    if not prefix:
+        return None
+    
+    prompts = [build_prompt(tokenizer, r.system_prompt, r.prompt) for r in requests]
+    split = split_prefix_ids(tokenizer, prefix, prompts)
+    if split is None:
+        return None
+    prefix_ids, suffixes = split
+    
+    prefix_ids = torch.tensor([prefix_ids])
+    layers = prefix_cache.get(model, prefix_ids)
+    if layers is None:
+        return None
+    
+    size = len(requests)
+    width = max(len(ids) for ids in suffixes)
+    suffix_ids = torch.tensor([[tokenizer.pad_token_id] * (width - len(ids)) + ids for ids in suffixes])
+    suffix_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in suffixes])
+    input_ids = torch.cat([prefix_ids.expand(size, -1), suffix_ids], dim=1)
+    attention_mask = torch.cat([torch.ones((size, prefix_ids.shape[1]), dtype=suffix_mask.dtype), suffix_mask], dim=1)
+    
+    # Copie étendue au lot: la génération ajoute ses clés/valeurs sans modifier l'entrée en cache
+    from transformers import DynamicCache
+    past_key_values = DynamicCache()
+    for index, (keys, values) in enumerate(layers):
+        past_key_values.update(
+            keys.expand(size, -1, -1, -1).contiguous(), values.expand(size, -1, -1, -1).contiguous(), index
+        )
+    
+    return {
+        "input_ids": input_ids.to(model.device),
+        "attention_mask": attention_mask.to(model.device),
+        "past_key_values": past_key_values
+    }
+
+def generate_batch(model, tokenizer, requests):
+    """Génère en une seule passe les réponses d'un lot de requêtes aux paramètres identiques"""
+    if hasattr(model, "generate_batch"):
+        # Backend non transformers (GGUF): génération et cache de préfixe propres
+        return model.generate_batch(requests)
+    
+    import torch
+    
+    # Modèle décodeur seul: remplissage à gauche pour que la génération suive chaque prompt
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    
+    inputs = None
+    try:
+        inputs = _prefix_cached_inputs(model, tokenizer, requests)
+    except Exception as e:
+        logger.warning(f"Cache de préfixe inutilisable pour ce lot: {str(e)}")
+    
+    if inputs is None:
+        # Le gabarit contient déjà les jetons spéciaux (<s>)
+        prompts = [build_prompt(tokenizer, r.system_prompt, r.prompt) for r in requests]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(model.device)
+    
+    params = requests[0]
+    sampling = params.temperature > 0
+    with torch.inference_mode():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=params.max_length,
+            do_sample=sampling,
+            temperature=params.temperature if sampling else None,
+            top_p=params.top_p if sampling else None,
+            pad_token_id=tokenizer.pad_token_id
+        )
+    
+    new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+    return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+def warm_up(model, tokenizer, runs=MODEL_WARMUP_RUNS):
+    """
+    Générations factices pour initialiser noyaux et tampons avant la première
+    requête: une génération seule puis des lots de taille maximale
+    """
+    from types import SimpleNamespace
+    
+    request = SimpleNamespace(
+        prompt="Bonjour", system_prompt="Tu es un assistant IA utile et concis.",
+        temperature=0, top_p=1.0, max_length=MODEL_WARMUP_TOKENS
+    )
+    for run in range(runs):
+        started = time.monotonic()
+        size = 1 if run == 0 else LOCAL_BATCH_MAX_SIZE
+        generate_batch(model, tokenizer, [request] * size)
+        logger.info(f"Préchauffage {run + 1}/{runs} (lot de {size}) en {time.monotonic() - started:.2f}s")
+
+class _PendingRequest:
+    """Requête en attente d'un lot"""
+    __slots__ = ("input_data", "model", "tokenizer", "future", "key", "enqueued_at")
+
+    def __init__(self, input_data, model, tokenizer, future):
+        self.input_data = input_data
+        self.model = model
+        self.tokenizer = tokenizer
+        self.future = future
+        # Seules les requêtes au même modèle et aux paramètres identiques partagent un lot
+        self.key = (id(model), input_data.temperature, input_data.top_p, input_data.max_length)
+        self.enqueued_at = time.monotonic()
+
+class RequestBatcher:
+    """
+    Regroupe les requêtes concurrentes pour le modèle local: un lot part dès
+    qu'il atteint max_batch_size ou que la plus ancienne requête a attendu max_wait_ms.
+    Pendant qu'un lot s'exécute, les suivantes s'accumulent pour le lot d'après.
+    La file est bornée à max_queue requêtes; une requête annulée en est retirée.
+    """
+
+    def __init__(self, max_batch_size=LOCAL_BATCH_MAX_SIZE, max_wait_ms=LOCAL_BATCH_MAX_WAIT_MS,
+                 max_queue=INFERENCE_QUEUE_MAX):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue = max_queue
+        self._pending = deque()
+        self._wakeup = None
+        self._worker_task = None
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = {}
+        self.total_wait = 0.0
+        self.total_batch_time = 0.0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def retry_after(self):
+        """Délai conseillé (secondes) avant de réessayer quand la file est pleine"""
+        if not self.batches:
+            return INFERENCE_RETRY_AFTER
+        avg_batch_time = self.total_batch_time / self.batches
+        pending_batches = len(self._pending) / self.max_batch_size + 1
+        return max(1, math.ceil(avg_batch_time * pending_batches))
+
+    async def submit(self, input_data, model, tokenizer):
+        """Ajoute une requête au prochain lot et attend sa réponse"""
+        if len(self._pending) >= self.max_queue:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after())
+        
+        if self._worker_task is None or self._worker_task.done():
+            self._wakeup = asyncio.Event()
+            self._worker_task = asyncio.ensure_future(self._worker())
+        
+        request = _PendingRequest(input_data, model, tokenizer, asyncio.get_running_loop().create_future())
+        self._pending.append(request)
+        self._wakeup.set()
+        
+        try:
+            return await request.future
+        except asyncio.CancelledError:
+            # Client parti: libérer sa place si le lot n'est pas encore parti
+            if request in self._pending:
+                self._pending.remove(request)
+                self.cancelled += 1
+            raise
+
+    def _compatible(self, key):
+        return sum(1 for request in self._pending if request.key == key)
+
+    async def _wait(self, timeout=None):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        while True:
+            while not self._pending:
+                await self._wait()
+            
+            # La plus ancienne requête fixe les paramètres et la fenêtre du lot
+            first = self._pending[0]
+            deadline = first.enqueued_at + self.max_wait_ms / 1000
+            while self._pending and self._pending[0] is first and self._compatible(first.key) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await self._wait(remaining)
+            
+            if not self._pending:
+                continue
+            key = self._pending[0].key
+            batch = []
+            for request in list(self._pending):
+                if len(batch) >= self.max_batch_size:
+                    break
+                if request.key == key:
+                    self._pending.remove(request)
+                    if not request.future.done():
+                        batch.append(request)
+            
+            if batch:
+                await self._run(batch)
+
+    async def _run(self, requests):
+        model, tokenizer = requests[0].model, requests[0].tokenizer
+        started = time.monotonic()
+        
+        try:
+            outputs = await run_in_worker(generate_batch, model, tokenizer, [r.input_data for r in requests])
+        except Exception as e:
+            logger.error(f"Erreur lors de la génération locale d'un lot de {len(requests)} requêtes: {e}")
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        
+        elapsed = time.monotonic() - started
+        self.batches += 1
+        self.requests += len(requests)
+        self.batch_sizes[len(requests)] = self.batch_sizes.get(len(requests), 0) + 1
+        self.total_batch_time += elapsed
+        self.total_wait += sum(started - r.enqueued_at for r in requests)
+        
+        for request, output in zip(requests, outputs):
+            if not request.future.done():
+                request.future.set_result(output)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue": self.max_queue,
+            "queued": len(self._pending),
+            "batches": self.batches,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "avg_queue_wait_ms": round(self.total_wait / self.requests * 1000, 2) if self.requests else 0,
+            "avg_batch_time_ms": round(self.total_batch_time / self.batches * 1000, 2) if self.batches else 0
+        }
+
+# Regroupeur partagé par l'application
+local_batcher = RequestBatcher()
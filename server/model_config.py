@@ -11,6 +11,8 @@ def save_model_config(model_name, config=None):
     config_path = os.path.join(CACHE_DIR, "model_config.json")
     
     try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        
         # Charger la configuration existante si elle existe
         if os.path.exists(config_path):
             with open(config_path, 'r', encoding='utf-8') as f:
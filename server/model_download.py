@@ -3,11 +3,20 @@
 Module for handling model downloads
 """
 import os
+import json
 import time
+import hashlib
 import threading
 import traceback
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 from pathlib import Path
-from .config import logger, DEFAULT_MODEL, CACHE_DIR
+from .config import (
+    logger, DEFAULT_MODEL, CACHE_DIR, GGUF_QUANTIZATION, DOWNLOAD_WORKERS, DOWNLOAD_CHUNK_SIZE_MB,
+    DOWNLOAD_RETRIES, DOWNLOAD_TIMEOUT, DOWNLOAD_BUFFER_SIZE
+)
+from .model_store import model_store
 
 # Variables globales pour la gestion du téléchargement
 download_progress = {
@@ -50,6 +59,303 @@ def init_model_download(model_name):
     
     return download_progress
 
+class DownloadError(Exception):
+    """Échec du téléchargement ou de la vérification d'un fichier"""
+
+class DownloadFile:
+    """Fichier à télécharger: URL, destination et, si connus, taille et SHA-256"""
+
+    def __init__(self, url, path, size=None, sha256=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+class _FileState:
+    """
+    Avancement d'un fichier: plages terminées (persistées à côté du fichier
+    partiel pour la reprise) et SHA-256 calculé sur le préfixe contigu terminé
+    """
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.part_path = file.path + ".part"
+        self.state_path = file.path + ".part.json"
+        self.lock = threading.Lock()
+        self.hasher = hashlib.sha256()
+        self.hashed_upto = 0
+        self.ranged = False
+        self.started_at = None
+        self.finished_at = None
+        
+        if file.size:
+            self.chunks = [
+                (start, min(start + chunk_size, file.size) - 1)
+                for start in range(0, file.size, chunk_size)
+            ]
+        else:
+            # Taille inconnue: un seul flux, sans reprise possible
+            self.chunks = [(0, None)]
+        self.done = set()
+        self.downloaded = 0
+        self.resumed = 0
+
+    def load(self):
+        """Reprend un téléchargement interrompu (plages déjà écrites)"""
+        os.makedirs(os.path.dirname(self.file.path) or ".", exist_ok=True)
+        if self.file.size and os.path.exists(self.part_path) and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get("size") == self.file.size and saved.get("chunks") == len(self.chunks):
+                    self.done = set(saved.get("done", []))
+            except Exception as e:
+                logger.warning(f"État de reprise illisible pour {self.file.path}: {str(e)}")
+        
+        if not self.done:
+            with open(self.part_path, "wb") as f:
+                if self.file.size:
+                    f.truncate(self.file.size)
+        
+        self.downloaded = self.resumed = sum(self._chunk_length(i) for i in self.done)
+        if self.resumed:
+            logger.info(f"Reprise de {os.path.basename(self.file.path)} à {self.resumed / (1024 * 1024):.0f} Mo")
+        self._advance_hash()
+
+    def _chunk_length(self, index):
+        start, end = self.chunks[index]
+        return end - start + 1
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.downloaded += count
+
+    def complete(self, index):
+        """Marque une plage terminée, la persiste et fait avancer le SHA-256"""
+        with self.lock:
+            self.done.add(index)
+            if self.file.size:
+                with open(self.state_path, 'w', encoding='utf-8') as f:
+                    json.dump({"size": self.file.size, "chunks": len(self.chunks), "done": sorted(self.done)}, f)
+            self._advance_hash()
+
+    def _advance_hash(self):
+        """Hache les plages terminées contiguës depuis le début (relues depuis le cache de pages)"""
+        if self.file.sha256 is None or not self.file.size or self.hashed_upto >= self.file.size:
+            return
+        index = self.hashed_upto // self._chunk_length(0)
+        if index not in self.done:
+            return
+        with open(self.part_path, "rb") as f:
+            f.seek(self.hashed_upto)
+            while index < len(self.chunks) and index in self.done:
+                remaining = self._chunk_length(index)
+                while remaining:
+                    data = f.read(min(DOWNLOAD_BUFFER_SIZE, remaining))
+                    if not data:
+                        raise DownloadError(f"Fichier partiel tronqué: {self.part_path}")
+                    self.hasher.update(data)
+                    remaining -= len(data)
+                self.hashed_upto = self.chunks[index][1] + 1
+                index += 1
+
+    def finalize(self):
+        """Vérifie le SHA-256 et met le fichier complet à sa place"""
+        if self.file.sha256 is not None:
+            if not self.file.size:
+                self.hasher = hashlib.sha256()
+                with open(self.part_path, "rb") as f:
+                    for data in iter(lambda: f.read(DOWNLOAD_BUFFER_SIZE), b""):
+                        self.hasher.update(data)
+            digest = self.hasher.hexdigest()
+            if digest != self.file.sha256:
+                # Fichier corrompu: repartir de zéro au prochain essai
+                for path in (self.part_path, self.state_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise DownloadError(
+                    f"SHA-256 invalide pour {os.path.basename(self.file.path)}: {digest} au lieu de {self.file.sha256}"
+                )
+        os.replace(self.part_path, self.file.path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.finished_at = time.time()
+
+    def stats(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        fetched = self.downloaded - self.resumed
+        throughput = fetched / elapsed if elapsed > 0 else 0
+        remaining = (self.file.size or 0) - self.downloaded
+        return {
+            "size_mb": round((self.file.size or 0) / (1024 * 1024), 1),
+            "downloaded_mb": round(self.downloaded / (1024 * 1024), 1),
+            "progress": int(self.downloaded * 100 / self.file.size) if self.file.size else None,
+            "throughput_mb_s": round(throughput / (1024 * 1024), 2),
+            "eta_seconds": round(remaining / throughput) if throughput > 0 and remaining > 0 else None,
+            "verified_mb": round(self.hashed_upto / (1024 * 1024), 1) if self.file.sha256 else None,
+            "completed": self.finished_at is not None
+        }
+
+class _StripAuthOnRedirect(urllib.request.HTTPRedirectHandler):
+    """Suit les redirections sans transmettre le jeton Hugging Face à une autre origine (CDN)"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_req = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_req is not None and urllib.parse.urlsplit(newurl).netloc != urllib.parse.urlsplit(req.full_url).netloc:
+            new_req.remove_header("Authorization")
+        return new_req
+
+_opener = urllib.request.build_opener(_StripAuthOnRedirect)
+
+class ChunkedDownloader:
+    """
+    Télécharge plusieurs fichiers en parallèle, et les gros fichiers par plages
+    d'octets concurrentes. Reprend les fichiers partiels et vérifie leur SHA-256
+    au fil de l'eau.
+    """
+
+    def __init__(self, files, headers=None, workers=DOWNLOAD_WORKERS,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE_MB * 1024 * 1024, on_progress=None):
+        self.files = [file for file in files if not self._already_complete(file)]
+        self.headers = headers or {}
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.states = [_FileState(file, chunk_size) for file in self.files]
+        self._last_report = 0
+
+    @staticmethod
+    def _already_complete(file):
+        return os.path.exists(file.path) and not os.path.exists(file.path + ".part") and (
+            file.size is None or os.path.getsize(file.path) == file.size
+        )
+
+    def _open(self, url, start=None, end=None):
+        headers = dict(self.headers)
+        if start is not None:
+            headers["Range"] = f"bytes={start}-{end}"
+        return _opener.open(urllib.request.Request(url, headers=headers), timeout=DOWNLOAD_TIMEOUT)
+
+    def _supports_ranges(self, state):
+        """Vérifie par une requête d'un octet que le serveur accepte les plages"""
+        if len(state.chunks) == 1:
+            return False
+        try:
+            with self._open(state.file.url, 0, 0) as response:
+                return response.status == 206
+        except Exception:
+            return False
+
+    def _fetch(self, state, index):
+        start, end = state.chunks[index]
+        if state.started_at is None:
+            state.started_at = time.time()
+        
+        for attempt in range(1, DOWNLOAD_RETRIES + 1):
+            written = 0
+            try:
+                ranged = state.ranged
+                with self._open(state.file.url, *((start, end) if ranged else (None, None))) as response, \
+                        open(state.part_path, "r+b") as out:
+                    out.seek(start)
+                    while True:
+                        data = response.read(DOWNLOAD_BUFFER_SIZE)
+                        if not data:
+                            break
+                        out.write(data)
+                        written += len(data)
+                        state.add_bytes(len(data))
+                        self._report()
+                
+                expected = (end - start + 1) if end is not None else written
+                if written != expected:
+                    raise DownloadError(f"Plage {start}-{end} incomplète ({written}/{expected} octets)")
+                break
+            except Exception as e:
+                state.add_bytes(-written)
+                if attempt == DOWNLOAD_RETRIES:
+                    raise DownloadError(f"Échec du téléchargement de {state.file.url}: {str(e)}")
+                logger.warning(f"Plage {start}-{end} de {os.path.basename(state.file.path)} en échec ({str(e)}), nouvel essai")
+                time.sleep(min(2 ** attempt, 30))
+        
+        if end is None:
+            state.file.size = written
+            state.chunks = [(0, written - 1)] if written else [(0, 0)]
+        state.complete(index)
+        if len(state.done) == len(state.chunks):
+            state.finalize()
+            logger.info(f"Fichier {os.path.basename(state.file.path)} téléchargé et vérifié")
+        self._report(force=True)
+
+    def _report(self, force=False):
+        now = time.monotonic()
+        if self.on_progress and (force or now - self._last_report >= 0.5):
+            self._last_report = now
+            self.on_progress(self.progress())
+
+    def progress(self):
+        """Avancement global et par fichier (débit, temps restant estimé)"""
+        files = {os.path.basename(state.file.path): state.stats() for state in self.states}
+        total = sum(state.file.size or 0 for state in self.states)
+        downloaded = sum(state.downloaded for state in self.states)
+        throughput = sum(stats["throughput_mb_s"] for stats in files.values() if not stats["completed"])
+        remaining_mb = (total - downloaded) / (1024 * 1024)
+        return {
+            "size_mb": round(total / (1024 * 1024), 1),
+            "downloaded_mb": round(downloaded / (1024 * 1024), 1),
+            "progress": int(downloaded * 100 / total) if total else 0,
+            "throughput_mb_s": round(throughput, 2),
+            "eta_seconds": round(remaining_mb / throughput) if throughput > 0 else None,
+            "files": files
+        }
+
+    def run(self):
+        """Télécharge tous les fichiers; lève DownloadError au premier échec définitif"""
+        tasks = []
+        for state in self.states:
+            state.ranged = self._supports_ranges(state)
+            if not state.ranged and state.file.size:
+                # Pas de plages: un seul flux pour tout le fichier
+                state.chunks = [(0, state.file.size - 1)]
+            state.load()
+            tasks.extend((state, index) for index in range(len(state.chunks)) if index not in state.done)
+            if len(state.done) == len(state.chunks):
+                state.finalize()
+        
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download") as executor:
+            futures = [executor.submit(self._fetch, state, index) for state, index in tasks]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            for future in done:
+                future.result()
+        
+        return self.progress()
+
+def _repo_files(model_name, local_dir):
+    """Révision et fichiers du dépôt Hugging Face avec taille et SHA-256 (fichiers LFS)"""
+    from huggingface_hub import HfApi, hf_hub_url
+    
+    info = HfApi().model_info(model_name, files_metadata=True)
+    siblings = info.siblings or []
+    
+    # Dépôt GGUF: une seule quantification, pas toutes les variantes du dépôt
+    gguf_files = [sibling for sibling in siblings if sibling.rfilename.endswith(".gguf")]
+    if gguf_files:
+        preferred = [s for s in gguf_files if GGUF_QUANTIZATION.lower() in s.rfilename.lower()]
+        keep = preferred[:1] or [min(gguf_files, key=lambda s: s.size or 0)]
+        siblings = [s for s in siblings if not s.rfilename.endswith(".gguf")] + keep
+    
+    return info.sha, [
+        DownloadFile(
+            hf_hub_url(model_name, sibling.rfilename, revision=info.sha),
+            os.path.join(local_dir, sibling.rfilename),
+            sibling.size,
+            sibling.lfs.sha256 if sibling.lfs else None
+        )
+        for sibling in siblings
+    ]
+
 def download_model(model_name):
     """Télécharge le modèle en arrière-plan"""
     global download_progress
@@ -58,44 +364,40 @@ def download_model(model_name):
         # Créer le répertoire de cache si nécessaire
         os.makedirs(CACHE_DIR, exist_ok=True)
         
-        # Utiliser huggingface_hub pour le téléchargement
-        from huggingface_hub import snapshot_download
-        from huggingface_hub.utils import ProgressCallback
+        from huggingface_hub.utils import build_hf_headers
         
-        class DownloadProgressCallback(ProgressCallback):
-            def __init__(self):
-                super().__init__()
-                self.last_progress = 0
-                
-            def __call__(self, progress, total, step=None, desc=None):
-                # Mise à jour du progrès global avec une protection contre les valeurs invalides
-                if total > 0:
-                    progress_percent = min(100, int((progress / total) * 100))
-                    
-                    # Mettre à jour uniquement si le progrès a significativement changé
-                    if progress_percent - self.last_progress >= 2:
-                        with download_lock:
-                            download_progress["progress"] = progress_percent
-                            download_progress["downloaded_mb"] = progress / (1024 * 1024)
-                        self.last_progress = progress_percent
-                        
-                        # Log périodique
-                        if progress_percent % 10 == 0:
-                            logger.info(f"Téléchargement du modèle {model_name}: {progress_percent}%")
-        
-        # Télécharger le modèle avec callback de progression
-        snapshot_download(
-            repo_id=model_name,
-            local_dir=os.path.join(CACHE_DIR, "models", model_name.replace("/", "--")),
-            local_dir_use_symlinks=False,
-            resume_download=True,
-            progress_callback=DownloadProgressCallback()
+        local_dir = model_store.model_dir(model_name)
+        revision, files = _repo_files(model_name, local_dir)
+        
+        # Fichiers déjà présents dans le magasin (autre modèle): lien dur au lieu d'un téléchargement
+        shared = [file for file in files if file.sha256 and model_store.link_existing(file.sha256, file.path)]
+        if shared:
+            logger.info(f"{len(shared)} fichier(s) de {model_name} déjà présents dans le magasin")
+        
+        def on_progress(stats):
+            with download_lock:
+                download_progress.update(stats)
+            # Log périodique
+            if stats["progress"] // 10 != on_progress.last_decile:
+                on_progress.last_decile = stats["progress"] // 10
+                eta = f", reste {stats['eta_seconds']}s" if stats["eta_seconds"] is not None else ""
+                logger.info(
+                    f"Téléchargement du modèle {model_name}: {stats['progress']}% "
+                    f"({stats['throughput_mb_s']} Mo/s{eta})"
+                )
+        on_progress.last_decile = -1
+        
+        ChunkedDownloader(files, headers=build_hf_headers(), on_progress=on_progress).run()
+        model_store.register(
+            model_name, revision, [file.path for file in files],
+            {file.path: file.sha256 for file in files if file.sha256}
         )
         
         # Téléchargement réussi
         with download_lock:
             download_progress["status"] = "completed"
             download_progress["progress"] = 100
+            download_progress["eta_seconds"] = 0
             download_progress["completed_at"] = time.time()
         
         logger.info(f"Téléchargement du modèle {model_name} terminé avec succès")
@@ -141,21 +443,23 @@ def estimate_model_size(model_name):
     return model_sizes.get(model_name, 15000)  # ~15 GB par défaut
 
 def check_model_cached(model_name, cache_dir=None):
-    """Vérifie si le modèle est déjà en cache"""
+    """
+    Vérifie si le modèle est disponible localement: magasin de modèles
+    (manifeste), sinon dépôt exact du cache Hugging Face, sans parcours des répertoires
+    """
+    if model_store.has(model_name):
+        return True
+    
+    # Utiliser le cache par défaut si non spécifié
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub")
+    
+    snapshots = os.path.join(cache_dir, f"models--{model_name.replace('/', '--')}", "snapshots")
     try:
-        from huggingface_hub import scan_cache_dir
-        
-        # Utiliser le cache par défaut si non spécifié
-        if not cache_dir:
-            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub")
-        
-        # Scanner le répertoire de cache
-        if os.path.exists(cache_dir):
-            cache_info = scan_cache_dir(cache_dir)
-            for repo in cache_info.repos:
-                if model_name in repo.repo_id:
-                    return True
-    except Exception as e:
+        if not os.path.isdir(snapshots):
+            return False
+        with os.scandir(snapshots) as entries:
+            return any(entry.is_dir() for entry in entries)
+    except OSError as e:
         logger.error(f"Erreur lors de la vérification du cache: {str(e)}")
-    
-    return False
+        return False
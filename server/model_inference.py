@@ -4,29 +4,59 @@ Module pour l'inférence de modèle et les modes de repli
 """
 import traceback
 import json
+import time
 from typing import Dict, Any, Optional
 from .config import logger
+from .http_client import http_sessions
+from .backend_router import backend_router, hedging
+
+# Backends HTTP utilisés par fallback_generate (une session partagée chacun)
+BACKENDS = ("ollama", "huggingface")
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_PROBE_URL = "http://localhost:11434/api/tags"
+OLLAMA_STREAM_READ_TIMEOUT = 60  # Silence maximum entre deux fragments (secondes)
+
+# Ordre de préférence à santé égale; seul Ollama expose une sonde peu coûteuse
+backend_router.register("ollama", 0, probe_url=OLLAMA_PROBE_URL)
+backend_router.register("huggingface", 1)
+
+class BackendResponseError(Exception):
+    """Réponse d'un backend inutilisable (statut ou format inattendu)"""
+
+def ollama_payload(input_data, stream=False):
+    """Corps de requête de l'API de génération d'Ollama"""
+    return {
+        "model": "mistral",
+        "prompt": input_data.prompt,
+        "system": input_data.system_prompt,
+        "stream": stream
+    }
+
+def validate_generation_input(input_data) -> Optional[str]:
+    """Valide l'entrée utilisateur avant de l'envoyer aux API"""
+    if not isinstance(input_data.prompt, str):
+        return "Le prompt doit être une chaîne de caractères"
+    if len(input_data.prompt) > 10000:
+        return "Le prompt est trop long (max 10000 caractères)"
+    return None
 
 async def fallback_generate(input_data):
     """Utilise une API externe quand le modèle local n'est pas disponible"""
     import aiohttp
     import asyncio
-    from aiohttp import ClientTimeout
     
     # Options d'API (priorité: locale, puis HF API, puis fallback API)
     apis = [
         {
-            "url": "http://localhost:11434/api/generate",  # Ollama
-            "data": {
-                "model": "mistral",
-                "prompt": input_data.prompt,
-                "system": input_data.system_prompt,
-                "stream": False
-            },
+            "name": "ollama",
+            "url": OLLAMA_URL,  # Ollama
+            "data": ollama_payload(input_data),
             "result_key": "response",
             "timeout": 30
         },
         {
+            "name": "huggingface",
             "url": "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.1",
             "data": {
                 "inputs": f"<s>[INST] {input_data.system_prompt}\n\n{input_data.prompt} [/INST]",
@@ -42,71 +72,191 @@ async def fallback_generate(input_data):
     ]
     
     # Valider l'entrée utilisateur avant de l'envoyer aux API
-    def validate_input() -> Optional[str]:
-        if not isinstance(input_data.prompt, str):
-            return "Le prompt doit être une chaîne de caractères"
-        if len(input_data.prompt) > 10000:
-            return "Le prompt est trop long (max 10000 caractères)"
-        return None
-    
-    validation_error = validate_input()
+    validation_error = validate_generation_input(input_data)
     if validation_error:
         logger.warning(f"Validation d'entrée échouée: {validation_error}")
-        return {"generated_text": f"Erreur: {validation_error}"}
+        return {"generated_text": f"Erreur: {validation_error}", "error": "invalid_input"}
     
-    for api in apis:
-        try:
-            # Configuration sécurisée d'aiohttp avec timeout et limites
-            timeout = ClientTimeout(total=api["timeout"])
-            conn = aiohttp.TCPConnector(ssl=True, limit=10)
-            
-            async with aiohttp.ClientSession(connector=conn, timeout=timeout) as session:
-                # Ajout d'en-têtes de sécurité et validation
-                headers = {
-                    "Content-Type": "application/json",
-                    "User-Agent": "FileChat/1.0",
-                    "X-Request-ID": f"filechat-{id(input_data)}"
-                }
-                
-                try:
-                    async with session.post(
-                        api["url"], 
-                        json=api["data"], 
-                        headers=headers,
-                        raise_for_status=True
-                    ) as response:
-                        if response.status == 200:
-                            # Validation et traitement sécurisé des réponses JSON
-                            try:
-                                result = await response.json(content_type=None)
-                                
-                                # Validation du format de réponse
-                                if isinstance(result, list) and len(result) > 0:
-                                    if api["result_key"] in result[0]:
-                                        return {"generated_text": result[0].get(api["result_key"], "")}
-                                elif isinstance(result, dict):
-                                    if api["result_key"] in result:
-                                        return {"generated_text": result.get(api["result_key"], "")}
-                                
-                                # Si le format ne correspond pas, réponse générique
-                                return {"generated_text": "Réponse reçue mais dans un format inattendu."}
-                            except json.JSONDecodeError:
-                                logger.warning(f"Réponse non-JSON de {api['url']}")
-                                continue
-                except aiohttp.ClientResponseError as e:
-                    logger.warning(f"Erreur HTTP {e.status} de {api['url']}: {e.message}")
-                    continue
-                
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logger.warning(f"Échec de l'API {api['url']}: {str(e)}")
-            continue
-        except Exception as e:
-            logger.error(f"Erreur inattendue avec {api['url']}: {str(e)}")
-            continue
+    apis_by_name = {api["name"]: api for api in apis}
+    
+    # Backends triés par santé; ceux dont le disjoncteur est ouvert sont ignorés
+    candidates = backend_router.order(list(apis_by_name))
+    result = await _run_backends([apis_by_name[name] for name in candidates], input_data)
+    if result is not None:
+        return result
     
     # Si toutes les API échouent, on renvoie un message d'erreur
     logger.error("Toutes les API ont échoué")
     return {
         "generated_text": "Désolé, je ne peux pas générer de réponse pour le moment. "
-                         "Veuillez vérifier votre connexion internet ou essayer plus tard."
+                         "Veuillez vérifier votre connexion internet ou essayer plus tard.",
+        "error": "all_backends_failed"
+    }
+
+async def _attempt_backend(api, input_data):
+    """Appelle un backend en enregistrant le résultat auprès du routeur"""
+    import aiohttp
+    import asyncio
+    
+    name = api["name"]
+    started = time.monotonic()
+    try:
+        result = await _call_backend(api, input_data)
+    except asyncio.CancelledError:
+        # Requête perdante d'une couverture: ni succès ni échec
+        raise
+    except aiohttp.ClientResponseError as e:
+        logger.warning(f"Erreur HTTP {e.status} de {api['url']}: {e.message}")
+        backend_router.record_failure(name)
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError, BackendResponseError) as e:
+        logger.warning(f"Échec de l'API {api['url']}: {str(e)}")
+        backend_router.record_failure(name)
+        raise
+    except Exception as e:
+        logger.error(f"Erreur inattendue avec {api['url']}: {str(e)}")
+        backend_router.record_failure(name)
+        raise
+    
+    backend_router.record_success(name, time.monotonic() - started)
+    return result
+
+async def _run_backends(apis, input_data):
+    """
+    Essaie les backends dans l'ordre. En mode couverture, si le backend en cours
+    dépasse son percentile de latence, le suivant est lancé en parallèle et le
+    premier à répondre l'emporte. Retourne None si tous échouent.
+    """
+    import asyncio
+    
+    hedging.on_request()
+    remaining = list(apis)
+    running = {}  # tâche -> (api, lancée en couverture)
+    hedges_left = hedging.max_per_request
+    
+    try:
+        while remaining or running:
+            if not running:
+                api = remaining.pop(0)
+                running[asyncio.ensure_future(_attempt_backend(api, input_data))] = (api, False)
+            
+            # Délai de couverture du backend en cours (un seul en vol)
+            delay = None
+            if hedges_left and remaining and len(running) == 1:
+                (current_api, _), = running.values()
+                delay = hedging.delay(current_api["name"])
+            
+            done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                # Backend lent: couverture par le suivant si le budget le permet
+                hedges_left -= 1
+                if hedging.acquire():
+                    api = remaining.pop(0)
+                    logger.info(f"Couverture: {api['name']} lancé après {delay:.2f}s sans réponse")
+                    running[asyncio.ensure_future(_attempt_backend(api, input_data))] = (api, True)
+                continue
+            
+            for task in done:
+                api, hedged = running.pop(task)
+                if task.exception() is None:
+                    if hedged:
+                        hedging.record_win()
+                    return task.result()
+    finally:
+        # Annuler la requête perdante éventuelle
+        for task in running:
+            task.cancel()
+    
+    return None
+
+async def _call_backend(api, input_data):
+    """Appelle un backend et retourne sa réponse, ou lève une exception"""
+    from aiohttp import ClientTimeout
+    
+    # Session partagée du backend: connexions déjà établies réutilisées
+    session = await http_sessions.get_session(api["name"])
+    timeout = ClientTimeout(total=api["timeout"])
+    
+    # Ajout d'en-têtes de sécurité et validation
+    headers = {
+        "Content-Type": "application/json",
+        "User-Agent": "FileChat/1.0",
+        "X-Request-ID": f"filechat-{id(input_data)}"
+    }
+    
+    async with session.post(
+        api["url"], 
+        json=api["data"], 
+        headers=headers,
+        timeout=timeout,
+        raise_for_status=True
+    ) as response:
+        if response.status != 200:
+            raise BackendResponseError(f"Statut inattendu {response.status}")
+        
+        # Validation et traitement sécurisé des réponses JSON
+        try:
+            result = await response.json(content_type=None)
+        except json.JSONDecodeError:
+            raise BackendResponseError(f"Réponse non-JSON de {api['url']}")
+        
+        # Validation du format de réponse
+        if isinstance(result, list) and len(result) > 0:
+            if api["result_key"] in result[0]:
+                return {"generated_text": result[0].get(api["result_key"], "")}
+        elif isinstance(result, dict):
+            if api["result_key"] in result:
+                return {"generated_text": result.get(api["result_key"], "")}
+        
+        # Format inattendu: échec du backend (le suivant est essayé, rien n'est mis en cache)
+        raise BackendResponseError(f"Format de réponse inattendu de {api['url']}")
+
+async def stream_generate(input_data):
+    """
+    Relaie les fragments de texte d'Ollama au fur et à mesure (JSON délimité par
+    des retours à la ligne). La lecture suit le rythme du consommateur; fermer le
+    générateur ferme la connexion et interrompt la génération côté Ollama.
+    """
+    import aiohttp
+    
+    if not backend_router.allow("ollama"):
+        raise ConnectionError("Ollama indisponible (disjoncteur ouvert)")
+    
+    session = await http_sessions.get_session("ollama")
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=OLLAMA_STREAM_READ_TIMEOUT)
+    headers = {
+        "Content-Type": "application/json",
+        "User-Agent": "FileChat/1.0",
+        "X-Request-ID": f"filechat-{id(input_data)}"
     }
+    
+    try:
+        async with session.post(
+            OLLAMA_URL,
+            json=ollama_payload(input_data, stream=True),
+            headers=headers,
+            timeout=timeout,
+            raise_for_status=True
+        ) as response:
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(f"Erreur Ollama: {chunk['error']}")
+                
+                token = chunk.get("response", "")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    # Durée dépendante de la longueur de la réponse: pas comptée dans les latences
+                    backend_router.record_success("ollama")
+                    return
+        
+        raise ConnectionError("Flux Ollama interrompu avant la fin de la génération")
+    except Exception:
+        backend_router.record_failure("ollama")
+        raise
@@ -4,95 +4,447 @@ Gestion du modèle d'IA pour le serveur d'inférence
 """
 import traceback
 import os
-from .config import logger, DEFAULT_MODEL, FALLBACK_MODE, MODEL_LOADED, model, tokenizer, CACHE_DIR
+import gc
+import time
+import threading
+from collections import OrderedDict
+from .config import (
+    logger, DEFAULT_MODEL, FALLBACK_MODE, MODEL_LOADED, MODEL_PRELOAD, CACHE_DIR,
+    MODEL_MEMORY_BUDGET_GB, MODEL_MEMORY_BUDGET_FRACTION, MODEL_MAX_RESIDENT
+)
 from .system_analyzer import analyze_system_resources
+from .system_capability import choose_cpu_precision
 from .model_download import check_model_cached, init_model_download, get_download_progress
 from .model_inference import fallback_generate
 from .model_config import save_model_config, load_model_config
+from .local_inference import prefix_cache
+from .gguf_backend import is_gguf_model, find_gguf_file, load_gguf_model
+from .model_store import model_store
+
+HUGGINGFACE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub")
 
 # Variables globales modifiables
 _fallback_mode = FALLBACK_MODE
 _model_loaded = MODEL_LOADED
+_default_model = None  # Lu dans model_config.json au premier besoin
+
+# Serveur prêt au moins une fois: un rechargement ultérieur (après un téléchargement)
+# ne le retire pas du service, les requêtes attendent simplement le modèle
+_was_ready = False
+
+# Progression du chargement, exposée par /status et /ready
+_load_state = {
+    "stage": "not_loaded",
+    "started_at": None,
+    "finished_at": None,
+    "error": None
+}
+
+def _set_stage(stage):
+    """Met à jour l'étape de chargement du modèle"""
+    global _was_ready
+    if _load_state["started_at"] is None:
+        _load_state["started_at"] = time.time()
+    _load_state["stage"] = stage
+    if stage in ("loaded", "ready", "fallback"):
+        _load_state["finished_at"] = time.time()
+    if stage in ("ready", "fallback"):
+        _was_ready = True
+    logger.info(f"Chargement du modèle: {stage}")
 
 def set_fallback_mode(value):
     """Définit le mode fallback"""
     global _fallback_mode
     _fallback_mode = value
+
+def is_fallback_mode():
+    """Indique si l'inférence passe par les API externes"""
+    return _fallback_mode
     
 def reset_model_loaded():
     """Réinitialise l'état de chargement du modèle"""
     global _model_loaded
     _model_loaded = False
 
+def is_model_loaded():
+    """Indique si le chargement du modèle (local ou mode léger) est terminé"""
+    return _model_loaded
+
+def get_default_model():
+    """Modèle utilisé quand la requête n'en précise pas"""
+    global _default_model
+    if _default_model is None:
+        _default_model = load_model_config().get("default_model") or DEFAULT_MODEL
+    return _default_model
+
+def set_default_model(model_name):
+    """Change le modèle par défaut sans décharger les modèles résidents"""
+    global _default_model
+    _default_model = model_name
+
+def is_ready():
+    """
+    Indique si le serveur peut répondre: en préchargement, seulement une fois
+    le modèle chargé et préchauffé (ou le mode léger retenu). Le rechargement
+    à la demande qui suit un téléchargement ne rend pas le serveur indisponible.
+    """
+    if not MODEL_PRELOAD:
+        return True
+    return _was_ready
+
+def get_load_state():
+    """État du chargement du modèle"""
+    state = dict(_load_state, ready=is_ready(), preload=MODEL_PRELOAD)
+    if state["started_at"] is not None:
+        end = state["finished_at"] or time.time()
+        state["elapsed_seconds"] = round(end - state["started_at"], 2)
+    return state
+
+def _memory_footprint(loaded_model):
+    """
+    Empreinte mémoire réelle d'un modèle chargé, en octets: tous les tenseurs de
+    son state_dict (poids int8 empaquetés compris), les poids partagés comptés une fois
+    """
+    if hasattr(loaded_model, "memory_footprint"):
+        return loaded_model.memory_footprint()
+    
+    seen = set()
+    total = 0
+    pending = list(loaded_model.state_dict().values())
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (tuple, list)):
+            pending.extend(value)
+            continue
+        if not hasattr(value, "element_size"):
+            continue
+        pointer = value.data_ptr()
+        if pointer in seen:
+            continue
+        seen.add(pointer)
+        total += value.numel() * value.element_size()
+    return total
+
+def _model_device(loaded_model):
+    if hasattr(loaded_model, "device"):
+        return str(loaded_model.device)
+    try:
+        return str(next(loaded_model.parameters()).device)
+    except Exception:
+        return "unknown"
+
+class ResidentModel:
+    """Modèle chargé en mémoire"""
+
+    def __init__(self, name, loaded_model, loaded_tokenizer, precision, load_seconds):
+        self.name = name
+        self.model = loaded_model
+        self.tokenizer = loaded_tokenizer
+        self.precision = precision
+        self.footprint = _memory_footprint(loaded_model)
+        self.device = _model_device(loaded_model)
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.last_used = time.time()
+        self.uses = 0
+
+    def stats(self):
+        return {
+            "precision": self.precision,
+            "footprint_mb": round(self.footprint / (1024 * 1024), 1),
+            "device": self.device,
+            "load_seconds": round(self.load_seconds, 2),
+            "uses": self.uses,
+            "idle_seconds": round(time.time() - self.last_used, 1)
+        }
+
+class ModelRegistry:
+    """
+    Modèles locaux résidents, chargés à la demande. Quand leur empreinte cumulée
+    dépasse le budget mémoire (ou leur nombre MODEL_MAX_RESIDENT), les moins
+    récemment utilisés sont déchargés.
+    """
+
+    def __init__(self, budget_bytes=None, max_resident=MODEL_MAX_RESIDENT):
+        self.models = OrderedDict()
+        self.budget_bytes = budget_bytes
+        self.max_resident = max_resident
+        self._footprints = {}  # Dernière empreinte connue, pour faire de la place avant un rechargement
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    def _budget(self, system_resources=None):
+        """Budget mémoire en octets: configuré, sinon une part de la VRAM ou de la RAM disponible"""
+        if self.budget_bytes is None:
+            if MODEL_MEMORY_BUDGET_GB > 0:
+                self.budget_bytes = int(MODEL_MEMORY_BUDGET_GB * 1024 ** 3)
+            elif system_resources is not None:
+                gpu_info = system_resources.get("gpu_info") or {}
+                if system_resources.get("gpu_available") and gpu_info.get("memory_total"):
+                    available_gb = gpu_info["memory_total"]
+                else:
+                    available_gb = system_resources.get("memory_available_gb") or 0
+                # Les modèles déjà résidents occupent une partie de la mémoire mesurée
+                resident_gb = self.used_bytes() / 1024 ** 3
+                if available_gb:
+                    self.budget_bytes = int((available_gb + resident_gb) * MODEL_MEMORY_BUDGET_FRACTION * 1024 ** 3)
+        return self.budget_bytes or 0
+
+    def used_bytes(self):
+        with self._lock:
+            return sum(resident.footprint for resident in self.models.values())
+
+    def get(self, name):
+        """Modèle résident (marqué comme récemment utilisé), None s'il n'est pas chargé"""
+        with self._lock:
+            resident = self.models.get(name)
+            if resident is not None:
+                self.models.move_to_end(name)
+                resident.last_used = time.time()
+                resident.uses += 1
+            return resident
+
+    def make_room(self, name, system_resources=None, estimate=0):
+        """
+        Décharge les modèles les moins récents pour accueillir name: empreinte
+        mesurée lors d'un chargement précédent, sinon l'estimation fournie
+        """
+        budget = self._budget(system_resources)
+        needed = self._footprints.get(name) or estimate
+        with self._lock:
+            while self.models and (
+                len(self.models) >= self.max_resident
+                or (budget and self.used_bytes() + needed > budget)
+            ):
+                self._evict(next(iter(self.models)))
+
+    def add(self, name, loaded_model, loaded_tokenizer, precision, load_seconds):
+        """Enregistre un modèle chargé et libère de la place au-delà du budget"""
+        resident = ResidentModel(name, loaded_model, loaded_tokenizer, precision, load_seconds)
+        with self._lock:
+            self.models[name] = resident
+            self._footprints[name] = resident.footprint
+            self.loads += 1
+            budget = self._budget()
+            while len(self.models) > 1 and (
+                len(self.models) > self.max_resident or (budget and self.used_bytes() > budget)
+            ):
+                self._evict(next(iter(self.models)))
+        logger.info(
+            f"Modèle {name} résident ({resident.footprint / (1024 ** 2):.0f} Mo en {precision} sur {resident.device}, "
+            f"{len(self.models)} modèle(s) chargé(s))"
+        )
+        return resident
+
+    def _evict(self, name):
+        resident = self.models.pop(name)
+        self.evictions += 1
+        prefix_cache.discard_model(resident.model)
+        logger.info(f"Modèle {name} déchargé ({resident.footprint / (1024 ** 2):.0f} Mo libérés)")
+        del resident
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget_bytes / (1024 * 1024), 1) if self.budget_bytes else None,
+                "used_mb": round(self.used_bytes() / (1024 * 1024), 1),
+                "max_resident": self.max_resident,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "resident": {name: resident.stats() for name, resident in self.models.items()}
+            }
+
+# Registre partagé des modèles locaux
+model_registry = ModelRegistry()
+
+def get_local_model(model_name=None):
+    """Retourne (model, tokenizer) du modèle demandé (par défaut sinon) s'il est résident, sinon None"""
+    if not _model_loaded or _fallback_mode:
+        return None
+    resident = model_registry.get(model_name or get_default_model())
+    if resident is None:
+        return None
+    return resident.model, resident.tokenizer
+
+def _load_cpu_weights(model_name, precision):
+    """Charge le modèle sur CPU en float32, int8 (quantification dynamique) ou 4 bits"""
+    import torch
+    from transformers import AutoModelForCausalLM
+    
+    if precision == "4bit":
+        try:
+            import bitsandbytes  # noqa: F401 - requis par BitsAndBytesConfig
+            from transformers import BitsAndBytesConfig
+            
+            loaded_model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                device_map="cpu",
+                low_cpu_mem_usage=True,
+                quantization_config=BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=torch.bfloat16
+                )
+            )
+            return loaded_model, "4bit"
+        except Exception as e:
+            logger.warning(f"Chargement 4 bits impossible ({str(e)}), passage en int8")
+            precision = "int8"
+    
+    loaded_model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float32,
+        device_map="cpu",
+        low_cpu_mem_usage=True
+    )
+    if precision == "int8":
+        # Poids des couches linéaires en int8, activations quantifiées à la volée
+        loaded_model = torch.quantization.quantize_dynamic(loaded_model, {torch.nn.Linear}, dtype=torch.qint8)
+    return loaded_model, precision
+
+def _is_model_available(model_name):
+    """Indique si les poids du modèle sont présents localement"""
+    if is_gguf_model(model_name):
+        return find_gguf_file(model_name, HUGGINGFACE_CACHE) is not None
+    return check_model_cached(model_name, HUGGINGFACE_CACHE)
+
+def _estimated_footprint(model_name):
+    """
+    Empreinte attendue d'un modèle jamais chargé, en octets: taille du fichier
+    GGUF projeté ou des fichiers du modèle dans le magasin (0 si inconnue)
+    """
+    if is_gguf_model(model_name):
+        path = find_gguf_file(model_name, HUGGINGFACE_CACHE)
+        return os.path.getsize(path) if path else 0
+    entry = model_store.get(model_name)
+    return entry["size"] if entry else 0
+
+def _load_weights(model_name, system_resources):
+    """Charge tokenizer et modèle avec la configuration adaptée aux ressources système"""
+    if is_gguf_model(model_name):
+        # llama.cpp: tokenizer intégré au fichier GGUF
+        loaded_model = load_gguf_model(model_name, system_resources, HUGGINGFACE_CACHE)
+        if loaded_model is None:
+            raise FileNotFoundError(f"Aucun fichier GGUF local pour {model_name}")
+        return loaded_model, None, f"gguf-{loaded_model.quantization}"
+    
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    
+    # Répertoire du magasin de modèles si le modèle y a été téléchargé, sinon cache Hugging Face
+    source = model_store.path(model_name) or model_name
+    use_gpu = system_resources.get("gpu_available", False)
+    loaded_tokenizer = AutoTokenizer.from_pretrained(source)
+    
+    if use_gpu:
+        precision = "float16"
+        options = {"torch_dtype": torch.float16, "device_map": "auto"}
+        if system_resources.get("memory_available_gb", 0) < 8:
+            # Configuration basse mémoire
+            logger.info("Mode économie de mémoire activé")
+            options.update(low_cpu_mem_usage=True, offload_folder="offload")
+        loaded_model = AutoModelForCausalLM.from_pretrained(source, **options)
+    else:
+        # Précision choisie selon la taille de ce modèle et la mémoire disponible
+        cpu_precision = choose_cpu_precision(system_resources.get("memory_available_gb"), _estimated_footprint(model_name))
+        loaded_model, precision = _load_cpu_weights(source, cpu_precision)
+    
+    logger.info(f"Modèle {model_name} chargé avec succès sur {'gpu' if use_gpu else 'cpu'} ({precision})")
+    return loaded_model, loaded_tokenizer, precision
+
+def load_local_model(model_name):
+    """
+    Rend résident le modèle demandé s'il est disponible en cache local
+    (à exécuter dans le thread d'inférence). Retourne None sinon.
+    """
+    resident = model_registry.get(model_name)
+    if resident is not None:
+        return resident
+    if _fallback_mode:
+        return None
+    
+    if not _is_model_available(model_name):
+        logger.warning(f"Modèle {model_name} non trouvé en cache, chargement impossible")
+        return None
+    
+    try:
+        system_resources = analyze_system_resources()
+        model_registry.make_room(model_name, system_resources, _estimated_footprint(model_name))
+        started = time.monotonic()
+        loaded_model, loaded_tokenizer, precision = _load_weights(model_name, system_resources)
+        return model_registry.add(model_name, loaded_model, loaded_tokenizer, precision, time.monotonic() - started)
+    except Exception as e:
+        logger.error(f"Erreur lors du chargement du modèle {model_name}: {str(e)}")
+        return None
+
 def lazy_load_model():
     """Charge le modèle seulement quand nécessaire"""
-    global model, tokenizer, _model_loaded, _fallback_mode
+    global _model_loaded, _fallback_mode
     
     if _model_loaded:
         return True
         
+    get_default_model()  # Résout _default_model depuis model_config.json si besoin
     try:
-        logger.info(f"Chargement du modèle {DEFAULT_MODEL}...")
+        logger.info(f"Chargement du modèle {_default_model}...")
         
         # En mode light (sans Rust), on ne charge pas réellement le modèle
         if _fallback_mode:
             logger.info("Mode léger activé: utilisation d'une API externe pour l'inférence")
+            _set_stage("fallback")
             _model_loaded = True
             return True
             
         # Analyser les ressources système
+        _set_stage("analyzing_resources")
         system_resources = analyze_system_resources()
         
         # Si les ressources système sont trop faibles, passer en mode fallback
         if not system_resources["can_run_local_model"]:
             logger.warning("Ressources système insuffisantes, passage en mode léger (API externe)")
+            _set_stage("fallback")
             _fallback_mode = True
             _model_loaded = True
             return True
             
         # Sinon, on essaie de charger le modèle localement
-        import torch
-        from transformers import AutoTokenizer, AutoModelForCausalLM
+        _set_stage("importing")
+        if is_gguf_model(_default_model):
+            import llama_cpp  # noqa: F401 - backend GGUF
+        else:
+            import torch
+            from transformers import AutoTokenizer, AutoModelForCausalLM
         
         # Vérifier si le modèle est déjà en cache
-        huggingface_cache = os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub")
-        model_cached = check_model_cached(DEFAULT_MODEL, huggingface_cache)
+        _set_stage("checking_cache")
+        model_cached = _is_model_available(_default_model)
         
         # Si le modèle n'est pas en cache, proposer de le télécharger (à travers l'API)
         if not model_cached:
-            logger.info(f"Modèle {DEFAULT_MODEL} non trouvé en cache")
+            logger.info(f"Modèle {_default_model} non trouvé en cache")
             # On ne bloque pas ici, le téléchargement se fera lors de la première requête
-            init_model_download(DEFAULT_MODEL)
+            init_model_download(_default_model)
+            _set_stage("fallback")
             _fallback_mode = True
             _model_loaded = True
             return True
         
         # Charger le modèle avec la configuration optimale détectée
-        use_gpu = system_resources.get("gpu_available", False)
-        device_map = "auto" if use_gpu else "cpu"
-        
-        # Configuration adaptative basée sur les ressources système
-        if system_resources.get("memory_available_gb", 0) < 8:
-            # Configuration basse mémoire
-            logger.info("Mode économie de mémoire activé")
-            tokenizer = AutoTokenizer.from_pretrained(DEFAULT_MODEL)
-            model = AutoModelForCausalLM.from_pretrained(
-                DEFAULT_MODEL, 
-                torch_dtype=torch.float16 if use_gpu else torch.float32,
-                device_map=device_map,
-                low_cpu_mem_usage=True,
-                offload_folder="offload"
-            )
-        else:
-            # Configuration standard
-            tokenizer = AutoTokenizer.from_pretrained(DEFAULT_MODEL)
-            model = AutoModelForCausalLM.from_pretrained(
-                DEFAULT_MODEL, 
-                torch_dtype=torch.float16 if use_gpu else torch.float32,
-                device_map=device_map
-            )
-
-        logger.info(f"Modèle chargé avec succès sur {device_map}")
+        _set_stage("loading_weights")
+        # Modèles référencés par le seul registre: un modèle évincé est réellement libéré
+        model_registry.make_room(_default_model, system_resources, _estimated_footprint(_default_model))
+        started = time.monotonic()
+        loaded_model, loaded_tokenizer, precision = _load_weights(_default_model, system_resources)
+        model_registry.add(_default_model, loaded_model, loaded_tokenizer, precision, time.monotonic() - started)
+        _set_stage("loaded")
         _model_loaded = True
         return True
         
@@ -100,20 +452,25 @@ def lazy_load_model():
         error_msg = f"Erreur lors du chargement du modèle: {str(e)}"
         logger.error(error_msg)
         traceback.print_exc()
+        _load_state["error"] = str(e)
         
-        if "CUDA" in str(e) or "GPU" in str(e):
+        if ("CUDA" in str(e) or "GPU" in str(e)) and not is_gguf_model(_default_model):
             logger.info("Erreur GPU détectée, passage en mode CPU")
             try:
                 import torch
                 from transformers import AutoTokenizer, AutoModelForCausalLM
                 
-                tokenizer = AutoTokenizer.from_pretrained(DEFAULT_MODEL)
-                model = AutoModelForCausalLM.from_pretrained(
-                    DEFAULT_MODEL,
+                started = time.monotonic()
+                source = model_store.path(_default_model) or _default_model
+                loaded_tokenizer = AutoTokenizer.from_pretrained(source)
+                loaded_model = AutoModelForCausalLM.from_pretrained(
+                    source,
                     device_map="cpu",
                     low_cpu_mem_usage=True
                 )
+                model_registry.add(_default_model, loaded_model, loaded_tokenizer, "float32", time.monotonic() - started)
                 logger.info("Modèle chargé en mode CPU avec succès")
+                _set_stage("loaded")
                 _model_loaded = True
                 return True
             except Exception as cpu_e:
@@ -121,6 +478,26 @@ def lazy_load_model():
                 
         # En cas d'erreur, on passe en mode fallback
         logger.warning("Passage en mode léger (API externe)")
+        _set_stage("fallback")
         _fallback_mode = True
         _model_loaded = True
         return True
+
+def preload_model():
+    """Charge puis préchauffe le modèle au démarrage (à exécuter dans le thread d'inférence)"""
+    from .local_inference import warm_up
+    
+    lazy_load_model()
+    
+    local_model = get_local_model()
+    if local_model is None:
+        return
+    
+    _set_stage("warming_up")
+    try:
+        warm_up(*local_model)
+    except Exception as e:
+        # Le modèle reste utilisable: seul le premier appel sera plus lent
+        logger.error(f"Erreur lors du préchauffage du modèle: {str(e)}")
+        _load_state["error"] = str(e)
+    _set_stage("ready")
@@ -0,0 +1,158 @@
+"""
+Magasin local des modèles adressé par contenu: chaque fichier est un blob
+nommé par son SHA-256, lié en dur dans le répertoire du modèle, et un
+manifeste (dépôt, révision, fichiers, tailles, empreintes) répond aux
+recherches sans parcourir les répertoires
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from .config import logger, MODELS_DIR, DOWNLOAD_BUFFER_SIZE
+
+MANIFEST_PATH = os.path.join(MODELS_DIR, "manifest.json")
+BLOBS_DIR = os.path.join(MODELS_DIR, "blobs", "sha256")
+
+def sha256_file(path):
+    """SHA-256 d'un fichier local"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(DOWNLOAD_BUFFER_SIZE), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+def _link(source, destination):
+    """Lien dur (remplacement atomique), copie si le système de fichiers ne le permet pas"""
+    temporary = destination + ".link"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copy2(source, temporary)
+    os.replace(temporary, destination)
+
+class ModelStore:
+    """Manifeste des modèles téléchargés et blobs partagés entre modèles"""
+
+    def __init__(self, models_dir=MODELS_DIR, manifest_path=MANIFEST_PATH, blobs_dir=BLOBS_DIR):
+        self.models_dir = models_dir
+        self.manifest_path = manifest_path
+        self.blobs_dir = blobs_dir
+        self._lock = threading.Lock()
+        self._models = None
+
+    def _manifest(self):
+        """Manifeste en mémoire, lu une seule fois"""
+        if self._models is None:
+            self._models = {}
+            try:
+                if os.path.exists(self.manifest_path):
+                    with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                        self._models = json.load(f).get("models", {})
+            except Exception as e:
+                logger.error(f"Erreur lors de la lecture du manifeste des modèles: {str(e)}")
+        return self._models
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        temporary = self.manifest_path + ".tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "models": self._models}, f, indent=2)
+        os.replace(temporary, self.manifest_path)
+
+    def model_dir(self, model_name):
+        """Répertoire d'un modèle dans le magasin"""
+        return os.path.join(self.models_dir, model_name.replace("/", "--"))
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256)
+
+    def get(self, model_name):
+        """Entrée du manifeste d'un modèle complet, None s'il n'est pas dans le magasin"""
+        with self._lock:
+            entry = self._manifest().get(model_name)
+        if entry is None or not os.path.isdir(entry["path"]):
+            return None
+        return entry
+
+    def has(self, model_name):
+        return self.get(model_name) is not None
+
+    def path(self, model_name):
+        """Répertoire local d'un modèle du magasin (utilisable par from_pretrained)"""
+        entry = self.get(model_name)
+        return entry["path"] if entry else None
+
+    def files(self, model_name, suffix=""):
+        """Chemins des fichiers d'un modèle, filtrés par extension"""
+        entry = self.get(model_name)
+        if entry is None:
+            return []
+        return [os.path.join(entry["path"], name) for name in entry["files"] if name.endswith(suffix)]
+
+    def link_existing(self, sha256, destination):
+        """Lie un blob déjà présent (partagé avec un autre modèle); False s'il est absent"""
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            return False
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if not (os.path.exists(destination) and os.path.samefile(blob, destination)):
+            _link(blob, destination)
+        return True
+
+    def register(self, model_name, revision, paths, hashes=None):
+        """
+        Range les fichiers téléchargés d'un modèle dans les blobs (un fichier
+        identique déjà présent est remplacé par un lien dur) et met à jour le manifeste
+        """
+        hashes = hashes or {}
+        root = self.model_dir(model_name)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        files = {}
+        shared = 0
+        
+        for path in paths:
+            sha256 = hashes.get(path) or sha256_file(path)
+            blob = self.blob_path(sha256)
+            if os.path.exists(blob):
+                if not os.path.samefile(blob, path):
+                    _link(blob, path)
+                    shared += 1
+            else:
+                try:
+                    os.link(path, blob)
+                except OSError:
+                    shutil.copy2(path, blob)
+            files[os.path.relpath(path, root).replace(os.sep, "/")] = {
+                "size": os.path.getsize(path),
+                "sha256": sha256
+            }
+        
+        with self._lock:
+            self._manifest()[model_name] = {
+                "revision": revision,
+                "path": root,
+                "files": files,
+                "size": sum(file["size"] for file in files.values()),
+                "registered_at": time.time()
+            }
+            self._save()
+        logger.info(f"Modèle {model_name} enregistré dans le magasin ({len(files)} fichiers, {shared} partagés)")
+
+    def stats(self):
+        with self._lock:
+            models = dict(self._manifest())
+        return {
+            name: {
+                "revision": entry["revision"],
+                "files": len(entry["files"]),
+                "size_mb": round(entry["size"] / (1024 * 1024), 1)
+            }
+            for name, entry in models.items()
+        }
+
+# Magasin partagé par le téléchargement et le chargement des modèles
+model_store = ModelStore()
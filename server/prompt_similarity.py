@@ -0,0 +1,100 @@
+"""
+Canonicalisation des prompts et signatures MinHash/LSH pour retrouver
+des prompts quasi identiques dans le cache de réponses
+"""
+import hashlib
+import re
+import unicodedata
+from array import array
+
+# Paramètres MinHash / LSH: 64 permutations découpées en 16 bandes de 4 lignes
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3  # Nombre de mots par shingle
+MAX_SHINGLES = 2000  # Limite le coût du calcul sur les très longs prompts
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xFFFFFFFF
+_WHITESPACE = re.compile(r"\s+")
+
+def _permutations():
+    """Coefficients (a, b) déterministes des permutations MinHash"""
+    coefficients = []
+    for i in range(MINHASH_PERMUTATIONS):
+        digest = hashlib.sha256(f"minhash-{i}".encode()).digest()
+        a = int.from_bytes(digest[:8], "little") % _MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:16], "little") % _MERSENNE_PRIME
+        coefficients.append((a, b))
+    return coefficients
+
+_PERMUTATIONS = _permutations()
+
+def normalize_prompt(text):
+    """
+    Normalisation sans perte de sens pour la clé exacte du cache: Unicode NFC,
+    fins de ligne unifiées, espaces en fin de ligne et en bordure retirés
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def canonicalize_prompt(text):
+    """
+    Forme canonique d'un prompt: Unicode NFKC, casse repliée, ponctuation
+    retirée et espaces normalisés. Réservée à la correspondance approchée:
+    des prompts de sens différent ("C++" et "C") y partagent la même forme.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+def shingles(canonical_text):
+    """Ensemble des empreintes 32 bits des shingles de mots du texte canonique"""
+    words = canonical_text.split(" ")
+    if len(words) < SHINGLE_SIZE:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return {
+        int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "little")
+        for gram in grams[:MAX_SHINGLES]
+    }
+
+def minhash_signature(canonical_text):
+    """Signature MinHash (MINHASH_PERMUTATIONS valeurs 32 bits)"""
+    hashes = shingles(canonical_text)
+    return array("I", [
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    ])
+
+def signature_to_bytes(signature):
+    """Sérialise une signature pour le stockage SQLite"""
+    return signature.tobytes()
+
+def signature_from_bytes(data):
+    """Désérialise une signature stockée"""
+    signature = array("I")
+    signature.frombytes(data)
+    return signature
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimation de la similarité de Jaccard entre deux signatures"""
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / MINHASH_PERMUTATIONS
+
+def lsh_buckets(signature, context):
+    """
+    Clés de bandes LSH (band, bucket). Le contexte (prompt système, modèle,
+    paramètres) est inclus pour ne rapprocher que des requêtes compatibles.
+    """
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(f"{context}|{band}|{rows.tolist()}".encode(), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, "little", signed=True)))
+    return buckets
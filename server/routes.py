@@ -1,26 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from typing import Optional
+import asyncio
 import traceback
 import time
 import json
 import os
 import platform
 
-from .config import logger, MODEL_LOADED
-from .model_manager import lazy_load_model
-from .model_inference import fallback_generate
+from .config import logger, INFERENCE_DISCONNECT_POLL, MODEL_PRELOAD, ensure_directories, log_configuration
+from .cache_manager import (
+    init_cache, close_cache, generate_cache_id, check_cache, update_cache, find_similar_cache
+)
+from .model_manager import (
+    lazy_load_model, is_model_loaded, is_fallback_mode, get_local_model, load_local_model, preload_model,
+    get_load_state, get_default_model, set_default_model, model_registry
+)
+from .local_inference import local_batcher, model_loads, prefix_cache, run_in_worker, InferenceQueueFull
+from .model_inference import fallback_generate, stream_generate, validate_generation_input, BACKENDS
+from .http_client import http_sessions
+from .backend_router import backend_router, hedging
 from .model_download import get_download_progress
+from .model_store import model_store
+from .system_resources import resource_sampler
+from .hardware_fingerprint import get_hardware_fingerprint, cached_hardware_fingerprint
 from .model_config import save_model_config, load_model_config
 
 router = APIRouter()
 
+# Générations en cours, indexées par ID de cache (requêtes identiques fusionnées)
+_inflight_generations = {}
+# Nombre de clients en attente de chaque génération en cours
+_inflight_waiters = {}
+
 class GenerationInput(BaseModel):
     prompt: str = Field(..., description="Texte d'entrée pour la génération")
     system_prompt: str = Field("Tu es un assistant IA utile et concis.", description="Instructions système pour le modèle")
     max_length: int = Field(1000, description="Longueur maximale de la sortie")
     temperature: float = Field(0.7, description="Température pour la génération (0.1-1.0)")
     top_p: float = Field(0.9, description="Valeur top_p pour la génération (0.1-1.0)")
+    similar_match: bool = Field(True, description="Autoriser une réponse en cache d'un prompt quasi identique")
+    model: Optional[str] = Field(None, description="Modèle local à utiliser (modèle par défaut si absent)")
 
 class ModelConfigInput(BaseModel):
     model_name: str = Field(..., description="Nom du modèle à configurer")
@@ -39,12 +60,20 @@ async def get_health():
         }
     }
 
+@router.get("/ready")
+async def get_ready():
+    """Sonde de disponibilité: 200 seulement quand le modèle peut servir"""
+    state = get_load_state()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content={"ready": False, "stage": state["stage"]})
+    return {"ready": True, "stage": state["stage"]}
+
 @router.get("/status")
 async def get_status():
     """Retourne l'état du serveur et du modèle"""
     try:
         # Vérifier si le modèle est chargé
-        model_status = "loaded" if MODEL_LOADED else "not_loaded"
+        model_status = "loaded" if is_model_loaded() else "not_loaded"
         
         # Obtenir l'état du téléchargement si en cours
         download_status = get_download_progress()
@@ -52,30 +81,278 @@ async def get_status():
         return {
             "status": "ok",
             "model_status": model_status,
-            "download_status": download_status
+            "model_loading": get_load_state(),
+            "download_status": download_status,
+            "backends": backend_router.stats(),
+            "hedging": hedging.stats(),
+            "batching": local_batcher.stats(),
+            "model_loads": model_loads.stats(),
+            "prefix_cache": prefix_cache.stats(),
+            "models": dict(model_registry.stats(), default=get_default_model()),
+            "model_store": model_store.stats(),
+            "resources": resource_sampler.snapshot(),
+            "hardware": cached_hardware_fingerprint()
         }
     except Exception as e:
         logger.error(f"Erreur lors de la vérification du statut: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+def init_app():
+    """Crée l'application FastAPI et branche l'initialisation/fermeture du cache et des sessions HTTP"""
+    from fastapi import FastAPI
+    
+    ensure_directories()
+    log_configuration(get_default_model())
+    
+    app = FastAPI(title="FileChat - Serveur d'inférence IA")
+    app.include_router(router)
+    
+    @app.on_event("startup")
+    async def on_startup():
+        init_cache()
+        resource_sampler.start()
+        # Empreinte matérielle relue (ou sondée) hors de la boucle, avant le premier chargement
+        asyncio.get_running_loop().run_in_executor(None, get_hardware_fingerprint)
+        await http_sessions.start(BACKENDS)
+        backend_router.start()
+        if MODEL_PRELOAD:
+            # Chargement et préchauffage en arrière-plan: /ready passe à 200 une fois terminés
+            asyncio.ensure_future(run_in_worker(preload_model))
+    
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        await backend_router.stop()
+        await http_sessions.close()
+        resource_sampler.stop()
+        close_cache()
+    
+    return app
+
+# Modèle sous lequel sont rangées les réponses des API externes: jamais sous la clé
+# d'un modèle local qui ne les a pas produites
+FALLBACK_CACHE_MODEL = "fallback"
+
+def _model_name(input_data: GenerationInput):
+    """Modèle demandé par la requête, sinon le modèle par défaut"""
+    return input_data.model or get_default_model()
+
+def _cache_model(input_data: GenerationInput, local: bool):
+    """Modèle de la clé de cache: le modèle local demandé, ou les API externes"""
+    return _model_name(input_data) if local else FALLBACK_CACHE_MODEL
+
+def _cache_id(input_data: GenerationInput, local: bool):
+    """ID de cache d'une requête selon le générateur de la réponse"""
+    return generate_cache_id(
+        input_data.prompt, input_data.system_prompt, _cache_model(input_data, local),
+        input_data.temperature, input_data.top_p, input_data.max_length
+    )
+
+def _serves_locally():
+    """Indique si les générations passent par un modèle local (inconnu avant le chargement: supposé)"""
+    return not (is_model_loaded() and is_fallback_mode())
+
+def _store_in_cache(input_data: GenerationInput, local: bool, generated_text: str):
+    """Enregistre une réponse générée dans le cache, sous la clé de son générateur"""
+    update_cache(
+        _cache_id(input_data, local), input_data.prompt, input_data.system_prompt, _cache_model(input_data, local),
+        generated_text, input_data.temperature, input_data.top_p, input_data.max_length
+    )
+
+async def _generate(input_data: GenerationInput):
+    """
+    Génère avec le modèle local s'il est chargé (par lots), sinon via les API
+    externes. Retourne (résultat, généré localement).
+    """
+    local_model = get_local_model(_model_name(input_data))
+    if local_model is not None:
+        model, tokenizer = local_model
+        try:
+            return {"generated_text": await local_batcher.submit(input_data, model, tokenizer)}, True
+        except InferenceQueueFull:
+            raise
+        except Exception as e:
+            if input_data.model:
+                # Les API externes ne servent pas le modèle explicitement demandé
+                raise
+            logger.warning(f"Génération locale impossible, passage aux API externes: {str(e)}")
+    
+    return await fallback_generate(input_data), False
+
+async def _generate_and_cache(input_data: GenerationInput, cache_id: str):
+    """Génère la réponse une seule fois et l'enregistre dans le cache"""
+    result, local = await _generate(input_data)
+    
+    # Ne pas mettre en cache les erreurs de validation ou d'indisponibilité
+    if "error" not in result:
+        _store_in_cache(input_data, local, result["generated_text"])
+    
+    return result
+
+async def _generate_single_flight(input_data: GenerationInput, cache_id: str):
+    """Partage une même génération entre toutes les requêtes identiques en cours"""
+    task = _inflight_generations.get(cache_id)
+    if task is None:
+        task = asyncio.ensure_future(_generate_and_cache(input_data, cache_id))
+        _inflight_generations[cache_id] = task
+        task.add_done_callback(lambda _: _inflight_generations.pop(cache_id, None))
+    else:
+        logger.debug(f"Génération déjà en cours pour {cache_id[:12]}, attente du résultat")
+    
+    _inflight_waiters[cache_id] = _inflight_waiters.get(cache_id, 0) + 1
+    try:
+        # shield: l'annulation d'un client ne doit pas annuler la génération partagée...
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # ...sauf s'il était le dernier à l'attendre: la requête quitte alors la file
+        if _inflight_waiters.get(cache_id) == 1 and not task.done():
+            task.cancel()
+        raise
+    finally:
+        _inflight_waiters[cache_id] -= 1
+        if not _inflight_waiters[cache_id]:
+            del _inflight_waiters[cache_id]
+
+async def _until_disconnected(request: Request, coro):
+    """Attend coro, annulée si le client HTTP se déconnecte entre-temps"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=INFERENCE_DISCONNECT_POLL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client déconnecté, requête retirée de la file d'inférence")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client déconnecté")
+    finally:
+        if not task.done():
+            task.cancel()
+
 @router.post("/generate")
-async def generate_text(input_data: GenerationInput):
+async def generate_text(input_data: GenerationInput, request: Request):
     """Génère du texte à partir d'un prompt"""
+    # Validation avant tout chemin de génération (modèle local compris)
+    validation_error = validate_generation_input(input_data)
+    if validation_error:
+        raise HTTPException(status_code=400, detail=validation_error)
+    
     try:
-        # Charger le modèle si nécessaire
-        if not lazy_load_model():
+        # Un modèle explicitement demandé n'est jamais servi par les API externes
+        local = _serves_locally() or bool(input_data.model)
+        cache_id = _cache_id(input_data, local)
+        
+        # Réponse déjà en cache: pas besoin du modèle (l'échec est compté par la recherche approchée)
+        cached_response = check_cache(cache_id, record_miss=not input_data.similar_match)
+        
+        # Sinon, prompt quasi identique (générations déterministes, sauf refus explicite)
+        if cached_response is None and input_data.similar_match:
+            cached_response = find_similar_cache(
+                input_data.prompt, input_data.system_prompt, _cache_model(input_data, local),
+                input_data.temperature, input_data.top_p, input_data.max_length, record_miss=True
+            )
+        
+        if cached_response is not None:
+            return {"generated_text": cached_response}
+        
+        # Charger le modèle si nécessaire, dans le thread d'inférence pour ne pas bloquer la boucle
+        # Chargements regroupés par modèle et bornés, comme la file de génération
+        if not is_model_loaded() and not await model_loads.load(None, lazy_load_model):
             raise HTTPException(status_code=500, detail="Impossible de charger le modèle")
         
-        # Utiliser le mode fallback si activé
-        result = await fallback_generate(input_data)
+        # Modèle demandé pas encore (ou plus) résident: chargement à la demande
+        model_name = _model_name(input_data)
+        resident = get_local_model(model_name)
+        if resident is None and not is_fallback_mode():
+            resident = await model_loads.load(model_name, load_local_model, model_name)
+        if resident is None and input_data.model:
+            raise HTTPException(status_code=404, detail=f"Modèle {model_name} non disponible localement")
+        
+        # Modèle local (par lots) ou API externes en mode fallback
+        result = await _until_disconnected(request, _generate_single_flight(input_data, cache_id))
         
         return result
+    except InferenceQueueFull as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de la génération: {str(e)}"
         logger.error(error_msg)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=error_msg)
 
+def _sse(data, event=None):
+    """Formate un événement Server-Sent Events"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/generate/stream")
+async def generate_text_stream(input_data: GenerationInput, request: Request):
+    """Génère du texte en streaming (Server-Sent Events) à partir d'un prompt"""
+    validation_error = validate_generation_input(input_data)
+    if validation_error:
+        raise HTTPException(status_code=400, detail=validation_error)
+    
+    # Texte produit par Ollama: rangé sous la clé des API externes
+    cache_id = _cache_id(input_data, local=False)
+    cached_response = check_cache(cache_id)
+    
+    async def events():
+        # Réponse en cache: un seul événement final
+        if cached_response is not None:
+            yield _sse({"generated_text": cached_response, "cached": True}, "done")
+            return
+        
+        tokens = []
+        stream = stream_generate(input_data)
+        try:
+            try:
+                async for token in stream:
+                    if await request.is_disconnected():
+                        logger.info("Client déconnecté, génération en streaming interrompue")
+                        return
+                    tokens.append(token)
+                    yield _sse({"token": token})
+            finally:
+                # Fermeture immédiate (pas au passage du ramasse-miettes): la connexion
+                # Ollama est fermée et la génération arrêtée
+                await stream.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if tokens:
+                logger.warning(f"Streaming interrompu: {str(e)}")
+                yield _sse({"error": str(e)}, "error")
+                return
+            
+            # Ollama indisponible avant le premier fragment: génération complète via les autres backends
+            logger.warning(f"Streaming Ollama indisponible ({str(e)}), génération sans streaming")
+            try:
+                result = await _generate_single_flight(input_data, cache_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as fallback_error:
+                logger.error(f"Génération de repli impossible: {str(fallback_error)}")
+                yield _sse({"error": str(fallback_error)}, "error")
+                return
+            if "error" in result:
+                yield _sse({"error": result["error"], "generated_text": result["generated_text"]}, "error")
+                return
+            yield _sse({"generated_text": result["generated_text"], "cached": False}, "done")
+            return
+        
+        # Texte complet: mis en cache comme pour /generate
+        generated_text = "".join(tokens)
+        _store_in_cache(input_data, False, generated_text)
+        yield _sse({"generated_text": generated_text, "cached": False}, "done")
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/config/model")
 async def configure_model(config_data: ModelConfigInput):
     """Configure le modèle à utiliser"""
@@ -86,6 +363,9 @@ async def configure_model(config_data: ModelConfigInput):
         if not success:
             raise HTTPException(status_code=500, detail="Impossible d'enregistrer la configuration")
         
+        # Les modèles déjà résidents restent chargés: revenir à l'un d'eux est immédiat
+        set_default_model(config_data.model_name)
+        
         return {"status": "ok", "message": f"Configuration du modèle {config_data.model_name} enregistrée"}
     except Exception as e:
         error_msg = f"Erreur lors de la configuration: {str(e)}"
@@ -3,9 +3,9 @@
 Analyse des ressources système pour le serveur d'inférence IA
 """
 from .config import logger
-from .gpu_detector import detect_gpu
+from .hardware_fingerprint import get_hardware_fingerprint
 from .system_resources import analyze_memory_cpu
-from .system_capability import calculate_system_score, assess_model_capability, get_platform_info
+from .system_capability import calculate_system_score, assess_model_capability, choose_cpu_precision, get_platform_info
 
 def analyze_system_resources():
     """
@@ -19,18 +19,23 @@ def analyze_system_resources():
         "gpu_available": False,
         "gpu_info": None,
         "system_score": 0.5,  # Default score
-        "can_run_local_model": True
+        "can_run_local_model": True,
+        "cpu_precision": "float32"
     }
     
     try:
-        # Get GPU information
-        gpu_info = detect_gpu()
+        # Get GPU information from the cached hardware fingerprint (probed once per boot)
+        hardware = get_hardware_fingerprint()
+        gpu_info = hardware["gpu_info"]
         result["gpu_available"] = gpu_info["available"]
         result["gpu_info"] = gpu_info
         
         # Get memory and CPU information
         resources = analyze_memory_cpu()
         result.update(resources)
+        result["cpu_count_physical"] = hardware["cpu_count_physical"]
+        result["cpu_count_logical"] = hardware["cpu_count_logical"]
+        result["isa_flags"] = hardware["isa_flags"]
         
         # Calculate system score
         result["system_score"] = calculate_system_score(
@@ -46,6 +51,9 @@ def analyze_system_resources():
             result["system_score"]
         )
         
+        # Pick the CPU weight precision (ignored when a GPU is used)
+        result["cpu_precision"] = choose_cpu_precision(result["memory_available_gb"])
+        
         # If psutil isn't available, add basic platform info
         if result["cpu_percent"] is None:
             result["platform_info"] = get_platform_info()
@@ -2,8 +2,20 @@
 """
 Module for assessing system capabilities for AI processing
 """
+import importlib.util
 import platform
-from .config import logger
+from .config import (
+    logger, MODEL_CPU_PRECISION, CPU_FLOAT32_MIN_MEMORY_GB, CPU_INT8_MIN_MEMORY_GB, CPU_MEMORY_HEADROOM,
+    BNB_CPU_MIN_VERSION
+)
+
+CPU_PRECISIONS = ("float32", "int8", "4bit")
+
+# Bytes per parameter at each precision, and in a checkpoint (float16/bfloat16)
+BYTES_PER_PARAMETER = {"float32": 4, "int8": 1, "4bit": 0.5}
+CHECKPOINT_BYTES_PER_PARAMETER = 2
+
+_cpu_4bit_available = None
 
 def calculate_system_score(cpu_percent, memory_percent, gpu_available):
     """
@@ -35,6 +47,61 @@ def assess_model_capability(memory_available_gb, cpu_percent, system_score):
         system_score > 0.3             # System score is sufficient
     )
 
+def cpu_4bit_available():
+    """
+    Whether bitsandbytes can load 4-bit weights on CPU (version read from the
+    package metadata, without importing it)
+    """
+    global _cpu_4bit_available
+    if _cpu_4bit_available is None:
+        _cpu_4bit_available = False
+        if importlib.util.find_spec("bitsandbytes") is not None:
+            try:
+                from importlib.metadata import version
+                release = tuple(int(part) for part in version("bitsandbytes").split(".")[:2])
+                _cpu_4bit_available = release >= BNB_CPU_MIN_VERSION
+            except Exception as e:
+                logger.debug(f"Unreadable bitsandbytes version: {str(e)}")
+    return _cpu_4bit_available
+
+def estimate_cpu_footprint_gb(model_bytes, precision):
+    """Expected memory (GB, headroom included) of a model_bytes checkpoint loaded at this precision"""
+    parameters = model_bytes / CHECKPOINT_BYTES_PER_PARAMETER
+    return parameters * BYTES_PER_PARAMETER[precision] * CPU_MEMORY_HEADROOM / (1024 ** 3)
+
+def choose_cpu_precision(memory_available_gb, model_bytes=0):
+    """
+    Choose the weight precision for CPU inference: the most precise one whose
+    estimated footprint fits in available memory. 4-bit is only offered when
+    bitsandbytes can run it on CPU; otherwise int8 is the smallest option.
+    Without a model size, fixed memory thresholds are used.
+    """
+    if MODEL_CPU_PRECISION in CPU_PRECISIONS:
+        return MODEL_CPU_PRECISION
+    
+    smallest = "4bit" if cpu_4bit_available() else "int8"
+    if memory_available_gb is None:
+        # Without metrics, int8 is the safe middle ground
+        return "int8"
+    
+    if model_bytes:
+        for precision in ("float32", "int8", "4bit"):
+            if precision == "4bit" and smallest != "4bit":
+                break
+            if estimate_cpu_footprint_gb(model_bytes, precision) <= memory_available_gb:
+                return precision
+        logger.warning(
+            f"Model of {model_bytes / (1024 ** 3):.1f} GB too large for {memory_available_gb:.1f} GB "
+            f"available, even in {smallest}"
+        )
+        return smallest
+    
+    if memory_available_gb >= CPU_FLOAT32_MIN_MEMORY_GB:
+        return "float32"
+    if memory_available_gb >= CPU_INT8_MIN_MEMORY_GB:
+        return "int8"
+    return smallest
+
 def get_platform_info():
     """
     Get basic platform information when psutil is not available
@@ -1,31 +1,154 @@
-
 """
 Module for analyzing system memory and CPU resources
 """
-from .config import logger, PSUTIL_AVAILABLE
+import os
+import sys
+import time
+import threading
+from collections import deque
+from statistics import median
+from .config import logger, PSUTIL_AVAILABLE, RESOURCE_SAMPLE_INTERVAL, RESOURCE_SAMPLE_WINDOW
+
+def _gpu_memory():
+    """
+    GPU memory readings (GB) when torch is already loaded with CUDA; torch is
+    never imported here so sampling stays cheap
+    """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    try:
+        if not torch.cuda.is_available():
+            return None
+        free, total = torch.cuda.mem_get_info()
+        return {"gpu_memory_free_gb": free / (1024 ** 3), "gpu_memory_total_gb": total / (1024 ** 3)}
+    except Exception:
+        return None
+
+# Blocking CPU measurement for a first reading taken before the sampler has run
+FIRST_SAMPLE_CPU_INTERVAL = 0.1
+
+def _read_sample(cpu_interval=None):
+    """One reading of CPU, memory, load and GPU memory (non-blocking unless cpu_interval is given)"""
+    import psutil
+    
+    memory = psutil.virtual_memory()
+    sample = {
+        "time": time.time(),
+        # interval=None: usage since the previous call, no sleep
+        "cpu_percent": psutil.cpu_percent(interval=cpu_interval),
+        "memory_available_gb": memory.available / (1024 * 1024 * 1024),
+        "memory_percent": memory.percent,
+        "load_average": os.getloadavg()[0] if hasattr(os, "getloadavg") else None
+    }
+    gpu = _gpu_memory()
+    if gpu:
+        sample.update(gpu)
+    return sample
+
+class ResourceSampler:
+    """
+    Background thread keeping a rolling window of resource readings, so
+    request paths read a smoothed snapshot instantly instead of probing
+    """
+    
+    SMOOTHED_KEYS = ("cpu_percent", "memory_available_gb", "memory_percent", "load_average", "gpu_memory_free_gb")
+
+    def __init__(self, interval=RESOURCE_SAMPLE_INTERVAL, window=RESOURCE_SAMPLE_WINDOW):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling (no-op without psutil or when already running)"""
+        if not PSUTIL_AVAILABLE or (self._thread is not None and self._thread.is_alive()):
+            return
+        import psutil
+        psutil.cpu_percent(interval=None)  # Prime the CPU counters
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self, cpu_interval=None):
+        """Take one reading and add it to the window"""
+        try:
+            reading = _read_sample(cpu_interval)
+        except Exception as e:
+            logger.error(f"Error sampling system resources: {str(e)}")
+            return None
+        with self._lock:
+            self.samples.append(reading)
+        return reading
+
+    def snapshot(self):
+        """Latest reading plus the median of the window for each metric"""
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return None
+        
+        smoothed = {}
+        for key in self.SMOOTHED_KEYS:
+            values = [sample[key] for sample in samples if sample.get(key) is not None]
+            smoothed[key] = median(values) if values else None
+        return {
+            "latest": samples[-1],
+            "smoothed": smoothed,
+            "samples": len(samples),
+            "age_seconds": round(time.time() - samples[-1]["time"], 1)
+        }
+
+# Shared sampler, started with the application
+resource_sampler = ResourceSampler()
 
 def analyze_memory_cpu():
     """
-    Analyze memory and CPU usage
+    Analyze memory and CPU usage from the sampler's smoothed snapshot
     """
     resources = {
         "cpu_percent": None,
         "memory_available_gb": None,
         "memory_percent": None,
+        "cpu_count_physical": None,
+        "cpu_count_logical": os.cpu_count(),
     }
     
     if PSUTIL_AVAILABLE:
         try:
             import psutil
             
-            # Get CPU usage
-            resources["cpu_percent"] = psutil.cpu_percent(interval=0.5)
+            snapshot = resource_sampler.snapshot()
+            if snapshot is None:
+                # No reading yet: start the sampler and measure CPU over a short window,
+                # a non-blocking reading right after priming would cover almost no time
+                resource_sampler.start()
+                resource_sampler.sample(cpu_interval=FIRST_SAMPLE_CPU_INTERVAL)
+                snapshot = resource_sampler.snapshot()
             
-            # Get memory usage
-            memory = psutil.virtual_memory()
-            resources["memory_available_gb"] = memory.available / (1024 * 1024 * 1024)
-            resources["memory_percent"] = memory.percent
+            smoothed = snapshot["smoothed"]
+            resources["cpu_percent"] = smoothed["cpu_percent"]
+            resources["memory_available_gb"] = smoothed["memory_available_gb"]
+            resources["memory_percent"] = smoothed["memory_percent"]
+            resources["load_average"] = smoothed["load_average"]
+            if smoothed["gpu_memory_free_gb"] is not None:
+                resources["gpu_memory_free_gb"] = smoothed["gpu_memory_free_gb"]
             
+            # Get core counts (physical cores drive token generation throughput)
+            resources["cpu_count_physical"] = psutil.cpu_count(logical=False)
+            resources["cpu_count_logical"] = psutil.cpu_count(logical=True)
+        
         except Exception as e:
             logger.error(f"Error analyzing memory and CPU: {str(e)}")
     else:
@@ -0,0 +1,14 @@
+import pytest
+
+from server import cache_manager
+
+
+@pytest.fixture
+def cache_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_manager, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cache_manager._engine, "db_path", str(tmp_path / "response_cache.db"))
+    monkeypatch.setattr(cache_manager._maintenance, "start", lambda: None)
+    cache_manager.init_cache()
+    yield cache_manager._engine.connection()
+    cache_manager.close_cache()
+    cache_manager._memory_tier.clear()
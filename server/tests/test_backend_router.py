@@ -0,0 +1,26 @@
+from server.backend_router import BackendRouter
+
+
+def make_router():
+    router = BackendRouter()
+    router.register("ollama", 0)
+    router.register("huggingface", 1)
+    return router
+
+
+def test_unmeasured_backends_follow_priority():
+    router = make_router()
+    assert router.order(["huggingface", "ollama"]) == ["ollama", "huggingface"]
+
+
+def test_measured_backend_keeps_its_place_ahead_of_unmeasured():
+    router = make_router()
+    router.record_success("ollama", 0.8)
+    assert router.order(["ollama", "huggingface"]) == ["ollama", "huggingface"]
+
+
+def test_faster_measured_backend_goes_first():
+    router = make_router()
+    router.record_success("ollama", 2.0)
+    router.record_success("huggingface", 0.5)
+    assert router.order(["ollama", "huggingface"]) == ["huggingface", "ollama"]
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+
+import pytest
+
+from server import cache_manager
+
+
+@pytest.fixture
+def legacy_cache(tmp_path, monkeypatch):
+    """Cache sur une base créée sans auto_vacuum (avant la réduction progressive)"""
+    db_path = str(tmp_path / "response_cache.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE legacy (id INTEGER)")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(cache_manager, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cache_manager._engine, "db_path", db_path)
+    monkeypatch.setattr(cache_manager._maintenance, "start", lambda: None)
+    yield db_path
+    cache_manager.close_cache()
+    cache_manager._memory_tier.clear()
+
+
+def fill_and_evict():
+    payload = os.urandom(2048).hex()
+    for index in range(500):
+        cache_manager.update_cache(f"id-{index}", f"prompt {index}", "", "mistral", payload, 0.7, 0.9, 512)
+    cache_manager._engine.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    evictor = cache_manager._evictor
+    max_bytes, evictor.max_bytes = evictor.max_bytes, 1
+    try:
+        while evictor.step():
+            pass
+    finally:
+        evictor.max_bytes = max_bytes
+    cache_manager._engine.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def test_compact_cache_shrinks_file_after_eviction(legacy_cache):
+    cache_manager.init_cache()
+    assert cache_manager._engine.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    fill_and_evict()
+    size_before = os.path.getsize(legacy_cache)
+
+    assert cache_manager.compact_cache()
+
+    assert os.path.getsize(legacy_cache) < size_before / 4
+    assert cache_manager._engine.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_init_cache_compacts_legacy_database_when_enabled(legacy_cache, monkeypatch):
+    cache_manager.init_cache()
+    fill_and_evict()
+    size_before = os.path.getsize(legacy_cache)
+    cache_manager.close_cache()
+
+    monkeypatch.setattr(cache_manager, "CACHE_COMPACT_ON_START", True)
+    cache_manager.init_cache()
+
+    assert os.path.getsize(legacy_cache) < size_before / 4
+    assert cache_manager._engine.connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
@@ -0,0 +1,32 @@
+import sqlite3
+import threading
+
+from server.cache_manager import CacheEngine
+
+
+def test_connections_of_finished_threads_are_closed(tmp_path):
+    engine = CacheEngine(str(tmp_path / "engine.db"))
+    opened = []
+
+    def worker():
+        opened.append(engine.connection())
+
+    for _ in range(5):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+    # La connexion du thread principal élimine celles des threads terminés
+    engine.connection()
+
+    assert engine.open_connections() == 1
+    assert all(_is_closed(conn) for conn in opened)
+    engine.close_all()
+
+
+def _is_closed(conn):
+    try:
+        conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
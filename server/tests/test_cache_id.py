@@ -0,0 +1,17 @@
+from server.cache_manager import generate_cache_id
+
+
+def cache_id(prompt, system_prompt="Tu es un assistant."):
+    return generate_cache_id(prompt, system_prompt, "mistral", 0.7, 0.9, 512)
+
+
+def test_whitespace_and_unicode_form_share_an_id():
+    assert cache_id("Bonjour\r\nle monde  \n") == cache_id("Bonjour\nle monde")
+    assert cache_id("café") == cache_id("café")
+
+
+def test_case_and_punctuation_stay_significant():
+    assert cache_id("Foo") != cache_id("foo")
+    assert cache_id("5-3") != cache_id("5 3")
+    assert cache_id("C++") != cache_id("C")
+    assert cache_id("x", "Réponds en C++.") != cache_id("x", "Réponds en C.")
@@ -0,0 +1,34 @@
+from server import cache_manager
+
+
+def user_rows(conn):
+    return conn.execute("SELECT key, entries FROM cache_aggregates WHERE scope = 'user'").fetchall()
+
+
+def test_aggregate_rows_are_deleted_when_emptied(cache_db):
+    for user in range(50):
+        cache_manager.update_cache(f"id-{user}", "prompt", "", "mistral", "réponse", 0.7, 0.9, 512, f"user-{user}")
+    assert len(user_rows(cache_db)) == 50
+
+    cache_manager.purge_cache()
+
+    assert user_rows(cache_db) == []
+    assert cache_db.execute("SELECT COUNT(*) FROM cache_aggregates").fetchone()[0] == 0
+    assert cache_manager.get_cache_stats()["entries"] == 0
+
+
+def test_replacing_an_entry_keeps_one_row_per_key(cache_db):
+    cache_manager.update_cache("id", "prompt", "", "mistral", "première", 0.7, 0.9, 512, "alice")
+    cache_manager.update_cache("id", "prompt", "", "mistral", "seconde", 0.7, 0.9, 512, "bob")
+
+    assert user_rows(cache_db) == [("bob", 1)]
+
+
+def test_top_users_query_uses_scope_entries_index(cache_db):
+    plan = cache_db.execute(
+        "EXPLAIN QUERY PLAN SELECT key, entries, total_bytes FROM cache_aggregates "
+        "WHERE scope = 'user' AND key != '' AND entries > 0 ORDER BY entries DESC LIMIT 20"
+    ).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "idx_cache_aggregates_scope_entries" in details
+    assert "TEMP B-TREE" not in details
@@ -0,0 +1,39 @@
+import pytest
+
+from server import gguf_backend
+from server.gguf_backend import find_gguf_file
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    root = tmp_path / "models"
+    (root / "local").mkdir(parents=True)
+    (root / "local" / "tiny.Q4_K_M.gguf").write_bytes(b"GGUF")
+    (tmp_path / "outside.gguf").write_bytes(b"GGUF")
+    monkeypatch.setattr(gguf_backend, "MODELS_DIR", str(root))
+    return root
+
+
+def test_gguf_file_is_resolved_inside_models_dir(models_dir, tmp_path):
+    path = find_gguf_file("local/tiny.Q4_K_M.gguf", str(tmp_path / "hf"))
+    assert path == str((models_dir / "local" / "tiny.Q4_K_M.gguf").resolve())
+
+
+@pytest.mark.parametrize("name", [
+    "../outside.gguf",
+    "local/../../outside.gguf",
+    "..\\outside.gguf",
+    "/etc/outside.gguf",
+    "../models--org--repo-GGUF",
+])
+def test_paths_outside_models_dir_are_rejected(models_dir, tmp_path, name):
+    assert find_gguf_file(name, str(tmp_path / "hf")) is None
+
+
+def test_absolute_path_to_existing_file_is_rejected(models_dir, tmp_path):
+    assert find_gguf_file(str(tmp_path / "outside.gguf"), str(tmp_path / "hf")) is None
+
+
+def test_symlink_escaping_models_dir_is_rejected(models_dir, tmp_path):
+    (models_dir / "link.gguf").symlink_to(tmp_path / "outside.gguf")
+    assert find_gguf_file("link.gguf", str(tmp_path / "hf")) is None
@@ -0,0 +1,35 @@
+import json
+import threading
+import time
+
+from server import hardware_fingerprint
+
+
+def test_concurrent_callers_probe_and_write_once(tmp_path, monkeypatch):
+    path = tmp_path / "hardware_fingerprint.json"
+    monkeypatch.setattr(hardware_fingerprint, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(hardware_fingerprint, "FINGERPRINT_PATH", str(path))
+    monkeypatch.setattr(hardware_fingerprint, "_fingerprint", None)
+    probes = []
+
+    def probe_hardware():
+        probes.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return {"version": hardware_fingerprint.FINGERPRINT_VERSION, "boot_id": hardware_fingerprint.boot_id(),
+                "probed_at": time.time()}
+
+    monkeypatch.setattr(hardware_fingerprint, "probe_hardware", probe_hardware)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(hardware_fingerprint.get_hardware_fingerprint()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(probes) == 1
+    assert all(result is results[0] for result in results)
+    assert json.loads(path.read_text(encoding="utf-8"))["version"] == hardware_fingerprint.FINGERPRINT_VERSION
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from server import model_download
+from server.model_download import ChunkedDownloader, DownloadError, DownloadFile
+
+CHUNK_SIZE = 64 * 1024
+DATA = os.urandom(5 * CHUNK_SIZE + 1234)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class ShardHandler(BaseHTTPRequestHandler):
+    """Sert DATA avec ou sans plages d'octets, selon la configuration du serveur"""
+
+    def do_GET(self):
+        server = self.server
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        with server.lock:
+            server.requests.append(self.headers.get("Range"))
+            server.authorizations.append(self.headers.get("Authorization"))
+            truncate = match is not None and match.group(0) in server.truncate_once
+            if truncate:
+                server.truncate_once.discard(match.group(0))
+
+        if match and server.ranges:
+            start, end = int(match.group(1)), int(match.group(2))
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        if server.content_length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # Plage coupée en cours de route: la connexion se ferme avant la fin annoncée
+        self.wfile.write(body[:len(body) // 2] if truncate else body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def shard_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ShardHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.authorizations = []
+    server.truncate_once = set()
+    server.ranges = True
+    server.content_length = True
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/model.safetensors"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(model_download.time, "sleep", lambda seconds: None)
+
+
+def ranged_requests(server):
+    return sorted(r for r in server.requests if r and r != "bytes=0-0")
+
+
+def download(server, tmp_path, size=len(DATA), sha256=SHA256):
+    file = DownloadFile(server.url, str(tmp_path / "model.safetensors"), size, sha256)
+    ChunkedDownloader([file], workers=3, chunk_size=CHUNK_SIZE).run()
+    return file.path
+
+
+def test_file_is_split_into_byte_ranges(shard_server, tmp_path):
+    path = download(shard_server, tmp_path)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(ranged_requests(shard_server)) == 6
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_download_resumes_from_saved_ranges(shard_server, tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    with open(path + ".part", "wb") as f:
+        f.truncate(len(DATA))
+        f.write(DATA[:2 * CHUNK_SIZE])
+    with open(path + ".part.json", "w", encoding="utf-8") as f:
+        json.dump({"size": len(DATA), "chunks": 6, "done": [0, 1]}, f)
+
+    download(shard_server, tmp_path)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    requested = ranged_requests(shard_server)
+    assert len(requested) == 4
+    assert f"bytes=0-{CHUNK_SIZE - 1}" not in requested
+
+
+def test_truncated_range_is_retried(shard_server, tmp_path):
+    truncated = f"bytes={CHUNK_SIZE}-{2 * CHUNK_SIZE - 1}"
+    shard_server.truncate_once.add(truncated)
+
+    path = download(shard_server, tmp_path)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert ranged_requests(shard_server).count(truncated) == 2
+
+
+def test_checksum_mismatch_discards_the_file(shard_server, tmp_path):
+    with pytest.raises(DownloadError, match="SHA-256"):
+        download(shard_server, tmp_path, sha256="0" * 64)
+
+    path = tmp_path / "model.safetensors"
+    assert not path.exists()
+    assert not (tmp_path / "model.safetensors.part").exists()
+    assert not (tmp_path / "model.safetensors.part.json").exists()
+
+
+def test_server_without_range_support_streams_whole_file(shard_server, tmp_path):
+    shard_server.ranges = False
+
+    path = download(shard_server, tmp_path)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    # Sonde d'un octet, puis un seul flux complet
+    assert shard_server.requests == ["bytes=0-0", None]
+
+
+def test_unknown_size_without_content_length(shard_server, tmp_path):
+    shard_server.content_length = False
+
+    path = download(shard_server, tmp_path, size=None)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert shard_server.requests == [None]
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    """Redirige toute requête vers le serveur de fichiers (CDN sur une autre origine)"""
+
+    def do_GET(self):
+        self.server.authorizations.append(self.headers.get("Authorization"))
+        self.send_response(302)
+        self.send_header("Location", self.server.target)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_token_is_not_forwarded_to_another_origin(shard_server, tmp_path):
+    hub = ThreadingHTTPServer(("127.0.0.1", 0), RedirectHandler)
+    hub.authorizations = []
+    hub.target = shard_server.url
+    thread = threading.Thread(target=hub.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        file = DownloadFile(f"http://127.0.0.1:{hub.server_address[1]}/model.safetensors",
+                            str(tmp_path / "model.safetensors"), len(DATA), SHA256)
+        ChunkedDownloader([file], headers={"Authorization": "Bearer hf_secret"},
+                          chunk_size=CHUNK_SIZE).run()
+    finally:
+        hub.shutdown()
+
+    with open(file.path, "rb") as f:
+        assert f.read() == DATA
+    assert set(hub.authorizations) == {"Bearer hf_secret"}
+    assert set(shard_server.authorizations) == {None}
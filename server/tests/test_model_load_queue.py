@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from server import routes
+from server.local_inference import InferenceQueueFull, ModelLoadQueue
+from server.routes import GenerationInput, generate_text
+
+
+def test_concurrent_loads_of_one_model_run_once():
+    calls = []
+    release = threading.Event()
+
+    def load(name):
+        calls.append(name)
+        release.wait(5)
+        return f"modèle {name}"
+
+    async def scenario():
+        queue = ModelLoadQueue(max_pending=1)
+        waiters = [asyncio.ensure_future(queue.load("org/a", load, "org/a")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*waiters), queue.stats()
+
+    results, stats = asyncio.run(scenario())
+
+    assert results == ["modèle org/a"] * 3
+    assert calls == ["org/a"]
+    assert stats["coalesced"] == 2 and stats["pending"] == 0
+
+
+def test_distinct_loads_beyond_the_bound_are_rejected():
+    release = threading.Event()
+
+    async def scenario():
+        queue = ModelLoadQueue(max_pending=1)
+        first = asyncio.ensure_future(queue.load("org/a", release.wait, 5))
+        await asyncio.sleep(0)
+        with pytest.raises(InferenceQueueFull):
+            await queue.load("org/b", release.wait, 5)
+        release.set()
+        await first
+        # La place libérée, un autre modèle peut être chargé
+        assert await queue.load("org/b", lambda: "b") == "b"
+
+    asyncio.run(scenario())
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+def test_generate_returns_503_when_model_loads_are_saturated(cache_db, monkeypatch):
+    saturated = ModelLoadQueue(max_pending=0)
+    monkeypatch.setattr(routes, "model_loads", saturated)
+    monkeypatch.setattr(routes, "is_model_loaded", lambda: True)
+    monkeypatch.setattr(routes, "is_fallback_mode", lambda: False)
+    monkeypatch.setattr(routes, "get_local_model", lambda model_name=None: None)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(generate_text(GenerationInput(prompt="Bonjour", model="org/other"), ConnectedRequest()))
+
+    assert error.value.status_code == 503
+    assert "Retry-After" in error.value.headers
+    assert saturated.stats()["rejected"] == 1
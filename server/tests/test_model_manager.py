@@ -0,0 +1,70 @@
+import sys
+import types
+
+import pytest
+
+from server import model_manager
+from server.model_manager import ModelRegistry
+
+
+class FakeModel:
+    device = "cpu"
+
+    def memory_footprint(self):
+        return 1024
+
+
+@pytest.fixture
+def preload_state(monkeypatch):
+    """État de chargement isolé, préchargement activé, modèle GGUF factice"""
+    monkeypatch.setattr(model_manager, "MODEL_PRELOAD", True)
+    monkeypatch.setattr(model_manager, "_was_ready", False)
+    monkeypatch.setattr(model_manager, "_fallback_mode", False)
+    monkeypatch.setattr(model_manager, "_model_loaded", False)
+    monkeypatch.setattr(model_manager, "_default_model", "org/tiny-GGUF")
+    monkeypatch.setattr(model_manager, "_load_state", {
+        "stage": "not_loaded", "started_at": None, "finished_at": None, "error": None
+    })
+    monkeypatch.setattr(model_manager, "model_registry", ModelRegistry(budget_bytes=10 ** 9))
+    monkeypatch.setitem(sys.modules, "llama_cpp", types.ModuleType("llama_cpp"))
+    monkeypatch.setattr(model_manager, "analyze_system_resources", lambda: {"can_run_local_model": True})
+    monkeypatch.setattr(model_manager, "init_model_download", lambda model_name: None)
+    monkeypatch.setattr(model_manager, "_estimated_footprint", lambda model_name: 0)
+    monkeypatch.setattr(model_manager, "_load_weights", lambda name, resources: (FakeModel(), None, "gguf-Q4_K_M"))
+
+
+def test_ready_stays_true_through_reload_after_download(preload_state, monkeypatch):
+    # Démarrage: modèle absent, mode léger en attendant le téléchargement
+    monkeypatch.setattr(model_manager, "_is_model_available", lambda model_name: False)
+    model_manager.preload_model()
+    assert model_manager.get_load_state()["stage"] == "fallback"
+    assert model_manager.is_ready()
+
+    # Fin du téléchargement (download_model), puis rechargement à la première requête
+    monkeypatch.setattr(model_manager, "_is_model_available", lambda model_name: True)
+    model_manager.set_fallback_mode(False)
+    model_manager.reset_model_loaded()
+
+    readiness = []
+    set_stage = model_manager._set_stage
+    def tracking_set_stage(stage):
+        set_stage(stage)
+        readiness.append((stage, model_manager.is_ready()))
+    monkeypatch.setattr(model_manager, "_set_stage", tracking_set_stage)
+
+    assert model_manager.lazy_load_model()
+
+    assert readiness[-1] == ("loaded", True)
+    assert all(ready for _, ready in readiness)
+    assert model_manager.get_local_model() is not None
+
+
+def test_not_ready_until_preloaded_model_is_warmed_up(preload_state, monkeypatch):
+    monkeypatch.setattr(model_manager, "_is_model_available", lambda model_name: True)
+    readiness = []
+    monkeypatch.setattr("server.local_inference.warm_up", lambda *model: readiness.append(model_manager.is_ready()))
+
+    model_manager.preload_model()
+
+    assert readiness == [False]
+    assert model_manager.is_ready()
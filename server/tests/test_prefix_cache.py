@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+from server.local_inference import build_prompt, split_prefix_ids, split_prompt
+
+SYSTEM_PROMPT = "Tu es un assistant qui répond en français."
+PROMPTS = ["Bonjour", "Quelle est la capitale de la France ?", "résume ce document"]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    """Petit tokenizer BPE façon Llama: espaces encodés en '▁', ajouté en tête de texte"""
+    backend = Tokenizer(models.BPE(unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split("\n", "isolated"),
+        pre_tokenizers.Metaspace(prepend_scheme="first")
+    ])
+    backend.decoder = decoders.Metaspace(prepend_scheme="first")
+    corpus = [build_prompt(None, SYSTEM_PROMPT, prompt) for prompt in PROMPTS] * 20
+    trainer = trainers.BpeTrainer(vocab_size=300, special_tokens=["<unk>", "<s>", "</s>"])
+    backend.train_from_iterator(corpus, trainer)
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="<unk>", bos_token="<s>", eos_token="</s>", pad_token="</s>"
+    )
+
+
+def test_cached_input_ids_match_uncached_prompt(tokenizer):
+    prefix, _ = split_prompt(tokenizer, SYSTEM_PROMPT)
+    prompts = [build_prompt(tokenizer, SYSTEM_PROMPT, prompt) for prompt in PROMPTS]
+
+    split = split_prefix_ids(tokenizer, prefix, prompts)
+
+    assert split is not None
+    prefix_ids, suffixes = split
+    for prompt, suffix in zip(prompts, suffixes):
+        assert prefix_ids + suffix == tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+
+def test_separately_tokenized_suffix_differs(tokenizer):
+    """Tokeniser la suite seule ajoute un '▁' initial: d'où le découpage du prompt entier"""
+    prefix, tail = split_prompt(tokenizer, SYSTEM_PROMPT)
+    prompt = build_prompt(tokenizer, SYSTEM_PROMPT, PROMPTS[0])
+    naive = (
+        tokenizer(prefix, add_special_tokens=False)["input_ids"]
+        + tokenizer(PROMPTS[0] + tail, add_special_tokens=False)["input_ids"]
+    )
+    assert naive != tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+
+def test_boundary_merge_skips_the_cache(tokenizer):
+    # Le préfixe se termine au milieu d'un mot, fusionné dans le prompt entier
+    prompt = build_prompt(tokenizer, SYSTEM_PROMPT, PROMPTS[0])
+    assert split_prefix_ids(tokenizer, prompt[:-6], [prompt]) is None
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from server import cache_manager, routes
+from server.routes import GenerationInput, generate_text
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+@pytest.fixture
+def fallback_mode(cache_db, monkeypatch):
+    """Serveur en mode léger: les API externes répondent avec leur propre modèle"""
+    async def fallback_generate(input_data):
+        return {"generated_text": "réponse de mistral"}
+
+    monkeypatch.setattr(routes, "is_model_loaded", lambda: True)
+    monkeypatch.setattr(routes, "is_fallback_mode", lambda: True)
+    monkeypatch.setattr(routes, "get_local_model", lambda model_name=None: None)
+    monkeypatch.setattr(routes, "get_default_model", lambda: "org/default-model")
+    monkeypatch.setattr(routes, "fallback_generate", fallback_generate)
+
+
+def generate(**fields):
+    input_data = GenerationInput(prompt="Bonjour", **fields)
+    return asyncio.run(generate_text(input_data, ConnectedRequest()))
+
+
+def cached_models(conn):
+    return [row[0] for row in conn.execute("SELECT model FROM response_cache")]
+
+
+def test_explicit_model_is_not_served_by_fallback(fallback_mode, cache_db):
+    with pytest.raises(HTTPException) as error:
+        generate(model="org/other-model")
+
+    assert error.value.status_code == 404
+    assert cached_models(cache_db) == []
+
+
+def test_fallback_output_is_not_cached_under_the_local_model(fallback_mode, cache_db):
+    assert generate() == {"generated_text": "réponse de mistral"}
+
+    assert cached_models(cache_db) == [routes.FALLBACK_CACHE_MODEL]
+    defaults = GenerationInput(prompt="Bonjour")
+    local_id = cache_manager.generate_cache_id(
+        defaults.prompt, defaults.system_prompt, "org/default-model",
+        defaults.temperature, defaults.top_p, defaults.max_length
+    )
+    assert cache_manager.check_cache(local_id) is None
+
+
+async def collect_events(input_data):
+    response = await routes.generate_text_stream(input_data, ConnectedRequest())
+    return [event async for event in response.body_iterator]
+
+
+@pytest.fixture
+def ollama_down(monkeypatch):
+    async def stream_generate(input_data):
+        raise ConnectionError("Ollama indisponible")
+        yield
+
+    monkeypatch.setattr(routes, "stream_generate", stream_generate)
+
+
+def test_stream_fallback_error_result_ends_with_error_event(fallback_mode, ollama_down, monkeypatch):
+    async def fallback_generate(input_data):
+        return {"generated_text": "Désolé", "error": "all_backends_failed"}
+
+    monkeypatch.setattr(routes, "fallback_generate", fallback_generate)
+    events = asyncio.run(collect_events(GenerationInput(prompt="Bonjour")))
+
+    assert len(events) == 1
+    assert events[0].startswith("event: error\n")
+    assert "all_backends_failed" in events[0]
+
+
+def test_stream_fallback_exception_ends_with_error_event(fallback_mode, ollama_down, monkeypatch):
+    async def fallback_generate(input_data):
+        raise routes.InferenceQueueFull(2)
+
+    monkeypatch.setattr(routes, "fallback_generate", fallback_generate)
+    events = asyncio.run(collect_events(GenerationInput(prompt="Bonjour")))
+
+    assert len(events) == 1
+    assert events[0].startswith("event: error\n")
+
+
+def test_generate_rejects_overlong_prompt_before_generation(cache_db, monkeypatch):
+    def unexpected(*args):
+        raise AssertionError("aucune génération attendue")
+
+    monkeypatch.setattr(routes, "get_local_model", unexpected)
+    monkeypatch.setattr(routes, "run_in_worker", unexpected)
+    input_data = GenerationInput(prompt="x" * 10001)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(generate_text(input_data, ConnectedRequest()))
+
+    assert error.value.status_code == 400
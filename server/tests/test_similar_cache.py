@@ -0,0 +1,34 @@
+from server import cache_manager
+from server.cache_manager import check_cache, find_similar_cache, generate_cache_id, update_cache
+
+PARAMS = ("Tu es un assistant.", "mistral", 0.1, 0.9, 512)
+
+
+def lookup(prompt):
+    """Comme /generate: recherche exacte puis approchée, un seul événement compté"""
+    response = check_cache(generate_cache_id(prompt, *PARAMS), record_miss=False)
+    if response is None:
+        response = find_similar_cache(prompt, *PARAMS, record_miss=True)
+    return response
+
+
+def test_similar_hit_counts_one_event(cache_db, monkeypatch):
+    monkeypatch.setattr(cache_manager, "CACHE_SIMILAR_ENABLED", True)
+    stored_id = generate_cache_id("Quelle est la capitale de la France ?", *PARAMS)
+    update_cache(stored_id, "Quelle est la capitale de la France ?", *PARAMS[:2], "Paris", *PARAMS[2:])
+    cache_manager._counters.flush()
+
+    assert lookup("quelle est la capitale de la france") == "Paris"
+
+    pending = cache_manager._counters.pending()
+    assert (pending["hits"], pending["misses"], pending["similar_hits"]) == (0, 0, 1)
+    assert cache_manager._counters._accesses[stored_id][0] == 1
+
+
+def test_lookup_without_match_counts_one_miss(cache_db, monkeypatch):
+    monkeypatch.setattr(cache_manager, "CACHE_SIMILAR_ENABLED", True)
+
+    assert lookup("aucune entrée proche") is None
+
+    pending = cache_manager._counters.pending()
+    assert (pending["hits"], pending["misses"], pending["similar_hits"]) == (0, 1, 0)
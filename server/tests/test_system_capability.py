@@ -0,0 +1,47 @@
+import pytest
+
+from server import system_capability
+from server.system_capability import choose_cpu_precision
+
+GB = 1024 ** 3
+MODEL_7B = 14 * GB  # Checkpoint float16 de 7 milliards de paramètres
+
+
+@pytest.fixture(autouse=True)
+def auto_precision(monkeypatch):
+    monkeypatch.setattr(system_capability, "MODEL_CPU_PRECISION", "auto")
+
+
+@pytest.fixture
+def no_cpu_4bit(monkeypatch):
+    monkeypatch.setattr(system_capability, "cpu_4bit_available", lambda: False)
+
+
+@pytest.fixture
+def cpu_4bit(monkeypatch):
+    monkeypatch.setattr(system_capability, "cpu_4bit_available", lambda: True)
+
+
+def test_small_model_stays_float32_on_modest_memory(no_cpu_4bit):
+    assert choose_cpu_precision(8, 1 * GB) == "float32"
+
+
+def test_large_model_uses_int8_when_float32_does_not_fit(no_cpu_4bit):
+    assert choose_cpu_precision(16, MODEL_7B) == "int8"
+
+
+def test_4bit_is_not_offered_without_cpu_backend(no_cpu_4bit):
+    assert choose_cpu_precision(6, MODEL_7B) == "int8"
+    assert choose_cpu_precision(6) == "int8"
+
+
+def test_4bit_is_chosen_when_available_and_needed(cpu_4bit):
+    assert choose_cpu_precision(6, MODEL_7B) == "4bit"
+
+
+def test_pinned_bitsandbytes_has_no_cpu_4bit(monkeypatch):
+    monkeypatch.setattr(system_capability, "_cpu_4bit_available", None)
+    monkeypatch.setattr(system_capability.importlib.util, "find_spec", lambda name: object())
+    monkeypatch.setattr("importlib.metadata.version", lambda name: "0.41.1")
+
+    assert not system_capability.cpu_4bit_available()
@@ -0,0 +1,28 @@
+import psutil
+import pytest
+
+from server import system_resources
+from server.system_resources import ResourceSampler, analyze_memory_cpu
+
+
+@pytest.fixture
+def sampler(monkeypatch):
+    sampler = ResourceSampler(interval=60)
+    monkeypatch.setattr(system_resources, "resource_sampler", sampler)
+    yield sampler
+    sampler.stop()
+
+
+def test_first_reading_measures_cpu_over_a_blocking_window(sampler, monkeypatch):
+    intervals = []
+
+    def cpu_percent(interval=None, percpu=False):
+        intervals.append(interval)
+        return 42.0 if interval else 0.0
+
+    monkeypatch.setattr(psutil, "cpu_percent", cpu_percent)
+
+    resources = analyze_memory_cpu()
+
+    assert resources["cpu_percent"] == 42.0
+    assert intervals[-1] == system_resources.FIRST_SAMPLE_CPU_INTERVAL